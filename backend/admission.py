@@ -0,0 +1,90 @@
+import math
+import time
+import asyncio
+
+
+class Overloaded(Exception):
+    """
+    Request bị từ chối vì server quá tải (status_code 429 hoặc 503, retry_after tính bằng giây).
+    """
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Giới hạn số request xử lý đồng thời, các request vượt giới hạn chờ trong hàng đợi có giới hạn.
+    - Hàng đợi đầy: từ chối ngay với 429.
+    - Chờ quá queue_timeout giây: từ chối với 503.
+    Retry-After ước lượng từ thời gian xử lý trung bình gần đây và độ dài hàng đợi.
+    """
+
+    def __init__(self, max_concurrent=32, max_queue=64, queue_timeout=5.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self._avg_seconds = 1.0  # EWMA thời gian xử lý một request
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def retry_after(self):
+        backlog = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(backlog * self._avg_seconds))
+
+    async def acquire(self):
+        """
+        Chờ tới lượt xử lý. Returns: hàm release (gọi nhiều lần cũng chỉ nhả một lần).
+        Raises: Overloaded nếu hàng đợi đầy hoặc chờ quá lâu.
+        """
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise Overloaded(429, self.retry_after(), "queue_full")
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                self.rejected_timeout += 1
+                raise Overloaded(503, self.retry_after(), "queue_timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted += 1
+        start = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.in_flight -= 1
+            self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * (time.perf_counter() - start)
+            self._semaphore.release()
+
+        return release
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_seconds": round(self._avg_seconds, 3),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
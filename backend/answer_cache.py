@@ -0,0 +1,125 @@
+import time
+import hashlib
+import threading
+import numpy as np
+from intent_classifier import normalize_query
+
+
+class _Partition:
+    """
+    Các câu trả lời của một model: ma trận embedding (đã chuẩn hóa) dạng vòng tròn
+    + chỉ mục hash cho trường hợp trùng khớp chính xác.
+    """
+
+    def __init__(self, capacity, dimensions):
+        self.matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)  # 0 = ô trống
+        self.keys = [None] * capacity
+        self.values = [None] * capacity
+        self.exact = {}  # hash câu hỏi -> vị trí
+        self.next_slot = 0
+
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời theo độ tương đồng embedding của câu hỏi, chia theo model_name.
+    Tra cứu: hash câu hỏi đã chuẩn hóa trước, sau đó cosine ≥ threshold.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query):
+        return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def lookup(self, query, vector, model_name):
+        """
+        Tìm câu trả lời đã lưu cho câu hỏi (hoặc câu hỏi gần giống).
+        Returns:
+            tuple: (câu trả lời, tài liệu) hoặc None nếu không có.
+        """
+        now = time.time()
+        with self._lock:
+            partition = self._partitions.get(model_name)
+            if partition is None:
+                self.misses += 1
+                return None
+
+            slot = partition.exact.get(self._key(query))
+            if slot is not None and partition.expires_at[slot] > now:
+                self.exact_hits += 1
+                return partition.values[slot]
+
+            similarities = partition.matrix @ self._normalize(vector)
+            similarities[partition.expires_at <= now] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.semantic_hits += 1
+                return partition.values[best]
+
+            self.misses += 1
+            return None
+
+    def store(self, query, vector, model_name, response, documents):
+        vector = self._normalize(vector)
+        key = self._key(query)
+        with self._lock:
+            partition = self._partitions.get(model_name)
+            if partition is None:
+                partition = _Partition(self.max_entries, vector.shape[0])
+                self._partitions[model_name] = partition
+
+            slot = partition.exact.get(key)
+            if slot is None:
+                slot = partition.next_slot
+                partition.next_slot = (slot + 1) % self.max_entries
+                old_key = partition.keys[slot]
+                if old_key is not None:
+                    partition.exact.pop(old_key, None)
+
+            partition.matrix[slot] = vector
+            partition.expires_at[slot] = time.time() + self.ttl
+            partition.keys[slot] = key
+            partition.values[slot] = (response, documents)
+            partition.exact[key] = slot
+
+    def invalidate(self, model_name=None):
+        """
+        Xóa cache của một model (hoặc toàn bộ nếu model_name là None).
+        """
+        with self._lock:
+            if model_name is None:
+                self._partitions.clear()
+            else:
+                self._partitions.pop(model_name, None)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            entries = {
+                model: int((partition.expires_at > now).sum())
+                for model, partition in self._partitions.items()
+            }
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "entries": entries,
+        }
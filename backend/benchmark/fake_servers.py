@@ -0,0 +1,313 @@
+"""
+Server giả lập cho benchmark (không tốn tiền gọi dịch vụ cloud):
+- OpenAI-compatible /chat/completions (cả stream SSE)
+- Jina-compatible /v1/embeddings
+- Elasticsearch _search / _msearch
+Mỗi server có phân phối độ trễ cấu hình được và ghi lại thời gian xử lý theo stage.
+"""
+import os
+import json
+import time
+import zlib
+import socket
+import asyncio
+import threading
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PLACES = [
+    "Eo Gió", "Kỳ Co", "Tháp Đôi", "Ghềnh Ráng", "Hầm Hô", "Bãi Xép", "Cù Lao Xanh",
+    "Tháp Bánh Ít", "Đầm Thị Nại", "Bảo tàng Quang Trung", "Hòn Khô", "Nhơn Hải",
+]
+ANSWER_WORDS = (
+    "**Bình Định** có nhiều địa điểm đẹp. - Bạn nên ghé tham quan vào buổi sáng sớm, "
+    "thưởng thức hải sản tươi và chụp ảnh hoàng hôn trên biển."
+).split(" ")
+
+
+class LatencyDistribution:
+    """
+    Phân phối độ trễ (mili-giây) từ chuỗi cấu hình:
+    "fixed:50", "uniform:20,80", "normal:50,10" (trung bình, độ lệch), "lognormal:50,0.5" (trung vị, sigma).
+    """
+
+    def __init__(self, spec, seed=None):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")] if params else [0.0]
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Lấy một mẫu độ trễ (giây).
+        """
+        with self._lock:
+            if self.kind == "fixed":
+                ms = self.params[0]
+            elif self.kind == "uniform":
+                ms = self._rng.uniform(self.params[0], self.params[1])
+            elif self.kind == "normal":
+                ms = self._rng.normal(self.params[0], self.params[1])
+            elif self.kind == "lognormal":
+                ms = self.params[0] * float(np.exp(self._rng.normal(0.0, self.params[1])))
+            else:
+                raise ValueError(f"Phân phối độ trễ không hợp lệ: {self.spec}")
+        return max(ms, 0.0) / 1000
+
+
+def percentiles(values):
+    """
+    p50/p95/p99/mean/max (mili-giây) của danh sách thời gian (giây).
+    """
+    if not values:
+        return {"count": 0}
+    ms = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "mean": round(float(ms.mean()), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+
+class StageRecorder:
+    """
+    Ghi thời gian xử lý của các server giả lập theo stage (embed, search, llm, ...).
+    """
+
+    def __init__(self):
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(duration)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+
+    def summary(self):
+        with self._lock:
+            return {stage: percentiles(durations) for stage, durations in self._durations.items()}
+
+
+def fake_embedding(text, dimensions):
+    """
+    Vector cố định theo nội dung văn bản (cùng văn bản → cùng vector).
+    """
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    vector = rng.standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_corpus(size):
+    corpus = []
+    for i in range(size):
+        place = PLACES[i % len(PLACES)]
+        content = f"{place} là điểm du lịch nổi tiếng của Bình Định. " * 8
+        corpus.append({
+            "_id": f"doc-{i}",
+            "_source": {
+                "title": f"{place} #{i}",
+                "content": content.strip(),
+                "link": f"https://example.com/{i}",
+                "text": f"{place} {content}".lower(),
+                "token_count": 120,
+            },
+        })
+    return corpus
+
+
+def create_jina_app(latency, recorder):
+    app = FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        start = time.perf_counter()
+        await asyncio.sleep(latency.sample())
+        dimensions = body.get("dimensions", 384)
+        data = [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+            for i, text in enumerate(body["input"])
+        ]
+        recorder.record("embed", time.perf_counter() - start)
+        return {"model": body.get("model"), "object": "list", "data": data,
+                "usage": {"total_tokens": len(body["input"])}}
+
+    return app
+
+
+def create_es_app(latency, recorder, corpus_size=200):
+    app = FastAPI()
+    corpus = make_corpus(corpus_size)
+    # Như index thật: _source có embedding (chỉ trả về khi truy vấn yêu cầu trường này)
+    for doc in corpus:
+        doc["_source"]["embedding"] = fake_embedding(doc["_source"]["text"], 384)
+    headers = {"X-Elastic-Product": "Elasticsearch"}
+
+    def search_hits(body):
+        size = body.get("size", 10)
+        offset = zlib.crc32(json.dumps(body.get("query", body.get("knn", {})), ensure_ascii=False)[:200].encode("utf-8"))
+        includes = body.get("_source")
+        hits = []
+        for i in range(min(size, len(corpus))):
+            doc = corpus[(offset + i) % len(corpus)]
+            if isinstance(includes, list):
+                doc = {**doc, "_source": {key: value for key, value in doc["_source"].items() if key in includes}}
+            hits.append({**doc, "_score": float(size - i)})
+        return hits
+
+    def search_response(body):
+        hits = search_hits(body)
+        return {"took": 1, "timed_out": False, "hits": {"total": {"value": len(hits), "relation": "eq"},
+                                                      "max_score": hits[0]["_score"] if hits else None, "hits": hits}}
+
+    @app.get("/")
+    async def info():
+        return JSONResponse({"version": {"number": "8.15.0"}, "tagline": "You Know, for Search"}, headers=headers)
+
+    @app.post("/{index}/_search")
+    async def search(index: str, request: Request):
+        body = await request.json()
+        start = time.perf_counter()
+        await asyncio.sleep(latency.sample())
+        recorder.record("search", time.perf_counter() - start)
+        return JSONResponse(search_response(body), headers=headers)
+
+    @app.post("/_msearch")
+    async def msearch(request: Request):
+        lines = [json.loads(line) for line in (await request.body()).decode("utf-8").splitlines() if line.strip()]
+        start = time.perf_counter()
+        await asyncio.sleep(latency.sample())
+        responses = [search_response(body) for body in lines[1::2]]
+        recorder.record("search", time.perf_counter() - start)
+        return JSONResponse({"took": 1, "responses": responses}, headers=headers)
+
+    return app
+
+
+def create_openai_app(latency, ttft_latency, token_latency, recorder, answer_tokens=60):
+    """
+    Args:
+        latency: Độ trễ của lời gọi không stream (toàn bộ câu trả lời).
+        ttft_latency: Độ trễ đến token đầu tiên khi stream.
+        token_latency: Độ trễ giữa các token khi stream.
+        answer_tokens (int): Số "token" (từ) của câu trả lời.
+    """
+    app = FastAPI()
+    answer = [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(answer_tokens)]
+    seen_prefixes = set()
+
+    def usage(body, content):
+        # Giả lập prefix cache của provider: system message đầu tiên đã gặp thì tính là cached (~4 ký tự/token)
+        messages = body.get("messages") or []
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        cached_tokens = 0
+        if messages and messages[0].get("role") == "system":
+            prefix = messages[0].get("content") or ""
+            if prefix in seen_prefixes:
+                cached_tokens = len(prefix) // 4
+            seen_prefixes.add(prefix)
+        completion_tokens = len(content.split(" "))
+        return {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def completion(body, content):
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(body, content),
+        }
+
+    def chunk(body, delta, finish_reason=None):
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    async def stream(body):
+        start = time.perf_counter()
+        await asyncio.sleep(ttft_latency.sample())
+        recorder.record("llm_ttft", time.perf_counter() - start)
+        for i, word in enumerate(answer):
+            if i:
+                await asyncio.sleep(token_latency.sample())
+            yield f"data: {json.dumps(chunk(body, {'content': word + ' '}), ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps(chunk(body, {}, 'stop'))}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            last = {**chunk(body, {}), "choices": [], "usage": usage(body, " ".join(answer))}
+            yield f"data: {json.dumps(last)}\n\n"
+        yield "data: [DONE]\n\n"
+        recorder.record("llm", time.perf_counter() - start)
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        # Lời gọi phân loại intent (max_tokens nhỏ) trả về nhãn
+        if (body.get("max_tokens") or 0) <= 5:
+            start = time.perf_counter()
+            await asyncio.sleep(latency.sample() / 4)
+            recorder.record("llm_classify", time.perf_counter() - start)
+            return completion(body, "related")
+        if body.get("stream"):
+            return StreamingResponse(stream(body), media_type="text/event-stream")
+        start = time.perf_counter()
+        await asyncio.sleep(latency.sample())
+        recorder.record("llm", time.perf_counter() - start)
+        return completion(body, " ".join(answer))
+
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port=None):
+    """
+    Chạy app trong thread nền (daemon), trả về (url, server). Dừng bằng stop_server.
+    """
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    server.thread = thread
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
+
+
+def stop_server(server):
+    server.should_exit = True
+    server.thread.join()
+
+
+def write_snapshot(out_dir, corpus_size=200, dimensions=384):
+    """
+    Ghi corpus giả lập thành snapshot cho InMemoryRetriever (thay cho server Elasticsearch giả).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = make_corpus(corpus_size)
+    with open(os.path.join(out_dir, "docs.jsonl"), "w", encoding="utf-8") as f:
+        for doc in corpus:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    vectors = np.array([fake_embedding(doc["_source"]["text"], dimensions) for doc in corpus], dtype=np.float32)
+    vectors.tofile(os.path.join(out_dir, "embeddings.f32"))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"index": "benchmark", "count": corpus_size, "dimensions": dimensions}, f)
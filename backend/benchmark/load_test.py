@@ -0,0 +1,282 @@
+"""
+Load test cho main.app với server giả lập thay cho Elasticsearch, OpenAI và Jina.
+Chạy app bằng uvicorn trong cùng tiến trình (gọi qua HTTP loopback để đo được stream), phát lại bộ câu hỏi với số request đồng thời
+cố định (--concurrency) hoặc tốc độ cố định (--rps), xuất kết quả dạng JSON để so sánh giữa các lần chạy.
+
+Ví dụ (chạy trong thư mục backend):
+    python -m benchmark.load_test --requests 200 --concurrency 16 --out bench_chat.json
+    python -m benchmark.load_test --endpoint /chat/stream --rps 20 --llm-ttft lognormal:300,0.4
+    python -m benchmark.load_test --retriever memory --embed fixed:15
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import platform
+import httpx
+from benchmark.fake_servers import (
+    LatencyDistribution, StageRecorder, percentiles, start_server, stop_server, write_snapshot,
+    create_es_app, create_jina_app, create_openai_app,
+)
+
+QUERIES_PATH = os.path.join(os.path.dirname(__file__), "queries.txt")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark /chat với server giả lập.")
+    parser.add_argument("--endpoint", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=0, help="Tốc độ cố định (open loop), 0 = dùng --concurrency")
+    parser.add_argument("--retriever", default="elasticsearch", choices=["elasticsearch", "memory"])
+    parser.add_argument("--corpus-size", type=int, default=200)
+    parser.add_argument("--embed", default="lognormal:40,0.3", help="Độ trễ Jina")
+    parser.add_argument("--search", default="lognormal:30,0.3", help="Độ trễ Elasticsearch")
+    parser.add_argument("--llm", default="lognormal:800,0.3", help="Độ trễ OpenAI (không stream)")
+    parser.add_argument("--llm-ttft", default="lognormal:300,0.3", help="Độ trễ đến token đầu tiên (stream)")
+    parser.add_argument("--llm-token", default="fixed:5", help="Độ trễ giữa các token (stream)")
+    parser.add_argument("--answer-cache", action="store_true", help="Bật cache câu trả lời")
+    parser.add_argument("--rerank", action="store_true", help="Bật rerank tập ứng viên rộng (adaptive k)")
+    parser.add_argument("--compression", default="off", choices=["off", "lexical", "embedding"],
+                        help="Rút gọn context theo câu hỏi")
+    parser.add_argument("--hedging", action="store_true",
+                        help="Gọi thêm model dự phòng khi LLM chậm hơn p95 quan sát được")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="File JSON kết quả (mặc định in ra stdout)")
+    return parser.parse_args()
+
+
+def start_fake_servers(args, recorder):
+    """
+    Khởi động các server giả lập và trỏ biến môi trường của backend tới chúng (trước khi import main).
+    """
+    jina_url, _ = start_server(create_jina_app(LatencyDistribution(args.embed, args.seed), recorder))
+    llm_url, _ = start_server(create_openai_app(
+        LatencyDistribution(args.llm, args.seed + 1),
+        LatencyDistribution(args.llm_ttft, args.seed + 2),
+        LatencyDistribution(args.llm_token, args.seed + 3),
+        recorder,
+    ))
+    os.environ.update({
+        "EMBEDDING_PROVIDER": "jina",
+        "JINA_API_KEY": "benchmark",
+        "JINA_API_URL": f"{jina_url}/v1/embeddings",
+        "GITHUB_TOKEN": "benchmark",
+        "LLM_ENDPOINT": llm_url,
+        "EMBEDDING_CACHE_PATH": "",
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "RERANK": "true" if args.rerank else "false",
+        "CONTEXT_COMPRESSION": args.compression,
+        "LLM_HEDGING": "true" if args.hedging else "false",
+        "RETRIEVER_BACKEND": args.retriever,
+    })
+    if args.retriever == "memory":
+        snapshot_dir = tempfile.mkdtemp(prefix="benchmark-snapshot-")
+        write_snapshot(snapshot_dir, args.corpus_size)
+        os.environ["SNAPSHOT_DIR"] = snapshot_dir
+        # Client Elasticsearch vẫn được tạo khi import nhưng không bao giờ được gọi
+        os.environ.setdefault("ELASTICSEARCH_URL", "http://127.0.0.1:9200")
+    else:
+        es_url, _ = start_server(create_es_app(LatencyDistribution(args.search, args.seed + 4), recorder, args.corpus_size))
+        os.environ["ELASTICSEARCH_URL"] = es_url
+        os.environ.pop("ELASTICSEARCH_API_KEY", None)
+
+
+async def send_request(client, endpoint, query):
+    """
+    Gửi một request, trả về dict kết quả (latency, ttft, ok).
+    """
+    start = time.perf_counter()
+    result = {"ok": False, "ttft": None}
+    try:
+        if endpoint == "/chat/stream":
+            async with client.stream("POST", endpoint, json={"query": query, "history": []}) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                        if event == "token" and result["ttft"] is None:
+                            result["ttft"] = time.perf_counter() - start
+                        elif event == "done":
+                            result["ok"] = response.status_code == 200
+                    elif line.startswith("data: ") and event == "done" and result["ttft"] is None:
+                        # Câu trả lời từ cache hoặc không qua LLM: cả câu trả lời đến cùng lúc
+                        result["ttft"] = time.perf_counter() - start
+        else:
+            response = await client.post(endpoint, json={"query": query, "history": []})
+            result["ok"] = response.status_code == 200 and not response.json().get("error")
+    except Exception as e:
+        result["exception"] = type(e).__name__
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def run_closed_loop(client, endpoint, queries, total, concurrency):
+    results = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            results.append(await send_request(client, endpoint, queries[i % len(queries)]))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(client, endpoint, queries, total, rps):
+    start = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        delay = start + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_request(client, endpoint, queries[i % len(queries)])))
+    return await asyncio.gather(*tasks)
+
+
+def histogram_totals(histogram, label=None):
+    """
+    (tổng, số lần) theo giá trị nhãn `label` của một histogram của backend.
+    """
+    totals = {}
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            key = sample.labels.get(label) if label else "all"
+            if sample.name.endswith("_sum"):
+                totals.setdefault(key, [0.0, 0])[0] = sample.value
+            elif sample.name.endswith("_count"):
+                totals.setdefault(key, [0.0, 0])[1] = int(sample.value)
+    return totals
+
+
+def app_stage_totals():
+    """
+    (tổng thời gian, số lần) của từng stage trong histogram chatbot_stage_seconds của backend.
+    """
+    from metrics import STAGE_SECONDS
+    return histogram_totals(STAGE_SECONDS, "stage")
+
+
+def prompt_totals():
+    """
+    (tổng, số lần) của số token prompt và số token/số tài liệu context (theo cách chọn tài liệu).
+    """
+    from metrics import PROMPT_TOKENS, CONTEXT_TOKENS, CONTEXT_DOCUMENTS
+    return {
+        "prompt_tokens": histogram_totals(PROMPT_TOKENS),
+        "context_tokens": histogram_totals(CONTEXT_TOKENS, "selection"),
+        "context_documents": histogram_totals(CONTEXT_DOCUMENTS, "selection"),
+    }
+
+
+def histogram_means(before, after, scale=1.0):
+    means = {}
+    for key, (total, count) in after.items():
+        total_before, count_before = before.get(key, (0.0, 0))
+        if count > count_before:
+            means[key] = {
+                "count": count - count_before,
+                "mean": round((total - total_before) / (count - count_before) * scale, 2),
+            }
+    return means
+
+
+def llm_token_totals():
+    """
+    Tổng token vào/ra và token prompt trúng prefix cache của provider (theo metric của backend).
+    """
+    from metrics import LLM_TOKENS, LLM_CACHED_TOKENS
+    totals = {}
+    for metric in (LLM_TOKENS, LLM_CACHED_TOKENS):
+        for family in metric.collect():
+            for sample in family.samples:
+                if sample.name.endswith("_total"):
+                    totals[sample.labels.get("direction", "cached")] = sample.value
+    return totals
+
+
+def app_stage_breakdown(before, after):
+    return histogram_means(before, after, scale=1000)
+
+
+async def run(args, recorder, app_url):
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(base_url=app_url, timeout=120, limits=limits, trust_env=False) as client:
+        for query in queries[:args.warmup]:
+            await send_request(client, args.endpoint, query)
+        recorder.reset()
+        stages_before = app_stage_totals()
+        tokens_before = llm_token_totals()
+        prompt_before = prompt_totals()
+
+        start = time.perf_counter()
+        if args.rps > 0:
+            results = await run_open_loop(client, args.endpoint, queries, args.requests, args.rps)
+        else:
+            results = await run_closed_loop(client, args.endpoint, queries, args.requests, args.concurrency)
+        duration = time.perf_counter() - start
+        stages_after = app_stage_totals()
+        tokens_after = llm_token_totals()
+        prompt_after = prompt_totals()
+
+    ok = [r for r in results if r["ok"]]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 2) if duration else 0.0,
+        "latency_ms": percentiles([r["latency"] for r in ok]),
+        "ttft_ms": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "app_stages_ms": app_stage_breakdown(stages_before, stages_after),
+        "upstream_stages_ms": recorder.summary(),
+        "llm_tokens": {key: int(value - tokens_before.get(key, 0)) for key, value in tokens_after.items()},
+        "prompt": {name: histogram_means(prompt_before[name], totals) for name, totals in prompt_after.items()},
+    }
+
+
+def collect_app_stats(main):
+    return {
+        "intent": main.local_classifier.stats(),
+        "embedding_cache": main.embedding_cache.stats(),
+        "embedding_batch": main.embedding_batcher.stats(),
+        "answer_cache": main.answer_cache.stats(),
+        "model_router": main.model_router.stats(),
+    }
+
+
+def main():
+    args = parse_args()
+    recorder = StageRecorder()
+    start_fake_servers(args, recorder)
+    # Log của backend ra stderr để stdout chỉ chứa JSON kết quả
+    with contextlib.redirect_stdout(sys.stderr):
+        import main as backend
+        app_url, app_server = start_server(backend.app)
+        try:
+            report = asyncio.run(run(args, recorder, app_url))
+            report["app_stats"] = collect_app_stats(backend)
+        finally:
+            stop_server(app_server)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Đã ghi kết quả vào {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
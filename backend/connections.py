@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Cấu hình connection pool dùng chung cho Jina, OpenAI và Elasticsearch
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25"))
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+
+# HTTP/2 (một kết nối, nhiều request song song) cần gói h2: pip install "httpx[http2]"
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"
+if HTTP2:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("⚠️ HTTP2=true nhưng chưa cài gói h2, dùng HTTP/1.1")
+        HTTP2 = False
+
+
+def _timeout(read_timeout=None):
+    return httpx.Timeout(read_timeout or HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def create_async_http_client(headers=None, read_timeout=None):
+    """
+    httpx.AsyncClient dùng chung (keep-alive, giới hạn pool, timeout rõ ràng, tùy chọn HTTP/2).
+    """
+    return httpx.AsyncClient(headers=headers, timeout=_timeout(read_timeout), limits=_limits(), http2=HTTP2)
+
+
+def create_http_client(headers=None, read_timeout=None):
+    """
+    Phiên bản đồng bộ của create_async_http_client (cho client OpenAI của chatbot() CLI).
+    """
+    return httpx.Client(headers=headers, timeout=_timeout(read_timeout), limits=_limits(), http2=HTTP2)
+
+
+def create_http_session(headers=None):
+    """
+    requests.Session có connection pool (thay cho requests.post mở kết nối TCP+TLS mới mỗi lần gọi).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_KEEPALIVE_CONNECTIONS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def elasticsearch_options():
+    """
+    Tham số pool/timeout cho Elasticsearch và AsyncElasticsearch.
+    """
+    return {
+        "connections_per_node": ES_CONNECTIONS_PER_NODE,
+        "request_timeout": ES_REQUEST_TIMEOUT,
+    }
+
+
+async def open_connection(client, url):
+    """
+    Mở sẵn kết nối (TCP + TLS) tới host của url bằng một request HEAD, bỏ qua mã trạng thái trả về.
+    """
+    await client.head(url)
+
+
+async def timed(name, coroutine):
+    start = time.perf_counter()
+    try:
+        await coroutine
+        print(f"✅ Warm-up {name}: {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"⚠️ Warm-up {name} lỗi: {str(e)}")
+
+
+async def warm_up(tasks):
+    """
+    Chạy song song các bước warm-up (dict tên -> coroutine), lỗi ở một bước không chặn các bước khác.
+    """
+    await asyncio.gather(*(timed(name, coroutine) for name, coroutine in tasks.items()))
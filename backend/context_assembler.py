@@ -0,0 +1,162 @@
+from functools import lru_cache
+import tiktoken
+
+# Khởi tạo bộ mã hóa tiktoken
+encoding = tiktoken.encoding_for_model("gpt-4o")
+
+# Số token tối thiểu dành cho context khi phải cắt bớt câu hỏi quá dài
+MIN_CONTEXT_TOKENS = 1000
+
+CONTEXT_HEADER = "**Dữ liệu chính:**\n"
+QUERY_HEADER = "\n\n**Câu hỏi:** "
+SNIPPET_SEPARATOR = "\n\n"
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Đếm token của văn bản (có memoize, mỗi chuỗi chỉ encode một lần).
+    """
+    return len(encoding.encode(text)) if text else 0
+
+
+def truncate_text(text, max_tokens):
+    """
+    Cắt bớt văn bản để không vượt quá số token cho phép.
+    Args:
+        text (str): Văn bản cần cắt.
+        max_tokens (int): Số token tối đa.
+    Returns:
+        str: Văn bản đã cắt bớt.
+    """
+    if not text:
+        return text
+    if max_tokens <= 0:
+        return ""
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    truncated_tokens = tokens[:max_tokens]
+    return encoding.decode(truncated_tokens)
+
+
+def snippet_text(title, content) -> str:
+    return f"**{title}**\n{content}"
+
+
+def document_snippet(doc) -> str:
+    return snippet_text(doc.title, doc.content)
+
+
+def document_tokens(doc) -> int:
+    """
+    Số token của snippet tài liệu. Ưu tiên trường `token_count` được tính lúc index
+    (số token của "**title**\\ncontent"), nếu không có thì đếm một lần và memoize.
+    """
+    if doc.token_count is not None:
+        return doc.token_count
+    return count_tokens(document_snippet(doc))
+
+
+def _select_history(history, max_history_tokens, max_history_messages):
+    """
+    Chọn các tin nhắn gần nhất trong giới hạn token (tin nhắn vượt giới hạn bị cắt bớt).
+    """
+    selected = []
+    history_tokens = 0
+    for msg in reversed(history[-max_history_messages:] if max_history_messages else []):
+        if history_tokens >= max_history_tokens:
+            break
+        role = msg["role"]
+        if role == "bot":
+            role = "assistant"
+        content = msg["content"]
+        # Tin nhắn từ SessionStore đã có sẵn số token (đếm một lần khi thêm vào)
+        msg_tokens = msg.get("tokens")
+        if msg_tokens is None:
+            msg_tokens = count_tokens(content)
+
+        if history_tokens + msg_tokens > max_history_tokens:
+            content = truncate_text(content, max_history_tokens - history_tokens)
+            msg_tokens = count_tokens(content)
+
+        history_tokens += msg_tokens
+        selected.append({"role": role, "content": content})
+    selected.reverse()
+    return selected, history_tokens
+
+
+def assemble_messages(system_prompt, documents, history, query,
+                      max_total_tokens=8000, max_context_tokens=5000,
+                      max_history_tokens=1000, max_history_messages=5, system_tokens=None):
+    """
+    Lập ngân sách token cho system prompt, context, history và câu hỏi trong một lượt.
+    Mỗi snippet/tin nhắn chỉ được đếm token một lần.
+
+    Thứ tự messages: system prompt tĩnh (giống hệt nhau từng byte giữa các request), history,
+    rồi tin nhắn user chứa tài liệu + câu hỏi. Phần đầu không đổi nên provider có thể cache prefix.
+    Args:
+        system_prompt (str): Hướng dẫn hệ thống (tĩnh, không chứa dữ liệu của request).
+        documents: Danh sách tài liệu từ semantic_search.
+        history: Lịch sử hội thoại.
+        query (str): Câu hỏi.
+        max_total_tokens (int): Số token tối đa cho toàn bộ messages.
+        max_context_tokens (int): Số token tối đa cho context.
+        max_history_tokens (int): Số token tối đa cho history.
+        max_history_messages (int): Số tin nhắn history gần nhất được giữ.
+        system_tokens (int): Số token của system_prompt nếu đã tính sẵn lúc khởi động.
+    Returns:
+        tuple: (messages, totals) với totals là số token của từng phần và tổng.
+    """
+    if system_tokens is None:
+        system_tokens = count_tokens(system_prompt)
+    history_messages, history_tokens = _select_history(history, max_history_tokens, max_history_messages)
+    query_tokens = count_tokens(query)
+
+    context_parts = []
+    context_tokens = 0
+    if documents:
+        wrapper_tokens = count_tokens(CONTEXT_HEADER) + count_tokens(QUERY_HEADER)
+        fixed_tokens = system_tokens + history_tokens + wrapper_tokens
+
+        # Nếu không đủ chỗ cho context, cắt bớt câu hỏi
+        if max_total_tokens - (fixed_tokens + query_tokens) < MIN_CONTEXT_TOKENS:
+            query = truncate_text(query, max_total_tokens - fixed_tokens - MIN_CONTEXT_TOKENS)
+            query_tokens = count_tokens(query)
+
+        context_budget = min(max_context_tokens, max_total_tokens - (fixed_tokens + query_tokens))
+        separator_tokens = count_tokens(SNIPPET_SEPARATOR)
+        for doc in documents:
+            snippet_tokens = document_tokens(doc) + (separator_tokens if context_parts else 0)
+            if context_tokens + snippet_tokens > context_budget:
+                break
+            context_parts.append(document_snippet(doc))
+            context_tokens += snippet_tokens
+
+        context = SNIPPET_SEPARATOR.join(context_parts)
+        user_content = f"{CONTEXT_HEADER}{context}{QUERY_HEADER}{query}"
+        user_tokens = wrapper_tokens + context_tokens + query_tokens
+        notice = None
+    else:
+        notice = (
+            f"**Xin lỗi nhé!** Mình không có dữ liệu chính về “{query}”. "
+            "Hỏi mình về du lịch Bình Định nhé! 😊"
+        )
+        user_content = query
+        user_tokens = query_tokens + count_tokens(notice)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history_messages)
+    if notice:
+        messages.append({"role": "system", "content": notice})
+    messages.append({"role": "user", "content": user_content})
+
+    totals = {
+        "system": system_tokens,
+        "context": context_tokens,
+        "history": history_tokens,
+        "query": query_tokens,
+        "documents": len(context_parts),
+        "total": system_tokens + history_tokens + user_tokens,
+    }
+    return messages, totals
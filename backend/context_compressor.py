@@ -0,0 +1,147 @@
+import re
+from dataclasses import replace
+import numpy as np
+from retriever import tokenize
+from context_assembler import count_tokens, document_snippet
+
+_SENTENCE_RE = re.compile(r"[^.!?…\n]+[.!?…]*")
+_MARK_RE = re.compile(r"<mark>(.*?)</mark>")
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.findall(text or "") if s.strip()]
+
+
+def _terms(text):
+    """
+    Từ đơn và cặp âm tiết liền nhau (từ ghép tiếng Việt thường gồm 2 âm tiết).
+    """
+    words = tokenize(text)
+    return set(words), {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def highlight_terms(hit):
+    """
+    Các từ Elasticsearch đã đánh dấu <mark> trong highlight của trường text.
+    """
+    fragments = hit.highlight or []
+    return {term.lower() for fragment in fragments for term in _MARK_RE.findall(fragment)}
+
+
+def lexical_scores(query, sentences, extra_terms=()):
+    words, bigrams = _terms(query)
+    words |= set(extra_terms)
+    scores = []
+    for sentence in sentences:
+        sentence_words, sentence_bigrams = _terms(sentence)
+        scores.append(len(words & sentence_words) + 2 * len(bigrams & sentence_bigrams))
+    return np.asarray(scores, dtype=np.float32)
+
+
+def embedding_scores(vector, sentence_vectors):
+    matrix = np.asarray(sentence_vectors, dtype=np.float32)
+    query_vector = np.asarray(vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) + 1e-12) + 1e-12
+    return matrix @ query_vector / norms
+
+
+def select_sentences(sentences, scores, max_tokens=300, neighbours=1):
+    """
+    Chọn các câu điểm cao nhất kèm `neighbours` câu liền trước/sau (cho mạch văn), giữ thứ tự gốc,
+    tổng không quá max_tokens. Không câu nào liên quan thì giữ các câu đầu.
+    Returns:
+        list: Chỉ số các câu được giữ (tăng dần).
+    """
+    if scores.max(initial=0) <= 0:
+        order = range(len(sentences))
+        neighbours = 0
+    else:
+        order = [i for i in np.argsort(-scores, kind="stable") if scores[i] > 0]
+
+    kept = set()
+    tokens = 0
+    for i in order:
+        window = [j for j in range(i - neighbours, i + neighbours + 1) if 0 <= j < len(sentences) and j not in kept]
+        window_tokens = sum(count_tokens(sentences[j]) for j in window)
+        if tokens + window_tokens > max_tokens:
+            if kept:
+                break
+            # Câu tốt nhất quá dài: giữ riêng câu đó
+            window = [i]
+            window_tokens = count_tokens(sentences[i])
+        kept.update(window)
+        tokens += window_tokens
+    return sorted(kept)
+
+
+def compressed_hit(hit, sentences, kept):
+    """
+    Bản sao của hit với content chỉ gồm các câu được giữ ("…" đánh dấu chỗ bị lược), giữ nguyên title, link.
+    """
+    parts = []
+    previous = None
+    for i in kept:
+        if previous is not None and i != previous + 1:
+            parts.append("…")
+        parts.append(sentences[i])
+        previous = i
+    compressed = replace(hit, content=" ".join(parts))
+    compressed.token_count = count_tokens(document_snippet(compressed))
+    return compressed
+
+
+class ContextCompressor:
+    """
+    Rút gọn tài liệu theo câu hỏi trước khi đưa vào prompt: chỉ giữ các câu liên quan (và câu lân cận).
+    mode "lexical": điểm theo từ/cặp âm tiết trùng với câu hỏi và các từ Elasticsearch đánh dấu trong highlight.
+    mode "embedding": cosine giữa embedding câu hỏi và embedding từng câu (qua provider embedding, có cache).
+    """
+
+    def __init__(self, mode="lexical", max_tokens=300, neighbours=1, get_embeddings=None, get_embeddings_async=None):
+        self.mode = mode
+        self.max_tokens = max_tokens
+        self.neighbours = neighbours
+        self.get_embeddings = get_embeddings
+        self.get_embeddings_async = get_embeddings_async
+
+    def _compress(self, hit, sentences, scores):
+        kept = select_sentences(sentences, scores, self.max_tokens, self.neighbours)
+        return compressed_hit(hit, sentences, kept)
+
+    def _candidates(self, documents):
+        # Tài liệu đã đủ ngắn thì giữ nguyên
+        for doc in documents:
+            sentences = split_sentences(doc.content)
+            if len(sentences) > 1 and count_tokens(doc.content) > self.max_tokens:
+                yield doc, sentences
+            else:
+                yield doc, None
+
+    def compress(self, query, vector, documents):
+        result = []
+        for doc, sentences in self._candidates(documents):
+            if sentences is None:
+                result.append(doc)
+            elif self.mode == "embedding" and vector is not None:
+                result.append(self._compress(doc, sentences, embedding_scores(vector, self.get_embeddings(sentences))))
+            else:
+                result.append(self._compress(doc, sentences, lexical_scores(query, sentences, highlight_terms(doc))))
+        return result
+
+    async def compress_async(self, query, vector, documents):
+        if self.mode != "embedding" or vector is None:
+            return self.compress(query, vector, documents)
+        candidates = list(self._candidates(documents))
+        # Một lần gọi embedding cho câu của mọi tài liệu
+        all_sentences = [s for _, sentences in candidates if sentences for s in sentences]
+        vectors = await self.get_embeddings_async(all_sentences) if all_sentences else []
+        result = []
+        offset = 0
+        for doc, sentences in candidates:
+            if sentences is None:
+                result.append(doc)
+                continue
+            sentence_vectors = vectors[offset:offset + len(sentences)]
+            offset += len(sentences)
+            result.append(self._compress(doc, sentences, embedding_scores(vector, sentence_vectors)))
+        return result
@@ -0,0 +1,102 @@
+import re
+import zlib
+import numpy as np
+
+_PRIME = np.uint64(4294967291)  # số nguyên tố lớn nhất < 2^32, a * x không tràn uint64
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text, size=3):
+    """
+    Tập shingle (các cụm `size` từ liên tiếp) của văn bản đã chuyển chữ thường, băm thành số 32-bit.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+def _choose_bands(num_perm, threshold, recall=0.99):
+    """
+    Chọn số band/row cho LSH (bands * rows <= num_perm): nhiều row nhất (ít ứng viên thừa nhất) mà một cặp có
+    Jaccard đúng bằng threshold vẫn là ứng viên với xác suất 1 - (1 - threshold^rows)^bands >= recall.
+    Ngưỡng LSH (1/bands)^(1/rows) vì vậy nằm dưới threshold; ứng viên được kiểm tra lại bằng chữ ký.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateFilter:
+    """
+    Phát hiện tài liệu gần trùng bằng MinHash trên shingle của content + LSH banding.
+    Tài liệu đầu tiên của mỗi cụm là bản chính tắc, các tài liệu sau có độ tương đồng
+    Jaccard (ước lượng) ≥ threshold với nó bị loại.
+    Args:
+        threshold (float): Ngưỡng Jaccard để coi là gần trùng.
+        num_perm (int): Số hàm băm của chữ ký MinHash.
+        shingle_size (int): Số từ mỗi shingle.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=3, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)[:, None]
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._keys = []
+
+        self.kept = 0
+        self.duplicates = 0
+
+    def signature(self, text):
+        values = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64) % _PRIME
+        hashed = (self._a * values % _PRIME + self._b) % _PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def find(self, signature):
+        """
+        Trả về khóa của bản chính tắc gần trùng với chữ ký (hoặc None).
+        """
+        candidates = set()
+        for band, bucket in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            candidates.update(bucket.get(key, ()))
+        best_key, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best_key, best_similarity = self._keys[candidate], similarity
+        return best_key
+
+    def add(self, key, signature):
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        self._keys.append(key)
+        for band, bucket in enumerate(self._buckets):
+            bucket.setdefault(signature[band * self.rows:(band + 1) * self.rows].tobytes(), []).append(position)
+
+    def filter(self, documents, key_fn, text_fn, on_duplicate=None):
+        """
+        Lọc một luồng tài liệu, chỉ giữ lại bản chính tắc của mỗi cụm gần trùng.
+        on_duplicate: Hàm nhận tài liệu bị bỏ (ví dụ để xóa dữ liệu cũ của nó).
+        """
+        for doc in documents:
+            signature = self.signature(text_fn(doc))
+            canonical = self.find(signature)
+            if canonical is not None:
+                self.duplicates += 1
+                print(f"🔁 Bỏ tài liệu gần trùng: {key_fn(doc)} ~ {canonical}")
+                if on_duplicate is not None:
+                    on_duplicate(doc)
+                continue
+            self.add(key_fn(doc), signature)
+            self.kept += 1
+            yield doc
@@ -0,0 +1,35 @@
+"""
+Xuất index Elasticsearch thành snapshot cho InMemoryRetriever (RETRIEVER_BACKEND=memory).
+
+Ví dụ:
+    python export_snapshot.py --index chatbot_elastic --out snapshot
+"""
+import os
+import time
+import argparse
+from elasticsearch import Elasticsearch
+from dotenv import load_dotenv
+from retriever import export_snapshot
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất index Elasticsearch thành snapshot trong RAM.")
+    parser.add_argument("--index", default="chatbot_elastic")
+    parser.add_argument("--out", default=os.getenv("SNAPSHOT_DIR", "snapshot"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    es = Elasticsearch(
+        os.getenv("ELASTICSEARCH_URL"),
+        api_key=os.getenv("ELASTICSEARCH_API_KEY"),
+        request_timeout=60,
+    )
+    start = time.time()
+    count = export_snapshot(es, args.index, args.out, batch_size=args.batch_size)
+    print(f"✅ Đã xuất {count} tài liệu từ '{args.index}' vào '{args.out}' ({time.time() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Nạp tài liệu (JSONL/CSV với các cột title, content, link) vào index Elasticsearch mà semantic_search dùng.
+Pipeline dạng generator: đọc → chia chunk theo token → bỏ qua chunk đã index → embedding theo batch → parallel_bulk.
+Mỗi chunk có _id = md5(title + content + link), chạy lại chỉ index những chunk mới hoặc đã thay đổi,
+rồi xóa các chunk cũ (không còn được tạo ra) của những link vừa nạp.
+Tài liệu gần trùng nhau (MinHash trên content, xem dedupe.py) được gộp về bản đầu tiên trước khi chia chunk.
+
+Ví dụ:
+    python ingest.py data/binhdinh.jsonl --index chatbot_elastic --thread-count 4
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+from itertools import islice
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import parallel_bulk
+from dotenv import load_dotenv
+from context_assembler import encoding, count_tokens, snippet_text
+from migrate_index import build_target_mapping
+from dedupe import NearDuplicateFilter
+from model.providers import load_provider
+
+load_dotenv()
+
+# Cùng provider embedding với backend (EMBEDDING_PROVIDER) để vector index khớp với vector truy vấn
+embedding_provider = load_provider()
+
+SOURCE_PROPERTIES = {
+    "title": {"type": "text"},
+    "content": {"type": "text"},
+    "link": {"type": "keyword"},
+    "text": {"type": "text"},
+    "token_count": {"type": "integer"},
+    "chunk": {"type": "integer"},
+}
+
+
+def content_hash(title, content, link):
+    """
+    Băm nội dung chunk, dùng làm _id để nạp tăng dần.
+    """
+    return hashlib.md5(f"{title}{content}{link}".encode("utf-8")).hexdigest()
+
+
+def read_documents(path):
+    """
+    Đọc lần lượt từng tài liệu từ file JSONL hoặc CSV.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            if row.get("title") and row.get("content"):
+                yield {"title": row["title"].strip(), "content": row["content"].strip(), "link": (row.get("link") or "").strip()}
+
+
+def split_content(content, max_tokens):
+    """
+    Chia nội dung thành các đoạn không quá max_tokens token, ưu tiên cắt theo đoạn văn.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in (p.strip() for p in content.split("\n")):
+        if not paragraph:
+            continue
+        tokens = encoding.encode(paragraph)
+        # Đoạn văn quá dài thì cắt cứng theo token
+        pieces = [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        for piece in pieces:
+            piece_tokens = count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def chunk_documents(documents, max_tokens, produced=None):
+    """
+    Args:
+        produced (dict): Nếu có, ghi lại link -> tập _id các chunk được tạo (để xóa chunk cũ sau khi nạp).
+    """
+    for doc in documents:
+        for number, chunk in enumerate(split_content(doc["content"], max_tokens)):
+            source = {
+                "title": doc["title"],
+                "content": chunk,
+                "link": doc["link"],
+                "text": f"{doc['title']} {chunk}".lower(),
+                "chunk": number,
+            }
+            source["token_count"] = count_tokens(snippet_text(source["title"], source["content"]))
+            doc_id = content_hash(doc["title"], chunk, doc["link"])
+            if produced is not None and doc["link"]:
+                produced.setdefault(doc["link"], set()).add(doc_id)
+            yield doc_id, source
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class IngestStats:
+    def __init__(self):
+        self.chunks = 0
+        self.skipped = 0
+        self.embedded = 0
+        self.indexed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.deleted = 0
+
+
+def skip_indexed(es, index_name, batches, stats):
+    """
+    Bỏ qua các chunk có _id (md5 nội dung) đã tồn tại trong index.
+    """
+    for batch in batches:
+        stats.chunks += len(batch)
+        res = es.mget(index=index_name, ids=[doc_id for doc_id, _ in batch], source=False)
+        existing = {doc["_id"] for doc in res["docs"] if doc.get("found")}
+        stats.skipped += len(existing)
+        new_batch = [item for item in batch if item[0] not in existing]
+        if new_batch:
+            yield new_batch
+
+
+def embed_batches(batches, index_name, stats):
+    for batch in batches:
+        embeddings = embedding_provider.get_embeddings([f"{source['title']}\n{source['content']}" for _, source in batch])
+        stats.embedded += len(batch)
+        for (doc_id, source), embedding in zip(batch, embeddings):
+            yield {"_index": index_name, "_id": doc_id, "_source": {**source, "embedding": embedding}}
+
+
+def delete_stale_chunks(es, index_name, produced, batch_size=50):
+    """
+    Xóa các chunk cũ của những link vừa nạp mà _id không còn được tạo ra (bài viết đã thay đổi),
+    link có tập _id rỗng (tài liệu bị bỏ vì gần trùng) thì xóa mọi chunk của link đó.
+    Returns:
+        int: Số chunk đã xóa.
+    """
+    deleted = 0
+    for links in batched(produced.items(), batch_size):
+        query = {
+            "bool": {
+                "should": [
+                    {"bool": {"filter": [{"term": {"link": link}}],
+                              "must_not": [{"ids": {"values": sorted(ids)}}] if ids else []}}
+                    for link, ids in links
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+        res = es.delete_by_query(index=index_name, query=query, conflicts="proceed", refresh=True)
+        deleted += res.get("deleted", 0)
+    return deleted
+
+
+def current_refresh_interval(es, index_name):
+    """
+    refresh_interval đang đặt cho index (None nếu dùng mặc định của Elasticsearch).
+    """
+    res = es.indices.get_settings(index=index_name, name="index.refresh_interval")
+    return res.get(index_name, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+
+
+def ensure_index(es, index_name, dims):
+    if es.indices.exists(index=index_name):
+        return
+    mapping = build_target_mapping({"properties": SOURCE_PROPERTIES}, dims, "cosine", 16, 100)
+    es.indices.create(index=index_name, mappings=mapping)
+    print(f"✅ Đã tạo index '{index_name}' (dense_vector {dims} chiều)")
+
+
+def ingest(es, path, index_name, max_tokens=400, batch_size=64, thread_count=4, chunk_size=200,
+           dedupe_threshold=0.8):
+    """
+    Chạy toàn bộ pipeline nạp dữ liệu.
+    Args:
+        es (Elasticsearch): Client đồng bộ.
+        path (str): File JSONL/CSV nguồn.
+        index_name (str): Index đích.
+        max_tokens (int): Số token tối đa của nội dung mỗi chunk.
+        batch_size (int): Số chunk mỗi lần gọi embedding.
+        thread_count (int): Số luồng của parallel_bulk.
+        chunk_size (int): Số tài liệu mỗi request bulk.
+        dedupe_threshold (float): Ngưỡng Jaccard để gộp tài liệu gần trùng (0 = tắt).
+    Returns:
+        IngestStats: Thống kê số chunk đã xử lý.
+    """
+    stats = IngestStats()
+    documents = read_documents(path)
+    # link -> _id các chunk vừa tạo; tài liệu bị bỏ vì gần trùng ghi tập rỗng để xóa chunk cũ của nó
+    produced = {}
+    near_duplicates = None
+    if dedupe_threshold > 0:
+        near_duplicates = NearDuplicateFilter(threshold=dedupe_threshold)
+        documents = near_duplicates.filter(
+            documents, lambda doc: doc["link"] or doc["title"], lambda doc: doc["content"],
+            on_duplicate=lambda doc: doc["link"] and produced.setdefault(doc["link"], set()),
+        )
+    chunks = chunk_documents(documents, max_tokens, produced)
+    batches = skip_indexed(es, index_name, batched(chunks, batch_size), stats)
+    actions = embed_batches(batches, index_name, stats)
+
+    # Tắt refresh trong lúc ghi hàng loạt, sau đó trả lại giá trị cũ (None = mặc định)
+    refresh_interval = current_refresh_interval(es, index_name)
+    es.indices.put_settings(index=index_name, settings={"refresh_interval": "-1"})
+    try:
+        for ok, info in parallel_bulk(es, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                      raise_on_error=False):
+            if ok:
+                stats.indexed += 1
+            else:
+                stats.failed += 1
+                print(f"⚠️ Lỗi index: {info}")
+    finally:
+        es.indices.put_settings(index=index_name, settings={"refresh_interval": refresh_interval})
+        es.indices.refresh(index=index_name)
+    # Chỉ xóa chunk cũ khi mọi chunk mới đã vào index, tránh mất nội dung của bài
+    if stats.failed:
+        print(f"⚠️ Có {stats.failed} chunk lỗi, giữ nguyên các chunk cũ")
+    else:
+        stats.deleted = delete_stale_chunks(es, index_name, produced)
+    if near_duplicates is not None:
+        stats.duplicates = near_duplicates.duplicates
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nạp tài liệu JSONL/CSV vào Elasticsearch.")
+    parser.add_argument("path")
+    parser.add_argument("--index", default="chatbot_elastic")
+    parser.add_argument("--dims", type=int, default=embedding_provider.cache.dimensions)
+    parser.add_argument("--max-tokens", type=int, default=400)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--thread-count", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--dedupe-threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    es = Elasticsearch(
+        os.getenv("ELASTICSEARCH_URL"),
+        api_key=os.getenv("ELASTICSEARCH_API_KEY"),
+        request_timeout=60,
+    )
+    ensure_index(es, args.index, args.dims)
+    start = time.time()
+    stats = ingest(es, args.path, args.index, max_tokens=args.max_tokens, batch_size=args.batch_size,
+                   thread_count=args.thread_count, chunk_size=args.chunk_size,
+                   dedupe_threshold=args.dedupe_threshold)
+    print(f"✅ Xong sau {time.time() - start:.1f}s: {stats.duplicates} tài liệu gần trùng, {stats.chunks} chunk, bỏ qua {stats.skipped}, "
+          f"embedding {stats.embedded}, index {stats.indexed}, xóa {stats.deleted} chunk cũ, lỗi {stats.failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import re
+import threading
+import numpy as np
+
+# Các câu ví dụ có nhãn (lấy từ prompt phân loại + bổ sung thêm)
+INTENT_EXAMPLES = {
+    "related": [
+        "Có những địa điểm du lịch nào ở Quy Nhơn?",
+        "Nghệ thuật hát tuồng ở Bình Định ra sao?",
+        "Quy Nhơn có gì chơi?",
+        "Đặc sản Bình Định là gì?",
+        "Eo Gió đi như thế nào?",
+        "Khách sạn gần biển Quy Nhơn",
+        "Lễ hội truyền thống tại Bình Định",
+        "Món ngon ở Quy Nhơn",
+        "Lịch sử nhà Tây Sơn",
+        "Kỳ Co có đẹp không?",
+        "Tháp Chăm ở Bình Định",
+        "Võ cổ truyền Bình Định",
+    ],
+    "unrelated": [
+        "Tôi nên học Python ở đâu?",
+        "iPhone 15 ra mắt năm nào?",
+        "Giá vàng hôm nay bao nhiêu?",
+        "Cách sửa lỗi máy tính không lên màn hình",
+        "Kết quả bóng đá Ngoại hạng Anh",
+        "Viết giúp tôi một đoạn code Java",
+        "Công thức tính diện tích hình tròn",
+        "Thủ đô của nước Pháp là gì?",
+    ],
+    "greeting": [
+        "Chào bạn!",
+        "Tạm biệt nhé, hẹn gặp lại!",
+        "Cảm ơn bạn nhiều",
+        "Xin chào",
+        "Chúc bạn một ngày tốt lành",
+        "Hello",
+    ],
+}
+
+# Từ điển lời chào/cảm ơn/tạm biệt (đã chuẩn hóa chữ thường, bỏ dấu câu)
+GREETING_PHRASES = [
+    "xin chào", "chào", "hello", "hi", "hey", "alo", "helo",
+    "cảm ơn", "cám ơn", "thank you", "thanks", "thank",
+    "tạm biệt", "bye", "goodbye", "hẹn gặp lại", "chúc ngủ ngon", "chúc",
+]
+# Các từ đệm có thể đi kèm lời chào mà không đổi ý nghĩa
+GREETING_FILLERS = {
+    "bạn", "nhé", "nha", "nhá", "ạ", "à", "nhiều", "rất", "lắm", "mình", "em", "anh", "chị",
+    "bot", "chatbot", "nhe", "luôn", "nhiêu", "you", "very", "much", "so",
+}
+
+_GREETING_RE = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(p) for p in set(GREETING_PHRASES)), key=len, reverse=True)) + r")\b"
+)
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_query(text: str) -> str:
+    """
+    Chuẩn hóa câu hỏi: chữ thường, bỏ dấu câu/emoji, gộp khoảng trắng.
+    """
+    text = _PUNCT_RE.sub(" ", text.lower())
+    return " ".join(text.split())
+
+
+def is_greeting(query: str) -> bool:
+    """
+    Kiểm tra nhanh câu chỉ gồm lời chào/cảm ơn/tạm biệt (và từ đệm).
+    """
+    normalized = normalize_query(query)
+    if not normalized or not _GREETING_RE.search(normalized):
+        return False
+    rest = _GREETING_RE.sub(" ", normalized).split()
+    return all(word in GREETING_FILLERS for word in rest)
+
+
+class LocalIntentClassifier:
+    """
+    Bộ phân loại intent cục bộ: lexicon lời chào + độ tương đồng cosine với centroid
+    của các câu ví dụ. Trả về None khi độ tin cậy (khoảng cách giữa nhãn tốt nhất
+    và nhãn thứ hai) dưới ngưỡng để gọi LLM dự phòng.
+    Chỉ các nhãn trong `local_labels` (mặc định greeting, related) được trả lời cục bộ: từ chối nhầm
+    một câu hỏi du lịch tệ hơn nhiều so với một lần gọi LLM, nên "unrelated" luôn để LLM quyết định.
+    """
+
+    def __init__(self, embed_batch_fn, embed_batch_async_fn, threshold=0.2, examples=None,
+                 local_labels=("greeting", "related")):
+        self.embed_batch_fn = embed_batch_fn
+        self.embed_batch_async_fn = embed_batch_async_fn
+        self.threshold = threshold
+        self.examples = examples or INTENT_EXAMPLES
+        self.labels = list(self.examples)
+        self.local_labels = set(local_labels)
+        self._centroids = None
+        self._lock = threading.Lock()
+
+        # Bộ đếm để tinh chỉnh ngưỡng
+        self.lexicon_hits = 0
+        self.centroid_hits = 0
+        self.llm_fallbacks = 0
+
+    @property
+    def ready(self):
+        return self._centroids is not None
+
+    def _build_centroids(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        centroids = []
+        start = 0
+        for label in self.labels:
+            count = len(self.examples[label])
+            centroid = vectors[start:start + count].mean(axis=0)
+            centroids.append(centroid / (np.linalg.norm(centroid) + 1e-12))
+            start += count
+        self._centroids = np.stack(centroids)
+
+    def _example_texts(self):
+        return [text.lower() for label in self.labels for text in self.examples[label]]
+
+    def warm_up(self):
+        """
+        Tính centroid cho từng nhãn (đồng bộ, dùng cho CLI).
+        """
+        with self._lock:
+            if self._centroids is None:
+                self._build_centroids(self.embed_batch_fn(self._example_texts()))
+
+    async def warm_up_async(self):
+        """
+        Tính centroid cho từng nhãn (bất đồng bộ, gọi khi khởi động FastAPI).
+        """
+        if self._centroids is None:
+            self._build_centroids(await self.embed_batch_async_fn(self._example_texts()))
+
+    def classify(self, query, vector=None):
+        """
+        Phân loại câu hỏi không cần gọi LLM.
+        Args:
+            query (str): Câu hỏi.
+            vector (list): Embedding của câu hỏi (nếu đã có).
+        Returns:
+            tuple: (nhãn hoặc None nếu cần gọi LLM, độ tin cậy).
+        """
+        if is_greeting(query):
+            self.lexicon_hits += 1
+            return "greeting", 1.0
+
+        if vector is None or self._centroids is None:
+            self.llm_fallbacks += 1
+            return None, 0.0
+
+        query_vector = np.asarray(vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) + 1e-12)
+        similarities = self._centroids @ query_vector
+        order = np.argsort(similarities)[::-1]
+        confidence = float(similarities[order[0]] - similarities[order[1]])
+
+        label = self.labels[order[0]]
+        if confidence >= self.threshold and label in self.local_labels:
+            self.centroid_hits += 1
+            return label, confidence
+
+        self.llm_fallbacks += 1
+        return None, confidence
+
+    def stats(self):
+        total = self.lexicon_hits + self.centroid_hits + self.llm_fallbacks
+        return {
+            "threshold": self.threshold,
+            "ready": self.ready,
+            "lexicon_hits": self.lexicon_hits,
+            "centroid_hits": self.centroid_hits,
+            "llm_fallbacks": self.llm_fallbacks,
+            "local_hit_ratio": (self.lexicon_hits + self.centroid_hits) / total if total else 0.0,
+        }
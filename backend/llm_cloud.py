@@ -3,15 +3,28 @@ import threading
 import queue
 import sys
 import select
-from elasticsearch import Elasticsearch
-# from model.embedding_model import get_embedding
-# from model.embedding_model_new import get_embedding
-from model.embedding_model_of_jina import get_embedding
-from openai import OpenAI
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import Elasticsearch, AsyncElasticsearch
+from model.providers import load_provider
+from openai import OpenAI, AsyncOpenAI
+from intent_classifier import LocalIntentClassifier, normalize_query
+from single_flight import SingleFlight, fingerprint
+from model_router import ModelRouter
+from model.embedding_cache import normalize_text
+from answer_cache import SemanticAnswerCache
+from session_store import SessionStore
+from retriever import ElasticsearchRetriever, InMemoryRetriever
+from reranker import FeatureReranker, select_adaptive
+from context_compressor import ContextCompressor
 import os
 from dotenv import load_dotenv
-import hashlib
-import tiktoken
+from context_assembler import document_tokens, assemble_messages, count_tokens
+from connections import (
+    create_http_client, create_async_http_client, elasticsearch_options, open_connection, warm_up,
+)
+from metrics import span, observe, record_tokens, record_usage, stats_collector, LLM_ANSWERS, PROMPT_TOKENS, CONTEXT_TOKENS, CONTEXT_DOCUMENTS, TIMEOUTS, UPSTREAM_ERRORS
 
 # Đo thời gian khởi động
 start_time = time.time()
@@ -20,43 +33,410 @@ print(f"Starting backend at {time.time() - start_time:.2f}s")
 load_dotenv()
 print(f"Loaded env at {time.time() - start_time:.2f}s")
 
+# Provider embedding chọn theo EMBEDDING_PROVIDER (jina, sentence_transformers, huggingface, onnx)
+embedding_provider = load_provider()
+get_embedding = embedding_provider.get_embedding
+get_embedding_async = embedding_provider.get_embedding_async
+get_embeddings = embedding_provider.get_embeddings
+get_embeddings_async = embedding_provider.get_embeddings_async
+aclose_embedding = embedding_provider.aclose
+embedding_cache = embedding_provider.cache
+embedding_batcher = embedding_provider.batcher
+print(f"Loaded embedding provider {embedding_provider.__name__} at {time.time() - start_time:.2f}s")
+
 # Khởi tạo Elasticsearch
 es = Elasticsearch(
     os.getenv("ELASTICSEARCH_URL"),
-    api_key=os.getenv("ELASTICSEARCH_API_KEY")
+    api_key=os.getenv("ELASTICSEARCH_API_KEY"),
+    **elasticsearch_options(),
+)
+# Client bất đồng bộ cho API (FastAPI), client đồng bộ giữ cho chatbot() CLI
+async_es = AsyncElasticsearch(
+    os.getenv("ELASTICSEARCH_URL"),
+    api_key=os.getenv("ELASTICSEARCH_API_KEY"),
+    **elasticsearch_options(),
 )
 print(f"Elasticsearch connected at {time.time() - start_time:.2f}s!")
 
 INDEX_NAME = "chatbot_elastic"
 
+# Chế độ truy vấn: "script_score" (cosine brute-force trên mọi tài liệu, như cũ)
+# hoặc "knn_hybrid" (kNN HNSW + BM25, hợp nhất bằng reciprocal-rank fusion).
+# knn_hybrid cần index có dense_vector được đánh chỉ mục (xem migrate_index.py).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "script_score")
+KNN_INDEX_NAME = os.getenv("KNN_INDEX_NAME", "chatbot_elastic_knn")
+KNN_NUM_CANDIDATES = int(os.getenv("KNN_NUM_CANDIDATES", "50"))
+RRF_RANK_CONSTANT = int(os.getenv("RRF_RANK_CONSTANT", "60"))
+RRF_WINDOW_SIZE = int(os.getenv("RRF_WINDOW_SIZE", "10"))
+
+# Rút gọn tài liệu theo câu hỏi trước khi đưa vào prompt: "off", "lexical" (từ trùng + highlight
+# của Elasticsearch) hoặc "embedding" (độ tương đồng từng câu); luôn giữ title và link
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "off").lower()
+compressor = ContextCompressor(
+    mode=CONTEXT_COMPRESSION,
+    max_tokens=int(os.getenv("COMPRESSION_DOC_TOKENS", "300")),
+    neighbours=int(os.getenv("COMPRESSION_NEIGHBOURS", "1")),
+    get_embeddings=get_embeddings,
+    get_embeddings_async=get_embeddings_async,
+)
+
+# Backend truy xuất: "elasticsearch" hoặc "memory" (snapshot trong RAM, xem export_snapshot.py)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "elasticsearch")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+
+# Lấy tập ứng viên rộng rồi xếp hạng lại trong tiến trình, chọn số tài liệu theo điểm (adaptive k)
+# với ngân sách context nhỏ hơn
+RERANK = os.getenv("RERANK", "false").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_MAX_K = int(os.getenv("RERANK_MAX_K", "4"))
+RERANK_CONTEXT_TOKENS = int(os.getenv("RERANK_CONTEXT_TOKENS", "2500"))
+RERANK_MIN_RELATIVE_SCORE = float(os.getenv("RERANK_MIN_RELATIVE_SCORE", "0.6"))
+reranker = FeatureReranker()
+
+def create_retriever():
+    if RETRIEVER_BACKEND == "memory":
+        return InMemoryRetriever(SNAPSHOT_DIR, rank_constant=RRF_RANK_CONSTANT, window_size=RRF_WINDOW_SIZE)
+    return ElasticsearchRetriever(
+        es, async_es, INDEX_NAME, KNN_INDEX_NAME, mode=RETRIEVAL_MODE,
+        num_candidates=KNN_NUM_CANDIDATES, rank_constant=RRF_RANK_CONSTANT, window_size=RRF_WINDOW_SIZE,
+        # Highlight chỉ cần khi rút gọn context theo từ khóa
+        highlight=CONTEXT_COMPRESSION == "lexical",
+        # Embedding tài liệu chỉ cần cho đặc trưng dense của rerank
+        embeddings=RERANK,
+    )
+
+retriever = create_retriever()
+
+# Chạy phân loại intent song song với embedding + tìm kiếm (hủy/bỏ kết quả tìm kiếm nếu không cần)
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-search")
+
+# Bộ phân loại intent cục bộ (chỉ trả lời cục bộ greeting/related), gọi LLM khi độ tin cậy dưới ngưỡng hoặc nghi "unrelated"
+LOCAL_INTENT_CLASSIFIER = os.getenv("LOCAL_INTENT_CLASSIFIER", "true").lower() == "true"
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.2"))
+local_classifier = LocalIntentClassifier(get_embeddings, get_embeddings_async, threshold=INTENT_CONFIDENCE_THRESHOLD)
+
+# Cache câu trả lời theo độ tương đồng câu hỏi (chia theo model)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+)
+
+# Ngân sách history trong prompt (dùng chung cho build_messages và SessionStore)
+MAX_HISTORY_TOKENS = 1000
+MAX_HISTORY_MESSAGES = 5
+
+# Tóm tắt cuốn chiếu history: chỉ giữ nguyên văn vài tin nhắn gần nhất, phần cũ hơn được LLM tóm tắt
+# ở task nền sau khi đã trả lời
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "false").lower() == "true"
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+HISTORY_SUMMARY_KEEP_MESSAGES = int(os.getenv("HISTORY_SUMMARY_KEEP_MESSAGES", "2"))
+
+# Gộp các lời gọi giống hệt nhau đang chạy đồng thời (từng stage và cả pipeline /chat)
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+embed_flight = SingleFlight("embed", SINGLE_FLIGHT)
+classify_flight = SingleFlight("classify", SINGLE_FLIGHT)
+search_flight = SingleFlight("search", SINGLE_FLIGHT)
+generate_flight = SingleFlight("generate", SINGLE_FLIGHT)
+chat_flight = SingleFlight("chat", SINGLE_FLIGHT)
+
 token = os.getenv("GITHUB_TOKEN")
-endpoint = "https://models.github.ai/inference"
-model_name = "openai/gpt-4.1"
+endpoint = os.getenv("LLM_ENDPOINT", "https://models.github.ai/inference")
+
+# Model chọn theo từng request (trong LLM_MODELS), bộ phân loại dùng model riêng.
+# Lời gọi chậm hơn ngưỡng (mặc định p95 quan sát được) được gọi thêm ở model dự phòng, lấy kết quả về trước;
+# model lỗi/chậm liên tục bị circuit breaker tạm bỏ qua.
+LLM_MODELS = [m.strip() for m in os.getenv("LLM_MODELS", "openai/gpt-4.1,openai/gpt-4o,openai/gpt-4o-mini").split(",") if m.strip()]
+LLM_HEDGE_AFTER = os.getenv("LLM_HEDGE_AFTER", "")
+model_router = ModelRouter(
+    LLM_MODELS,
+    default_model=os.getenv("LLM_DEFAULT_MODEL") or None,
+    classifier_model=os.getenv("LLM_CLASSIFIER_MODEL") or None,
+    fallback_models=[m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "openai/gpt-4o-mini").split(",") if m.strip()],
+    hedging=os.getenv("LLM_HEDGING", "true").lower() == "true",
+    # Hedge thời gian tới token đầu (stream) và phân loại; completion không stream chỉ hedge khi được cấu hình
+    hedge_kinds=[k.strip() for k in os.getenv("LLM_HEDGE_KINDS", "stream,classify").split(",") if k.strip()],
+    hedge_after=float(LLM_HEDGE_AFTER) if LLM_HEDGE_AFTER else None,
+    hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+    hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+    hedge_default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2.0")),
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+    slow_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "20")),
+)
+# Connection pool, timeout (và HTTP/2 nếu bật) theo connections.py
+llm_http_client = create_async_http_client()
 client = OpenAI(
     base_url=endpoint,
     api_key=token,
+    http_client=create_http_client(),
+)
+async_client = AsyncOpenAI(
+    base_url=endpoint,
+    api_key=token,
+    http_client=llm_http_client,
 )
 print(f"OpenAI client initialized at {time.time() - start_time:.2f}s!")
 
+SUMMARY_PROMPT = (
+    "Tóm tắt ngắn gọn cuộc hội thoại giữa người dùng và hướng dẫn viên du lịch Bình Định dưới đây. "
+    "Giữ lại các địa điểm, món ăn, thời gian, sở thích và yêu cầu mà người dùng đã nhắc tới. "
+    "Chỉ trả về đoạn tóm tắt, không thêm lời dẫn."
+)
+
+async def summarize_history_async(summary, messages):
+    """
+    Gộp các tin nhắn cũ vào bản tóm tắt hiện có của cuộc hội thoại (chạy nền, không chặn request).
+    Args:
+        summary (str): Bản tóm tắt trước đó (None nếu chưa có).
+        messages: Các tin nhắn vừa ra khỏi cửa sổ history.
+    Returns:
+        str: Bản tóm tắt mới.
+    """
+    lines = [f"Tóm tắt trước đó: {summary}"] if summary else []
+    for msg in messages:
+        speaker = "Người dùng" if msg["role"] == "user" else "Hướng dẫn viên"
+        lines.append(f"{speaker}: {msg['content']}")
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+    with span("summarize"):
+        response, _ = await model_router.call(
+            model_router.default_model,
+            lambda model: async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+                temperature=0,
+            ),
+            kind="summarize",
+        )
+    content = response.choices[0].message.content.strip()
+    usage = getattr(response, "usage", None)
+    if usage:
+        record_tokens(usage.prompt_tokens, usage.completion_tokens)
+    return content
+
+# History hội thoại lưu phía server theo session_id (client chỉ gửi session_id và câu hỏi mới)
+if HISTORY_SUMMARY:
+    session_store = SessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+        max_history_tokens=MAX_HISTORY_TOKENS - HISTORY_SUMMARY_MAX_TOKENS,
+        max_history_messages=min(HISTORY_SUMMARY_KEEP_MESSAGES, MAX_HISTORY_MESSAGES - 1),
+        summarize=summarize_history_async,
+    )
+else:
+    session_store = SessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+        max_history_tokens=MAX_HISTORY_TOKENS,
+        max_history_messages=MAX_HISTORY_MESSAGES,
+    )
+
+# Xuất stats() của cache/batcher/bộ phân loại ra /metrics
+stats_collector.add("embedding_cache", embedding_cache.stats, counters=("memory_hits", "disk_hits", "misses"))
+stats_collector.add("embedding_batch", embedding_batcher.stats, counters=("batches", "items"))
+stats_collector.add("intent", local_classifier.stats, counters=("lexicon_hits", "centroid_hits", "llm_fallbacks"))
+stats_collector.add("answer_cache", answer_cache.stats, counters=("exact_hits", "semantic_hits", "misses"))
+stats_collector.add("sessions", session_store.stats, counters=("created", "evicted", "summaries", "summary_errors"))
+for flight in (embed_flight, classify_flight, search_flight, generate_flight, chat_flight):
+    stats_collector.add(f"single_flight_{flight.name}", flight.stats, counters=("executions", "coalesced", "cancelled"))
+stats_collector.add("model_router", model_router.stats, counters=("calls", "hedges", "hedge_wins", "fallbacks", "failures"))
+
 print(f"Backend fully initialized at {time.time() - start_time:.2f}s!")
 
-# Khởi tạo bộ mã hóa tiktoken
-encoding = tiktoken.encoding_for_model("gpt-4o")
+# Prompt hệ thống rút gọn
+SYSTEM_PROMPT = (
+    "Bạn là hướng dẫn viên du lịch thân thiện, chuyên về Bình Định, được tạo bởi **Nguyễn Bá Lâm** (Phù Mỹ, Bình Định).\n"
+    "Trả lời gần gũi, đúng trọng tâm, dùng **Markdown**:\n"
+    "- Ưu tiên dữ liệu bên dưới, bổ sung kiến thức ngoài nếu cần (ghi rõ).\n"
+    "- Nếu người dùng hỏi nhiều ý (ví dụ: địa điểm + món ăn), hãy cố gắng trả lời đầy đủ cả hai nếu liên quan đến Bình Định."
+    "- Giữ câu trả lời ~400 token, dùng gạch đầu dòng (-), in đậm **tiêu đề**.\n"
+    "- Từ chối lịch sự nếu không liên quan đến du lịch, văn hóa, lịch sử Bình Định.\n"
+    "- Chỉ dùng liên kết của tài liệu đầu tiên.\n"
+)
+# System prompt tĩnh: giống hệt nhau giữa các request (tài liệu, câu hỏi nằm ở tin nhắn sau)
+# để provider cache được prefix; số token tính một lần lúc khởi động
+SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
 
-# function để đổi model
-def set_model_name(new_model_name: str):
-    global model_name
-    model_name = new_model_name
-    print(f"✅ Model name đã đổi thành: {model_name}")
+# Yêu cầu usage (kể cả cached_tokens) ở chunk cuối khi stream
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+async def aclose_clients():
+    """
+    Đóng các client bất đồng bộ (gọi khi tắt FastAPI).
+    """
+    await async_es.close()
+    await async_client.close()
+    await aclose_embedding()
 
-def semantic_search(query, top_k=2, max_context_tokens=5000, stop_event=None):
+async def warm_up_async():
     """
-    Tìm kiếm ngữ nghĩa trong Elasticsearch, trả về danh sách tài liệu và context đã được giới hạn token.
+    Chuẩn bị trước khi nhận request: mở sẵn kết nối tới Elasticsearch, LLM và provider embedding,
+    nạp bảng mã tiktoken, rồi tính centroid cho bộ phân loại intent cục bộ.
+    """
+    tasks = {
+        "tiktoken": asyncio.to_thread(count_tokens, "Bình Định"),
+        "embedding": embedding_provider.warm_up(),
+        "llm": open_connection(llm_http_client, endpoint),
+    }
+    if RETRIEVER_BACKEND == "elasticsearch":
+        tasks["elasticsearch"] = async_es.ping()
+    await warm_up(tasks)
+
+    if LOCAL_INTENT_CLASSIFIER:
+        try:
+            await local_classifier.warm_up_async()
+        except Exception as e:
+            print(f"Không tính được centroid phân loại intent, dùng LLM: {str(e)}")
+
+async def embed_query_async(query):
+    """
+    Embedding của câu hỏi (chữ thường), các câu hỏi giống nhau đang chờ dùng chung một lời gọi.
+    """
+    query = query.lower()
+    return await embed_flight.do(normalize_text(query), lambda: get_embedding_async(query))
+
+def lookup_cached_answer(query, vector, model, history=None):
+    """
+    Tra cache câu trả lời. Returns: (câu trả lời, tài liệu) hoặc None.
+    Câu hỏi nối tiếp (có history) phụ thuộc vào cuộc hội thoại nên không tra cache,
+    tránh trả câu trả lời của session này cho session khác.
+    """
+    if not ANSWER_CACHE_ENABLED or history:
+        return None
+    return answer_cache.lookup(query, vector, model)
+
+def store_cached_answer(query, vector, model, response, documents, history=None):
+    if ANSWER_CACHE_ENABLED and not history:
+        answer_cache.store(query, vector, model, response, documents)
+
+def select_documents(hits, top_k=2, max_context_tokens=5000):
+    """
+    Chọn tài liệu sao cho context không vượt quá giới hạn token.
+    Args:
+        hits (list): Danh sách Hit từ retriever.
+        top_k (int): Số lượng tài liệu tối đa trả về.
+        max_context_tokens (int): Số token tối đa cho phép của context.
+    Returns:
+        tuple: (danh sách tài liệu, lỗi nếu có).
+    """
+    # print(hits)
+    if not hits:
+        return None, "Mình không hiểu câu này lắm 😥. Bạn thử hỏi ngắn gọn hơn ^^"
+    
+    # Tìm điểm số cao nhất
+    # max_score = max(hit["_score"] for hit in hits)?
+    
+    # Kiểm tra nếu điểm số cao nhất dưới ngưỡng
+    # if max_score < similarity_threshold:
+    #     return None, "Câu hỏi này không liên quan đến du lịch Bình Định."
+    
+    # Sắp xếp theo điểm tương đồng (score) để ưu tiên các tài liệu quan trọng
+    sorted_results = sorted(hits, key=lambda x: x.score, reverse=True)
+    
+    # Chọn các tài liệu sao cho tổng số token của context không vượt quá max_context_tokens
+    selected_results = []
+    current_tokens = 0
+    
+    for hit in sorted_results[:top_k]:
+        # Số token của tài liệu (lấy từ lúc index hoặc đếm một lần)
+        snippet_tokens = document_tokens(hit)
+        
+        # Nếu thêm tài liệu này vượt quá giới hạn token, bỏ qua
+        if current_tokens + snippet_tokens > max_context_tokens:
+            break
+        
+        selected_results.append(hit)
+        current_tokens += snippet_tokens
+    
+    if not selected_results:
+        return None, "Không tìm thấy nội dung phù hợp trong giới hạn token."
+    
+    return selected_results, None  # Trả về danh sách tài liệu đã chọn
+
+def unique_hits(hits):
+    """
+    Bỏ các hit trùng nội dung, giữ hit điểm cao nhất. Tài liệu gần trùng được gộp lúc nạp dữ liệu (ingest.py),
+    nhưng chỉ trong cùng một lần nạp: kiểm tra này bảo vệ index cũ và bài được nạp lại với link khác.
+    """
+    seen = set()
+    unique = []
+    for hit in sorted(hits, key=lambda x: x.score, reverse=True):
+        digest = hashlib.md5(f"{hit.title}\n{hit.content}".encode("utf-8")).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(hit)
+    return unique
+
+def choose_documents(query, vector, hits, top_k=2, max_context_tokens=5000):
+    """
+    Chọn tài liệu đưa vào prompt: top_k theo score (select_documents), hoặc khi bật RERANK thì
+    xếp hạng lại tập ứng viên rộng và chọn số tài liệu theo điểm (adaptive k).
+    Returns:
+        tuple: (danh sách tài liệu, lỗi nếu có).
+    """
+    hits = unique_hits(hits or [])
+    if not RERANK:
+        documents, error = select_documents(hits, top_k, max_context_tokens)
+        selection = "top_k"
+    elif not hits:
+        return None, "Mình không hiểu câu này lắm 😥. Bạn thử hỏi ngắn gọn hơn ^^"
+    else:
+        # Vài chục ứng viên, tính bằng NumPy chỉ mất vài ms nên chạy trực tiếp
+        with span("rerank"):
+            ranked = reranker.rerank(query, vector, hits)
+        documents = select_adaptive(
+            ranked, RERANK_MAX_K, min(max_context_tokens, RERANK_CONTEXT_TOKENS), RERANK_MIN_RELATIVE_SCORE
+        )
+        error = None if documents else "Không tìm thấy nội dung phù hợp trong giới hạn token."
+        documents = documents or None
+        selection = "rerank"
+
+    if documents:
+        CONTEXT_TOKENS.labels(selection).observe(sum(document_tokens(doc) for doc in documents))
+        CONTEXT_DOCUMENTS.labels(selection).observe(len(documents))
+    return documents, error
+
+def _compressed(compressed):
+    CONTEXT_TOKENS.labels("compressed").observe(sum(document_tokens(doc) for doc in compressed))
+    return compressed
+
+def compress_documents(query, vector, documents):
+    """
+    Chỉ giữ các câu liên quan tới câu hỏi trong từng tài liệu (CONTEXT_COMPRESSION). Lỗi thì dùng tài liệu gốc.
+    """
+    if not documents or CONTEXT_COMPRESSION == "off":
+        return documents
+    try:
+        with span("compress"):
+            return _compressed(compressor.compress(query, vector, documents))
+    except Exception as e:
+        print(f"⚠️ Lỗi khi rút gọn context: {str(e)}")
+        return documents
+
+async def compress_documents_async(query, vector, documents):
+    if not documents or CONTEXT_COMPRESSION == "off":
+        return documents
+    try:
+        with span("compress"):
+            return _compressed(await compressor.compress_async(query, vector, documents))
+    except Exception as e:
+        print(f"⚠️ Lỗi khi rút gọn context: {str(e)}")
+        return documents
+
+def semantic_search(query, top_k=2, max_context_tokens=5000, stop_event=None, vector=None, mode=None):
+    """
+    Tìm kiếm ngữ nghĩa qua retriever (Elasticsearch hoặc trong RAM), trả về danh sách tài liệu và context đã được giới hạn token.
     Args:
         query (str): Câu truy vấn.
         top_k (int): Số lượng tài liệu tối đa trả về.
         max_context_tokens (int): Số token tối đa cho phép của context.
         stop_event: Sự kiện để dừng tác vụ nếu cần.
+        vector (list): Embedding của câu truy vấn nếu đã tính trước.
+        mode (str): "script_score" hoặc "knn_hybrid" (mặc định theo RETRIEVAL_MODE).
     Returns:
         tuple: (danh sách tài liệu, lỗi nếu có).
     """
@@ -65,198 +445,91 @@ def semantic_search(query, top_k=2, max_context_tokens=5000, stop_event=None):
     
     # Chuyển query thành chữ thường và tạo embedding
     query = query.lower()
-    vector = get_embedding(query)
-    keywords = query.split()
-    
-    # Xây dựng truy vấn Elasticsearch
-    es_query = {
-        "size": top_k,
-        "query": {
-            "bool": {
-                "must": [
-                    {
-                         "match": {
-                            "text": {
-                                "query": query,
-                                "operator": "or",
-                                "minimum_should_match": "60%"
-                            }
-                        }
-                    }
-                ],
-                "should": [
-                    {
-                        "match": {
-                            "text": {
-                                "query": query,
-                                "operator": "or",
-                                "fuzziness": "AUTO"
-                            }
-                        }
-                    },
-                    {
-                        "script_score": {
-                            "query": {"match_all": {}},
-                            "script": {
-                                "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                                "params": {"query_vector": vector}
-                            }
-                        }
-                    }
-                ],
-                "minimum_should_match": 1
-            }
-        },
-        "highlight": {
-            "fields": {
-                "text": {
-                    "pre_tags": ["<mark>"],
-                    "post_tags": ["</mark>"]
-                }
-            }
-        }
-    }
+    if vector is None:
+        vector = get_embedding(query)
     
     try:
-        res = es.search(index=INDEX_NAME, body=es_query)
+        hits = retriever.search(query, vector, RERANK_CANDIDATES if RERANK else top_k, mode)
         if stop_event and stop_event.is_set():
             return None, "Tác vụ tìm kiếm đã bị dừng."
-        # print(res["hits"]["hits"])
-        if not res["hits"]["hits"]:
-            return None, "Mình không hiểu câu này lắm 😥. Bạn thử hỏi ngắn gọn hơn ^^"
-        
-        # Tìm điểm số cao nhất
-        # max_score = max(hit["_score"] for hit in res["hits"]["hits"])?
-        
-        # Kiểm tra nếu điểm số cao nhất dưới ngưỡng
-        # if max_score < similarity_threshold:
-        #     return None, "Câu hỏi này không liên quan đến du lịch Bình Định."
-        
-        # Lọc trùng lặp dựa trên nội dung tài liệu
-        results = res["hits"]["hits"]
-        seen_hashes = set()
-        unique_results = []
-        for hit in results:
-            source = hit['_source']
-            doc_content = f"{source.get('title', '')}{source.get('content', '')}{source.get('link', '')}"
-            doc_hash = hashlib.md5(doc_content.encode('utf-8')).hexdigest()
-            if doc_hash not in seen_hashes:
-                seen_hashes.add(doc_hash)
-                unique_results.append(hit)
-        
-        if not unique_results:
-            return None, "Không tìm thấy kết quả nào chứa từ khóa."
-        
-        # Sắp xếp theo điểm tương đồng (_score) để ưu tiên các tài liệu quan trọng
-        sorted_results = sorted(unique_results, key=lambda x: x["_score"], reverse=True)
-        
-        # Chọn các tài liệu sao cho tổng số token của context không vượt quá max_context_tokens
-        selected_results = []
-        current_tokens = 0
-        
-        for hit in sorted_results[:top_k]:
-            # Tạo chuỗi context cho tài liệu này
-            context_snippet = f"**{hit['_source']['title']}**\n{hit['_source']['content']}\n{hit['_source']['link']}"
-            snippet_tokens = len(encoding.encode(context_snippet))
-            
-            # Nếu thêm tài liệu này vượt quá giới hạn token, bỏ qua
-            if current_tokens + snippet_tokens > max_context_tokens:
-                break
-            
-            selected_results.append(hit)
-            current_tokens += snippet_tokens
-        
-        if not selected_results:
-            return None, "Không tìm thấy nội dung phù hợp trong giới hạn token."
-        
-        # Tạo context từ các tài liệu đã chọn
-        context = "\n".join([f"**{hit['_source']['title']}**\n{hit['_source']['content']}\n{hit['_source']['link']}" for hit in selected_results])
-        
-        # In context để kiểm tra (có thể bỏ comment nếu cần)
-        print("===== KẾT QUẢ ELASTICSEARCH TÌM ĐƯỢC =====")
-        print(context)
-        print(f"Số token của context: {len(encoding.encode(context))}")
-        # print("Max_score: ", max_score)
-        return selected_results, None  # Trả về danh sách tài liệu đã chọn
+        documents, error = choose_documents(query, vector, hits, top_k, max_context_tokens)
     
+    except Exception as e:
+        return None, f"Lỗi Elasticsearch: {str(e)}"
+    return compress_documents(query, vector, documents), error
+
+async def semantic_search_async(query, top_k=2, max_context_tokens=5000, vector=None, mode=None):
+    """
+    Phiên bản bất đồng bộ của semantic_search (AsyncElasticsearch + embedding async).
+    Args:
+        query (str): Câu truy vấn.
+        top_k (int): Số lượng tài liệu tối đa trả về.
+        max_context_tokens (int): Số token tối đa cho phép của context.
+        vector (list): Embedding của câu truy vấn nếu đã tính trước.
+        mode (str): "script_score" hoặc "knn_hybrid" (mặc định theo RETRIEVAL_MODE).
+    Returns:
+        tuple: (danh sách tài liệu, lỗi nếu có).
+    """
+    query = query.lower()
+    if vector is None:
+        vector = await embed_query_async(query)
+    
+    size = RERANK_CANDIDATES if RERANK else top_k
+    try:
+        with span("search"):
+            hits = await search_flight.do(
+                fingerprint(query, size, mode),
+                lambda: retriever.search_async(query, vector, size, mode),
+            )
+        documents, error = choose_documents(query, vector, hits, top_k, max_context_tokens)
     
     except Exception as e:
+        UPSTREAM_ERRORS.labels("elasticsearch").inc()
         return None, f"Lỗi Elasticsearch: {str(e)}"
+    return await compress_documents_async(query, vector, documents), error
     
-def build_prompt(documents, query: str, max_context_tokens=5000) -> str:
+def build_messages(query, documents, history, max_total_tokens=8000):
     """
-    Xây dựng prompt cho LLM, đảm bảo tổng số token của context không vượt quá giới hạn.
+    Tạo danh sách messages gửi LLM, đảm bảo tổng số token không vượt quá giới hạn.
     Args:
-        documents: Danh sách tài liệu từ semantic_search.
         query (str): Câu truy vấn.
-        max_context_tokens (int): Số token tối đa cho context.
+        documents: Danh sách tài liệu từ semantic_search.
+        history: Lịch sử hội thoại.
+        max_total_tokens (int): Số token tối đa cho toàn bộ messages.
     Returns:
-        str: Prompt đã được tối ưu số token.
-    """
-    # Prompt hệ thống rút gọn
-    system_prompt = (
-        "Bạn là hướng dẫn viên du lịch thân thiện, chuyên về Bình Định, được tạo bởi **Nguyễn Bá Lâm** (Phù Mỹ, Bình Định).\n"
-        "Trả lời gần gũi, đúng trọng tâm, dùng **Markdown**:\n"
-        "- Ưu tiên dữ liệu bên dưới, bổ sung kiến thức ngoài nếu cần (ghi rõ).\n"
-        "- Nếu người dùng hỏi nhiều ý (ví dụ: địa điểm + món ăn), hãy cố gắng trả lời đầy đủ cả hai nếu liên quan đến Bình Định."
-        "- Giữ câu trả lời ~400 token, dùng gạch đầu dòng (-), in đậm **tiêu đề**.\n"
-        "- Từ chối lịch sự nếu không liên quan đến du lịch, văn hóa, lịch sử Bình Định.\n"
-        "- Chỉ dùng liên kết của tài liệu đầu tiên.\n"
+        tuple: (messages, totals) với totals là số token của từng phần.
+    """
+    messages, totals = assemble_messages(
+        SYSTEM_PROMPT, documents, history, query,
+        max_total_tokens=max_total_tokens, max_context_tokens=5000,
+        max_history_tokens=MAX_HISTORY_TOKENS, max_history_messages=MAX_HISTORY_MESSAGES,
+        system_tokens=SYSTEM_PROMPT_TOKENS,
     )
-    
-    if documents:
-        # Tạo context với thông tin tài liệu
-        context_parts = []
-        current_tokens = 0
-        
-        for doc in documents:
-            snippet = f"**{doc['_source']['title']}**\n{doc['_source']['content']}"
-            snippet_tokens = len(encoding.encode(snippet))
-            
-            if current_tokens + snippet_tokens > max_context_tokens:
-                break
-                
-            context_parts.append(snippet)
-            current_tokens += snippet_tokens
-        
-        context = "\n\n".join(context_parts)
-        
-        prompt = (
-            f"{system_prompt}\n\n"
-            f"**Dữ liệu chính:**\n{context}\n\n"
-            f"**Câu hỏi:** {query}\n\n"
-        )
-        
-        # Kiểm tra tổng số token của prompt (không tính link)
-        total_tokens = len(encoding.encode(prompt))
-        print(f"Số token của prompt (không tính history): {total_tokens}")
-        
-        return prompt
-    else:
-        return (
-            f"{system_prompt}\n\n"
-            f"**Xin lỗi nhé!** Mình không có dữ liệu chính về “{query}”. "
-            "Hỏi mình về du lịch Bình Định nhé! 😊"
-        )
-    
-def truncate_text(text, max_tokens):
+    PROMPT_TOKENS.observe(totals["total"])
+    return messages, totals
+
+def finalize_response(content, documents):
     """
-    Cắt bớt văn bản để không vượt quá số token cho phép.
+    Hậu xử lý câu trả lời: thêm liên kết "Đọc thêm" và cắt phần kết thúc dở dang.
     Args:
-        text (str): Văn bản cần cắt.
-        max_tokens (int): Số token tối đa.
+        content (str): Nội dung LLM trả về.
+        documents: Danh sách tài liệu từ semantic_search.
     Returns:
-        str: Văn bản đã cắt bớt.
+        str: Câu trả lời hoàn chỉnh.
     """
-    if not text:
-        return text
-    tokens = encoding.encode(text)
-    if len(tokens) <= max_tokens:
-        return text
-    truncated_tokens = tokens[:max_tokens]
-    return encoding.decode(truncated_tokens)
+    # Đảm bảo câu trả lời kết thúc tự nhiên (trước khi thêm liên kết để không cắt mất thẻ </a>)
+    if content.endswith("...") or not content.strip().endswith(("!", ".", "?", "😊")):
+        last_punct = max(content.rfind(p) for p in [".", "!", "?", "😊"])
+        if last_punct != -1:
+            content = content[:last_punct + 1]
+    
+    # Thêm liên kết của tài liệu đầu tiên
+    if documents:
+        content += f'\n\n<a href="{documents[0].link}">Đọc thêm tại đây nhé😊</a>'
+    
+    return content
 
-def generate_response(query, documents, history, client, stop_event=None, max_total_tokens=8000):
+def generate_response(query, documents, history, client, stop_event=None, max_total_tokens=8000, model=None):
     """
     Tạo phản hồi từ GPT-4o-mini, đảm bảo tổng số token không vượt quá giới hạn.
     Args:
@@ -266,84 +539,16 @@ def generate_response(query, documents, history, client, stop_event=None, max_to
         client: Client để gọi LLM.
         stop_event: Sự kiện để dừng tác vụ.
         max_total_tokens (int): Số token tối đa cho toàn bộ messages.
+        model (str): Model trả lời (mặc định model mặc định của router).
     Returns:
         tuple: (phản hồi, lỗi nếu có).
     """
+    model = model_router.resolve(model)
     if stop_event and stop_event.is_set():
         return None, "Tác vụ trả lời đã bị dừng."
     
     try:
-        # Xây dựng prompt
-        prompt = build_prompt(documents, query, max_context_tokens=5000)
-        
-        # Tạo messages
-        messages = [{"role": "system", "content": prompt}]
-        
-        # Giới hạn history (chỉ lấy 5 tin nhắn gần nhất)
-        history = history[-5:] if len(history) > 5 else history
-        
-        # Thêm history vào messages, cắt bớt nếu cần
-        history_tokens = 0
-        truncated_history = []
-        for msg in history:
-            role = msg["role"]
-            if role == "bot":
-                role = "assistant"
-            content = msg["content"]
-            msg_tokens = len(encoding.encode(content))
-            
-            if history_tokens + msg_tokens > 1000:  # Giới hạn history dưới 1000 token
-                content = truncate_text(content, 1000 - history_tokens)
-                msg_tokens = len(encoding.encode(content))
-            
-            history_tokens += msg_tokens
-            truncated_history.append({"role": role, "content": content})
-        
-        messages.extend(truncated_history)
-        messages.append({"role": "user", "content": query})
-        
-        # Tính tổng số token của messages
-        total_tokens = sum(len(encoding.encode(msg["content"])) for msg in messages)
-        print(f"Tổng số token của messages (ban đầu): {total_tokens}")
-        
-        # Nếu vượt quá giới hạn, cắt bớt context và query
-        if total_tokens > max_total_tokens:
-            # Ước tính số token của system prompt và history
-            system_tokens = len(encoding.encode(messages[0]["content"]))
-            history_tokens = sum(len(encoding.encode(msg["content"])) for msg in messages[1:-1])
-            query_tokens = len(encoding.encode(query))
-            
-            # Số token còn lại cho context
-            remaining_tokens = max_total_tokens - (system_tokens + history_tokens + query_tokens)
-            if remaining_tokens < 1000:  # Nếu không đủ chỗ cho context, cắt bớt query
-                remaining_tokens = max(1000, remaining_tokens)
-                max_query_tokens = max_total_tokens - (system_tokens + history_tokens + remaining_tokens)
-                query = truncate_text(query, max_query_tokens)
-                messages[-1]["content"] = query
-                query_tokens = len(encoding.encode(query))
-                remaining_tokens = max_total_tokens - (system_tokens + history_tokens + query_tokens)
-            
-            # Cắt bớt context trong prompt
-            if documents:
-                context_parts = []
-                current_tokens = 0
-                for doc in documents:
-                    snippet = f"**{doc['_source']['title']}**\n{doc['_source']['content']}"
-                    snippet_tokens = len(encoding.encode(snippet))
-                    if current_tokens + snippet_tokens > remaining_tokens:
-                        break
-                    context_parts.append(snippet)
-                    current_tokens += snippet_tokens
-                
-                context = "\n\n".join(context_parts)
-                messages[0]["content"] = (
-                    f"{messages[0]['content'].split('**Dữ liệu chính:**')[0]}"
-                    f"**Dữ liệu chính:**\n{context}\n\n"
-                    f"**Câu hỏi:** {query}\n\n"
-                )
-            
-            total_tokens = sum(len(encoding.encode(msg["content"])) for msg in messages)
-            print(f"Tổng số token của messages (sau khi cắt): {total_tokens}")
+        messages, _ = build_messages(query, documents, history, max_total_tokens)
         
         # Gửi đến LLM
         result_queue = queue.Queue()
@@ -351,16 +556,18 @@ def generate_response(query, documents, history, client, stop_event=None, max_to
         def run_openai():
             try:
                 response = client.chat.completions.create(
-                    model=model_name,
+                    model=model,
                     messages=messages,
                     max_tokens=500,
                     temperature=0.5,
+                    timeout=30,
                 )
                 result_queue.put((response.choices[0].message.content, None))
             except Exception as e:
                 result_queue.put((None, f"Lỗi LLM: {str(e)}"))
         
-        openai_thread = threading.Thread(target=run_openai)
+        # Thread tự kết thúc khi lời gọi HTTP hết hạn, không bị bỏ lại chạy tiếp sau join(timeout)
+        openai_thread = threading.Thread(target=run_openai, daemon=True)
         openai_thread.start()
         openai_thread.join(timeout=30)
         
@@ -376,25 +583,185 @@ def generate_response(query, documents, history, client, stop_event=None, max_to
         if stop_event and stop_event.is_set():
             return None, "Tác vụ trả lời đã bị dừng."
         
-        # Thêm liên kết của tài liệu đầu tiên
-        if documents:
-            first_doc = documents[0]['_source']
-            content += f'\n\n<a href="{first_doc["link"]}">Đọc thêm tại đây nhé😊</a>'
-        
-        # Đảm bảo câu trả lời kết thúc tự nhiên
-        if content.endswith("...") or not content.strip().endswith(("!", ".", "?", "😊")):
-            last_punct = max(content.rfind(p) for p in [".", "!", "?", "😊"])
-            if last_punct != -1:
-                content = content[:last_punct + 1]
-        
-        return content, None
+        return finalize_response(content, documents), None
     
     except Exception as e:
         return None, f"Lỗi trong generate_response: {str(e)}"
+
+async def generate_response_async(query, documents, history, client, max_total_tokens=8000, timeout=30, model=None):
+    """
+    Phiên bản bất đồng bộ của generate_response (dùng AsyncOpenAI, không tạo thread).
+    Các lời gọi cùng câu hỏi, tài liệu, history và model đang chạy đồng thời dùng chung một lần gọi LLM.
+    Args:
+        query (str): Câu truy vấn.
+        documents: Danh sách tài liệu từ semantic_search_async.
+        history: Lịch sử hội thoại.
+        client: AsyncOpenAI client.
+        max_total_tokens (int): Số token tối đa cho toàn bộ messages.
+        timeout (float): Thời gian chờ tối đa cho LLM (giây).
+        model (str): Model chính của request (có thể được model dự phòng trả lời thay, xem ModelRouter).
+    Returns:
+        tuple: (phản hồi, lỗi nếu có, model đã trả lời hoặc None nếu lỗi).
+    """
+    model = model_router.resolve(model)
+    doc_ids = [doc.id for doc in documents or []]
+    key = fingerprint(normalize_query(query), doc_ids, history, model, max_total_tokens)
+    return await generate_flight.do(
+        key, lambda: _generate_response_async(query, documents, history, client, max_total_tokens, timeout, model)
+    )
+
+async def _generate_response_async(query, documents, history, client, max_total_tokens, timeout, model):
+    try:
+        with span("prompt"):
+            messages, totals = build_messages(query, documents, history, max_total_tokens)
+        
+        start = time.perf_counter()
+        try:
+            with span("llm"):
+                response, answered = await asyncio.wait_for(
+                    model_router.call(
+                        model,
+                        lambda target: client.chat.completions.create(
+                            model=target,
+                            messages=messages,
+                            max_tokens=500,
+                            temperature=0.5,
+                        ),
+                    ),
+                    timeout=timeout,
+                )
+        except asyncio.TimeoutError:
+            TIMEOUTS.labels("llm").inc()
+            return None, "Mình xử lý hơi lâu, bạn hỏi lại nhé!", None
+        except Exception as e:
+            UPSTREAM_ERRORS.labels("llm").inc()
+            return None, f"Lỗi LLM: {str(e)}", None
+        
+        content = response.choices[0].message.content
+        LLM_ANSWERS.labels(answered).inc()
+        record_usage(
+            getattr(response, "usage", None), time.perf_counter() - start, totals["total"], count_tokens(content)
+        )
+        with span("postprocess"):
+            return finalize_response(content, documents), None, answered
+    
+    except Exception as e:
+        return None, f"Lỗi trong generate_response: {str(e)}", None
        
-def process_query(query, history, result_queue, stop_event):
+async def _open_stream(client, model, messages, extra):
+    """
+    Mở stream và chờ chunk đầu tiên (hedging theo thời gian tới chunk đầu).
+    Returns:
+        tuple: (stream, iterator, chunk đầu tiên hoặc None).
+    """
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=500,
+        temperature=0.5,
+        stream=True,
+        **extra,
+    )
+    chunks = stream.__aiter__()
+    try:
+        first = await anext(chunks, None)
+    except BaseException:
+        # Lỗi hoặc bị hủy (thua hedge): đóng kết nối HTTP ngay
+        await stream.close()
+        raise
+    return stream, chunks, first
+
+async def _close_stream(opened):
+    await opened[0].close()
+
+async def stream_response_async(query, documents, history, client, max_total_tokens=8000, timeout=30, model=None):
+    """
+    Gọi LLM với stream=True và trả về từng phần câu trả lời.
+    Args:
+        query (str): Câu truy vấn.
+        documents: Danh sách tài liệu từ semantic_search_async.
+        history: Lịch sử hội thoại.
+        client: AsyncOpenAI client.
+        max_total_tokens (int): Số token tối đa cho toàn bộ messages.
+        timeout (float): Thời gian tối đa cho cả lượt sinh câu trả lời (giây).
+        model (str): Model chính của request (có thể được model dự phòng trả lời thay, xem ModelRouter).
+    Yields:
+        tuple: (sự kiện, dữ liệu) với sự kiện là "model" (model thực sự trả lời, trước token đầu tiên),
+        "token" (phần mới), "done" (câu trả lời đã hậu xử lý: thêm liên kết, cắt phần dở dang) hoặc "error".
+    """
+    model = model_router.resolve(model)
+    parts = []
+    usage = None
+    try:
+        with span("prompt"):
+            messages, totals = build_messages(query, documents, history, max_total_tokens)
+        extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+        start = time.perf_counter()
+        # Deadline áp cho từng lần chờ chunk (không yield bên trong asyncio.timeout)
+        deadline = asyncio.get_running_loop().time() + timeout
+        async with asyncio.timeout_at(deadline):
+            (stream, chunks, chunk), answered = await model_router.call(
+                model, lambda target: _open_stream(client, target, messages, extra), kind="stream", discard=_close_stream
+            )
+        LLM_ANSWERS.labels(answered).inc()
+        yield "model", answered
+        try:
+            while chunk is not None:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        observe("llm_ttft", time.perf_counter() - start)
+                    parts.append(delta)
+                    yield "token", delta
+                async with asyncio.timeout_at(deadline):
+                    chunk = await anext(chunks, None)
+        finally:
+            # Đóng kết nối HTTP của stream ngay (hết hạn, lỗi hoặc client ngắt kết nối)
+            await stream.close()
+        llm_seconds = time.perf_counter() - start
+        observe("llm", llm_seconds)
+    except TimeoutError:
+        TIMEOUTS.labels("llm").inc()
+        yield "error", "Mình xử lý hơi lâu, bạn hỏi lại nhé!"
+        return
+    except Exception as e:
+        UPSTREAM_ERRORS.labels("llm").inc()
+        yield "error", f"Lỗi LLM: {str(e)}"
+        return
+    
+    content = "".join(parts)
+    record_usage(usage, llm_seconds, totals["total"], count_tokens(content))
+    with span("postprocess"):
+        final = finalize_response(content, documents)
+    yield "done", final
+
+def process_query(query, history, result_queue, stop_event, speculative=None):
+    if speculative is None:
+        speculative = SPECULATIVE_RETRIEVAL
+    
+    # Embedding dùng chung cho bộ phân loại cục bộ và tìm kiếm
+    try:
+        vector = get_embedding(query.lower())
+    except Exception as e:
+        UPSTREAM_ERRORS.labels("embedding").inc()
+        result_queue.put((None, f"Lỗi embedding: {str(e)}"))
+        return
+
+    # Chế độ speculative: tìm kiếm chạy trong thread khác trong lúc phân loại
+    search_future = None
+    search_stop = threading.Event()
+    if speculative:
+        search_future = _search_executor.submit(semantic_search, query, stop_event=search_stop, vector=vector)
+    
      # Phân loại câu hỏi
-    label = classify_query_intent(query, client)
+    label = classify_query_intent(query, client, vector=vector)
+    
+    if label in ("greeting", "unrelated") and search_future:
+        # Bỏ kết quả tìm kiếm, không cần dùng
+        search_stop.set()
+        search_future.cancel()
     
     if label == "greeting":
         result_queue.put((
@@ -412,7 +779,10 @@ def process_query(query, history, result_queue, stop_event):
         return
     #Yes
     # Tìm kiếm ngữ nghĩa
-    documents, error = semantic_search(query, stop_event=stop_event)
+    if search_future:
+        documents, error = search_future.result()
+    else:
+        documents, error = semantic_search(query, stop_event=stop_event, vector=vector)
     if stop_event.is_set():
         result_queue.put((None, "Mình xử lý hơi lâu, bạn hỏi lại nhé!"))
         return
@@ -432,6 +802,57 @@ def process_query(query, history, result_queue, stop_event):
     else:
         result_queue.put((response, None))
 
+def _discard_task(task):
+    """
+    Hủy task tìm kiếm speculative và nuốt exception (nếu có) để không bị log cảnh báo.
+    """
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def classify_and_search_async(query, client, speculative=None, top_k=2, max_context_tokens=5000, vector=None,
+                                    classifier_model=None):
+    """
+    Phân loại intent và tìm kiếm tài liệu. Ở chế độ speculative, Elasticsearch chạy
+    đồng thời với phân loại, nên thời gian chờ là max(phân loại, tìm kiếm) thay vì tổng.
+    Embedding của câu hỏi được tính một lần, dùng chung cho bộ phân loại cục bộ và tìm kiếm.
+    Args:
+        query (str): Câu truy vấn.
+        client: AsyncOpenAI client dùng để phân loại.
+        speculative (bool): Bật/tắt chạy song song (mặc định theo SPECULATIVE_RETRIEVAL).
+        top_k (int): Số lượng tài liệu tối đa trả về.
+        max_context_tokens (int): Số token tối đa cho phép của context.
+        vector (list): Embedding của câu hỏi nếu đã tính trước.
+        classifier_model (str): Model của bộ phân loại (mặc định LLM_CLASSIFIER_MODEL).
+    Returns:
+        tuple: (intent, danh sách tài liệu, lỗi nếu có). Tài liệu là None nếu intent khác 'related'.
+    """
+    if speculative is None:
+        speculative = SPECULATIVE_RETRIEVAL
+    
+    if vector is None:
+        vector = await embed_query_async(query)
+    
+    if not speculative:
+        intent = await classify_query_intent_async(query, client, vector=vector, model=classifier_model)
+        if intent != "related":
+            return intent, None, None
+        documents, error = await semantic_search_async(query, top_k, max_context_tokens, vector=vector)
+        return intent, documents, error
+    
+    search_task = asyncio.create_task(semantic_search_async(query, top_k, max_context_tokens, vector=vector))
+    try:
+        intent = await classify_query_intent_async(query, client, vector=vector, model=classifier_model)
+    except BaseException:
+        _discard_task(search_task)
+        raise
+    
+    if intent != "related":
+        _discard_task(search_task)
+        return intent, None, None
+    
+    documents, error = await search_task
+    return intent, documents, error
+
 def check_for_stop(timeout=0.1):
     if sys.stdin in select.select([sys.stdin], [], [], timeout)[0]:
         line = sys.stdin.readline().strip()
@@ -439,48 +860,93 @@ def check_for_stop(timeout=0.1):
             return True
     return False
 
+CLASSIFY_SYSTEM_PROMPT = (
+    "Bạn là bộ phân loại thông minh. Phân loại câu hỏi đầu vào thành 1 trong 3 loại sau:\n"
+    "- related: nếu liên quan đến du lịch, văn hóa, lịch sử, ẩm thực, ăn uống, vui chơi ở Bình Định\n"
+    "- unrelated: nếu không liên quan gì đến chủ đề trên\n"
+    "- greeting: nếu là lời chào hỏi, cảm ơn, chúc, tạm biệt, v.v.\n\n"
+    "Chỉ trả lời 1 từ: related / unrelated / greeting.\n"
+    "Ví dụ:\n"
+    "- 'Có những địa điểm du lịch nào ở Quy Nhơn?' → related\n"
+    "- 'Tôi nên học Python ở đâu?' → unrelated\n"
+    "- 'Chào bạn!' → greeting\n"
+    "- 'Tạm biệt nhé, hẹn gặp lại!' → greeting\n"
+    "- 'Nghệ thuật hát tuồng ở Bình Định ra sao?' → related\n"
+    "- 'iPhone 15 ra mắt năm nào?' → unrelated\n"
+)
+
+def build_classify_messages(query: str):
+    return [
+        {"role": "system", "content": CLASSIFY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Câu hỏi: {query}\nTrả lời (related/unrelated/greeting):"}
+    ]
+
+def parse_intent_label(content: str) -> str:
+    label = content.strip().lower()
+    return label if label in ["related", "unrelated", "greeting"] else "related"
+
 #hàm dùng GPT đánh giá câu hỏi có thuộc lĩnh vực chatbot học không?
-def classify_query_intent(query: str, client) -> str:
+def classify_query_intent(query: str, client, vector=None) -> str:
     """
     Phân loại câu hỏi thành:
     - 'related': liên quan đến du lịch, văn hóa, lịch sử ở Bình Định
     - 'unrelated': không liên quan
     - 'greeting': lời chào, cảm ơn, tạm biệt, xã giao
+    Thử bộ phân loại cục bộ trước (nếu có embedding), chỉ gọi GPT khi không đủ tin cậy.
     """
-    system_prompt = (
-        "Bạn là bộ phân loại thông minh. Phân loại câu hỏi đầu vào thành 1 trong 3 loại sau:\n"
-        "- related: nếu liên quan đến du lịch, văn hóa, lịch sử, ẩm thực, ăn uống, vui chơi ở Bình Định\n"
-        "- unrelated: nếu không liên quan gì đến chủ đề trên\n"
-        "- greeting: nếu là lời chào hỏi, cảm ơn, chúc, tạm biệt, v.v.\n\n"
-        "Chỉ trả lời 1 từ: related / unrelated / greeting.\n"
-        "Ví dụ:\n"
-        "- 'Có những địa điểm du lịch nào ở Quy Nhơn?' → related\n"
-        "- 'Tôi nên học Python ở đâu?' → unrelated\n"
-        "- 'Chào bạn!' → greeting\n"
-        "- 'Tạm biệt nhé, hẹn gặp lại!' → greeting\n"
-        "- 'Nghệ thuật hát tuồng ở Bình Định ra sao?' → related\n"
-        "- 'iPhone 15 ra mắt năm nào?' → unrelated\n"
-    )
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": f"Câu hỏi: {query}\nTrả lời (related/unrelated/greeting):"}
-    ]
-
+    if LOCAL_INTENT_CLASSIFIER:
+        if vector is not None and not local_classifier.ready:
+            try:
+                local_classifier.warm_up()
+            except Exception as e:
+                print(f"Không tính được centroid phân loại intent, dùng LLM: {str(e)}")
+        label, _ = local_classifier.classify(query, vector)
+        if label:
+            return label
+    
     try:
         response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
+            model=model_router.classifier_model,
+            messages=build_classify_messages(query),
             max_tokens=5,
             temperature=0,
         )
-        label = response.choices[0].message.content.strip().lower()
-        print(f"[DEBUG] GPT phân loại '{query}' → {label}")
-        return label if label in ["related", "unrelated", "greeting"] else "related"
+        return parse_intent_label(response.choices[0].message.content)
     except Exception as e:
         print("Lỗi khi phân loại câu hỏi:", str(e))
         return "related"
 
+async def classify_query_intent_async(query: str, client, vector=None, model=None) -> str:
+    """
+    Phiên bản bất đồng bộ của classify_query_intent (client là AsyncOpenAI).
+    Gọi LLM bằng model của bộ phân loại (model mặc định: LLM_CLASSIFIER_MODEL) qua router.
+    """
+    model = model or model_router.classifier_model
+    with span("classify"):
+        if LOCAL_INTENT_CLASSIFIER:
+            label, _ = local_classifier.classify(query, vector)
+            if label:
+                return label
+        
+        try:
+            response, _ = await classify_flight.do(
+                fingerprint(normalize_query(query), model),
+                lambda: model_router.call(
+                    model,
+                    lambda target: client.chat.completions.create(
+                        model=target,
+                        messages=build_classify_messages(query),
+                        max_tokens=5,
+                        temperature=0,
+                    ),
+                    kind="classify",
+                ),
+            )
+            return parse_intent_label(response.choices[0].message.content)
+        except Exception:
+            UPSTREAM_ERRORS.labels("llm_classify").inc()
+            return "related"
+
 def chatbot():
     history = []
     print("💬 Chào bạn! Mình là chatbot du lịch Bình Định. Hỏi mình bất cứ điều gì nhé! (Nhập 'exit' để thoát, hoặc 'stop' để dừng tác vụ đang chạy)")
@@ -1,14 +1,58 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 # from llm import semantic_search, generate_response, classify_query_intent, client
-from llm_cloud import semantic_search, generate_response, classify_query_intent, client, set_model_name
+from llm_cloud import (
+    classify_and_search_async, generate_response_async, stream_response_async, embed_query_async, chat_flight,
+    lookup_cached_answer, store_cached_answer, model_router,
+    async_client, aclose_clients, warm_up_async, local_classifier, embedding_cache, embedding_batcher,
+    answer_cache, session_store,
+)
+from intent_classifier import normalize_query
+from single_flight import fingerprint
+from admission import AdmissionController, Overloaded
+from metrics import (
+    span, start_trace, trace_payload, render_metrics, stats_collector, REQUEST_SECONDS, TIMEOUTS, UPSTREAM_ERRORS,
+)
 import time
 import asyncio
+import json
 import os
 
-app = FastAPI()
+GREETING_RESPONSE = "🥰 Chào bạn nha! Mình luôn sẵn sàng hỗ trợ nếu bạn cần tìm hiểu về du lịch Bình Định nè!"
+UNRELATED_RESPONSE = "😥 Xin lỗi, câu hỏi của bạn nằm ngoài lĩnh vực du lịch, văn hóa, lịch sử Bình Định. Bạn thử hỏi mình những câu liên quan đến vùng đất này nha!"
+EMBEDDING_ERROR_RESPONSE = "😥 Mình đang gặp sự cố khi xử lý câu hỏi, bạn thử lại sau nhé!"
+TIMEOUT_RESPONSE = "Mình xử lý hơi lâu, bạn hỏi lại nhé!"
+OVERLOADED_RESPONSE = "😥 Hiện có quá nhiều người hỏi cùng lúc, bạn thử lại sau ít giây nhé!"
+
+# Hạn chót cho cả request; hết hạn (hoặc client ngắt kết nối) thì các lời gọi Elasticsearch/embedding/LLM
+# đang chạy bị hủy theo
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Giới hạn số request xử lý đồng thời, phần vượt quá chờ trong hàng đợi có giới hạn (429/503 kèm Retry-After)
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_REQUESTS", "32")),
+    max_queue=int(os.getenv("MAX_QUEUED_REQUESTS", "64")),
+    queue_timeout=float(os.getenv("QUEUE_TIMEOUT", "5")),
+)
+stats_collector.add("admission", admission.stats, counters=("admitted", "rejected_queue_full", "rejected_timeout"))
+
+class ClientDisconnected(Exception):
+    pass
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up_async()
+    yield
+    # Đóng các connection pool khi tắt server
+    await aclose_clients()
+
+app = FastAPI(lifespan=lifespan)
 # port = int(os.getenv("PORT", 8000))
 
 # Cho phép CORS để React kết nối
@@ -23,82 +67,319 @@ app.add_middleware(
 # Định nghĩa model cho request body
 class ChatRequest(BaseModel):
     query: str
-    history: List[Dict[str, str]]
+    # Có session_id thì history lấy từ SessionStore, client không cần gửi lại cả cuộc hội thoại
+    session_id: Optional[str] = None
+    history: List[Dict[str, str]] = []
+    # Model trả lời cho riêng request này (None: model mặc định của server)
+    model: Optional[str] = None
+
+def request_model(request: ChatRequest):
+    """
+    Model của request, xác định một lần lúc nhận request (đổi model mặc định giữa chừng không ảnh hưởng).
+    """
+    try:
+        return model_router.resolve(request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def request_history(request: ChatRequest):
+    if request.session_id:
+        return session_store.history(request.session_id)
+    return request.history
+
+def remember_turn(request: ChatRequest, response):
+    """
+    Lưu câu hỏi và câu trả lời vào session (nếu request có session_id).
+    """
+    if request.session_id:
+        session_store.append(request.session_id, "user", request.query)
+        session_store.append(request.session_id, "assistant", response)
+        # Tóm tắt các tin nhắn cũ ở task nền (HISTORY_SUMMARY), không làm chậm câu trả lời
+        session_store.schedule_compaction(request.session_id)
 class SetModelRequest(BaseModel):
     model_name: str
     
-# ===== API đổi model =====
+# ===== API đổi model mặc định (request có thể chọn model riêng qua trường model) =====
 @app.post("/set_model")
 async def set_model(request: SetModelRequest):
     try:
-        set_model_name(request.model_name)
-        print(f"✅ Đã đổi model thành: {request.model_name}")
+        model_router.set_default_model(request.model_name)
+        print(f"✅ Đã đổi model mặc định thành: {request.model_name}")
         return {"message": f"Đã đổi model thành {request.model_name}"}
-    except Exception as e:
+    except ValueError as e:
         print(f"❌ Lỗi đổi model: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ===== Danh sách model và model mặc định =====
+@app.get("/models")
+async def models():
+    return {
+        "models": model_router.models,
+        "default": model_router.default_model,
+        "classifier": model_router.classifier_model,
+    }
+
+# ===== Thống kê router model (hedging, fallback, trạng thái circuit breaker) =====
+@app.get("/model_stats")
+async def model_stats():
+    return model_router.stats()
     
+# ===== Thống kê bộ phân loại intent cục bộ (để tinh chỉnh ngưỡng) =====
+@app.get("/intent_stats")
+async def intent_stats():
+    return local_classifier.stats()
+
+# ===== Thống kê cache embedding (hit ratio, dung lượng) =====
+@app.get("/embedding_cache_stats")
+async def embedding_cache_stats():
+    return await asyncio.to_thread(embedding_cache.stats)
+
+# ===== Thống kê micro-batching embedding =====
+@app.get("/embedding_batch_stats")
+async def embedding_batch_stats():
+    return embedding_batcher.stats()
+
+# ===== Thống kê cache câu trả lời =====
+@app.get("/answer_cache_stats")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+# ===== Xóa history của một cuộc hội thoại =====
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    session_store.delete(session_id)
+    return {"message": "Đã xóa session"}
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+async def embed_query(query):
+    """
+    Embedding câu hỏi (dùng chung cho cache câu trả lời, phân loại và tìm kiếm). Trả về None nếu lỗi.
+    """
+    try:
+        with span("embed"):
+            return await embed_query_async(query)
+    except Exception:
+        UPSTREAM_ERRORS.labels("embedding").inc()
+        return None
+
+async def answer_query(query, history, current_model):
+    """
+    Toàn bộ pipeline của /chat cho một câu hỏi.
+    Returns:
+        tuple: (payload, outcome) với outcome dùng cho metric (ok, cached, greeting, unrelated, error).
+    """
+    vector = await embed_query(query)
+    if vector is None:
+        return {"response": EMBEDDING_ERROR_RESPONSE, "error": True, "source": None}, "error"
+
+    # Tra cache câu trả lời trước (không cần Elasticsearch và LLM nếu trúng)
+    cached = lookup_cached_answer(query, vector, current_model, history)
+    if cached:
+        response, context = cached
+        search_results = [doc.to_es_hit() for doc in context]
+        return {"search_results": search_results, "response": response, "error": False, "cached": True}, "cached"
+
+    # Phân loại intent câu hỏi (song song với tìm kiếm nếu bật SPECULATIVE_RETRIEVAL)
+    intent, context, error = await classify_and_search_async(query, async_client, vector=vector)
+    if intent == "greeting":
+        return {"response": GREETING_RESPONSE, "error": False, "source": "greeting"}, intent
+    elif intent == "unrelated":
+        return {"response": UNRELATED_RESPONSE, "error": False, "source": "general"}, intent
+
+    if error:
+        return {"response": error, "error": True, "source": None}, "error"
+
+    response, error, answered_model = await generate_response_async(
+        query, context, history, async_client, model=current_model
+    )
+    if error:
+        return {"response": error, "error": True, "source": None}, "error"
+
+    # Lưu theo model thực sự trả lời (model dự phòng khi hedge/circuit breaker), không theo model được yêu cầu
+    store_cached_answer(query, vector, answered_model, response, context, history)
+    return {"search_results": [doc.to_es_hit() for doc in context], "response": response, "error": False}, "ok"
+
+async def admit():
+    """
+    Xin lượt xử lý từ admission controller. Returns: hàm release.
+    """
+    try:
+        return await admission.acquire()
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=e.status_code, detail=OVERLOADED_RESPONSE, headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def cancel_on_disconnect(http_request: Request, awaitable):
+    """
+    Chạy awaitable, hủy nó khi client ngắt kết nối (ClientDisconnected) hoặc khi chính request bị hủy (hết hạn).
+    """
+    task = asyncio.ensure_future(awaitable)
+    disconnected = False
+
+    async def watch():
+        nonlocal disconnected
+        while not task.done():
+            if await http_request.is_disconnected():
+                disconnected = True
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if disconnected:
+            raise ClientDisconnected()
+        raise
+    finally:
+        watcher.cancel()
+        task.cancel()
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
-    start_time = time.time()  # Bắt đầu đo tổng thời gian
+async def chat(request: ChatRequest, http_request: Request):
+    current_model = request_model(request)
+    release = await admit()
+    trace = start_trace()
+    start_time = time.perf_counter()
+    outcome = "ok"
     
     try:
-        async with asyncio.timeout(30):  # Timeout sau 30 giây
+        async with asyncio.timeout(REQUEST_TIMEOUT):
             query = request.query
-            history = request.history
+            history = request_history(request)
 
             if not query.strip():
-                total_time = time.time() - start_time
-                print(f"Total processing time: {total_time:.2f}s")
+                outcome = "error"
                 return {"response": "Vui lòng nhập câu hỏi!", "error": True, "source": None}
-            
-            # Phân loại intent câu hỏi
-            intent = classify_query_intent(query, client)
-            # print(f"Intent detected: {intent}")
+
+            # Các request giống hệt nhau (câu hỏi, history, model) đang chạy đồng thời dùng chung một lần xử lý
+            key = fingerprint(normalize_query(query), history, current_model)
+            payload, outcome = await cancel_on_disconnect(
+                http_request, chat_flight.do(key, lambda: answer_query(query, history, current_model))
+            )
+            if not payload["error"]:
+                remember_turn(request, payload["response"])
+            return {**payload, **trace_payload(trace)}
+    
+    except TimeoutError:
+        outcome = "timeout"
+        TIMEOUTS.labels("request").inc()
+        raise HTTPException(status_code=504, detail=TIMEOUT_RESPONSE)
+    except ClientDisconnected:
+        # Client đã đi, không còn ai nhận response
+        outcome = "cancelled"
+        return Response(status_code=499)
+    finally:
+        release()
+        REQUEST_SECONDS.labels("/chat", outcome).observe(time.perf_counter() - start_time)
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# ===== API chat dạng stream (Server-Sent Events) =====
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Trả về các sự kiện SSE:
+    - sources: danh sách tài liệu tìm được (gửi sớm, trước khi LLM trả lời)
+    - token: từng phần câu trả lời
+    - done: câu trả lời hoàn chỉnh đã hậu xử lý (liên kết "Đọc thêm", cắt phần dở dang)
+    - error: thông báo lỗi
+    Khi client ngắt kết nối, Starlette hủy stream và lời gọi LLM đang chạy bị đóng theo.
+    """
+    current_model = request_model(request)
+    release = await admit()
+
+    async def event_stream():
+        trace = start_trace()
+        start_time = time.perf_counter()
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT
+        outcome = "ok"
+        try:
+            query = request.query
+            if not query.strip():
+                outcome = "error"
+                yield sse_event("error", {"response": "Vui lòng nhập câu hỏi!"})
+                return
+
+            # Không yield bên trong asyncio.timeout: mỗi bước chờ có hạn theo cùng một deadline
+            async with asyncio.timeout_at(deadline):
+                vector = await embed_query(query)
+            if vector is None:
+                outcome = "error"
+                yield sse_event("error", {"response": EMBEDDING_ERROR_RESPONSE, **trace_payload(trace)})
+                return
+
+            history = request_history(request)
+            cached = lookup_cached_answer(query, vector, current_model, history)
+            if cached:
+                response, context = cached
+                outcome = "cached"
+                yield sse_event("sources", [
+                    {"title": doc.title, "link": doc.link} for doc in context
+                ])
+                remember_turn(request, response)
+                yield sse_event("done", {"response": response, "cached": True, **trace_payload(trace)})
+                return
+
+            async with asyncio.timeout_at(deadline):
+                intent, context, error = await classify_and_search_async(query, async_client, vector=vector)
             if intent == "greeting":
-                return {"response": "🥰 Chào bạn nha! Mình luôn sẵn sàng hỗ trợ nếu bạn cần tìm hiểu về du lịch Bình Định nè!", "error": False, "source": "greeting"}
-            elif intent == "unrelated":
-                return {"response": "😥 Xin lỗi, câu hỏi của bạn nằm ngoài lĩnh vực du lịch, văn hóa, lịch sử Bình Định. Bạn thử hỏi mình những câu liên quan đến vùng đất này nha!", "error": False, "source": "general"}
-
-            # Đo thời gian cho semantic_search
-            search_start = time.time()
-            context, error = semantic_search(query)
-            search_time = time.time() - search_start
-            print(f"semantic_search took {search_time:.2f}s")
-            
-            if error:
-                total_time = time.time() - start_time
-                print(f"Total processing time: {total_time:.2f}s")
-                return {"response": error, "error": True, "source": None}
-            
-            # Xác định nguồn dựa trên context
-            # source = "elasticsearch" if context else "openai"
-            
-            # Đo thời gian cho generate_response
-            generate_start = time.time()
-            response, error = generate_response(query, context, history, client)
-            generate_time = time.time() - generate_start
-            print(f"generate_response took {generate_time:.2f}s")
-            
+                outcome = intent
+                remember_turn(request, GREETING_RESPONSE)
+                yield sse_event("done", {"response": GREETING_RESPONSE, "source": "greeting", **trace_payload(trace)})
+                return
+            if intent == "unrelated":
+                outcome = intent
+                remember_turn(request, UNRELATED_RESPONSE)
+                yield sse_event("done", {"response": UNRELATED_RESPONSE, "source": "general", **trace_payload(trace)})
+                return
             if error:
-                total_time = time.time() - start_time
-                print(f"Total processing time: {total_time:.2f}s")
-                return {"response": error, "error": True, "source": None}
-            
-            # In tổng thời gian và nguồn
-            total_time = time.time() - start_time
-            print(f"Total processing time: {total_time:.2f}s")
-            # print(f"Nguồn: {'Dữ liệu Bình Định' if source == 'elasticsearch' else 'Kiến thức chung'}")
-            
-            return {
-                "search_results": context,
-                "response": response,
-                "error": False,
-                # "source": "Dữ liệu Bình Định" if source == "elasticsearch" else "Kiến thức chung"
-                
-            }
-    
-    except asyncio.TimeoutError:
-        total_time = time.time() - start_time
-        print(f"Total processing time: {total_time:.2f}s (Timed out)")
-        raise HTTPException(status_code=504, detail="Mình xử lý hơi lâu, bạn hỏi lại nhé!")
\ No newline at end of file
+                outcome = "error"
+                yield sse_event("error", {"response": error, **trace_payload(trace)})
+                return
+
+            yield sse_event("sources", [
+                {"title": doc.title, "link": doc.link} for doc in context
+            ])
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            answered_model = current_model
+            async for event, data in stream_response_async(
+                query, context, history, async_client, timeout=remaining, model=current_model
+            ):
+                if event == "model":
+                    answered_model = data
+                elif event == "token":
+                    yield sse_event("token", {"content": data})
+                elif event == "done":
+                    store_cached_answer(query, vector, answered_model, data, context, history)
+                    remember_turn(request, data)
+                    yield sse_event("done", {"response": data, **trace_payload(trace)})
+                else:
+                    outcome = "error"
+                    yield sse_event("error", {"response": data, **trace_payload(trace)})
+        except TimeoutError:
+            outcome = "timeout"
+            TIMEOUTS.labels("request").inc()
+            yield sse_event("error", {"response": TIMEOUT_RESPONSE, **trace_payload(trace)})
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            release()
+            REQUEST_SECONDS.labels("/chat/stream", outcome).observe(time.perf_counter() - start_time)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Nhả lượt cả khi stream chưa kịp bắt đầu (client ngắt kết nối sớm); release chỉ có tác dụng một lần
+        background=BackgroundTask(release),
+    )
@@ -0,0 +1,163 @@
+import os
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Trả trace_id + thời gian từng stage trong response (bật khi cần debug)
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "false").lower() == "true"
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_seconds", "Thời gian từng stage xử lý (embed, classify, search, prompt, llm, ...)",
+    ["stage"], buckets=_LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "chatbot_request_seconds", "Tổng thời gian xử lý request",
+    ["endpoint", "outcome"], buckets=_LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "chatbot_prompt_tokens", "Số token của messages gửi LLM (theo ngân sách token)",
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000),
+)
+CONTEXT_TOKENS = Histogram(
+    "chatbot_context_tokens", "Số token tài liệu đưa vào prompt theo cách chọn (top_k, rerank) và sau khi rút gọn (compressed)",
+    ["selection"], buckets=(250, 500, 1000, 1500, 2500, 4000, 5000),
+)
+CONTEXT_DOCUMENTS = Histogram(
+    "chatbot_context_documents", "Số tài liệu đưa vào prompt theo cách chọn (top_k hoặc rerank)",
+    ["selection"], buckets=(1, 2, 3, 4, 5, 6, 8),
+)
+LLM_TOKENS = Counter("chatbot_llm_tokens", "Token vào/ra của LLM", ["direction"])
+LLM_CACHED_TOKENS = Counter("chatbot_llm_cached_prompt_tokens", "Token prompt được provider lấy từ prefix cache")
+LLM_SECONDS = Histogram(
+    "chatbot_llm_seconds", "Thời gian gọi LLM theo việc prefix cache của provider có trúng hay không",
+    ["prefix_cache"], buckets=_LATENCY_BUCKETS,
+)
+LLM_ANSWERS = Counter("chatbot_llm_answers", "Số câu trả lời theo model thực sự trả lời (kể cả model dự phòng khi hedge)", ["model"])
+TIMEOUTS = Counter("chatbot_timeouts", "Số lần timeout", ["stage"])
+UPSTREAM_ERRORS = Counter("chatbot_upstream_errors", "Số lỗi từ dịch vụ bên ngoài", ["service"])
+
+_current_trace = contextvars.ContextVar("chatbot_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = {}
+
+
+def start_trace(trace=None):
+    """
+    Bắt đầu trace cho request hiện tại (các task con tạo sau đó dùng chung trace).
+    Args:
+        trace: Trace có sẵn để dùng thay vì tạo mới (ví dụ trace riêng của phần việc dùng chung).
+    """
+    if trace is None:
+        trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def merge_trace(trace):
+    """
+    Chép các span của trace (phần việc dùng chung giữa nhiều request) vào trace của request hiện tại.
+    """
+    current = _current_trace.get()
+    if current is not None and trace is not None:
+        current.spans.update(trace.spans)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans[stage] = round(seconds * 1000, 2)
+
+
+@contextmanager
+def span(stage):
+    """
+    Đo thời gian một stage: with span("search"): ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def trace_payload(trace):
+    """
+    {"trace_id", "spans"} để gắn vào response nếu bật TRACE_REQUESTS, ngược lại {}.
+    """
+    if not TRACE_REQUESTS or trace is None:
+        return {}
+    return {"trace": {"trace_id": trace.trace_id, "spans": trace.spans}}
+
+
+def record_tokens(prompt_tokens, completion_tokens, cached_tokens=0):
+    LLM_TOKENS.labels("in").inc(prompt_tokens)
+    LLM_TOKENS.labels("out").inc(completion_tokens)
+    if cached_tokens:
+        LLM_CACHED_TOKENS.inc(cached_tokens)
+
+
+def record_usage(usage, seconds, prompt_tokens, completion_tokens):
+    """
+    Ghi số token (kể cả token prompt trúng prefix cache) từ usage của completion và thời gian gọi LLM.
+    Nếu provider không trả usage thì dùng số token tự đếm (prompt_tokens, completion_tokens).
+    Returns:
+        int: Số token prompt được cache.
+    """
+    cached_tokens = 0
+    if usage:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    record_tokens(prompt_tokens, completion_tokens, cached_tokens)
+    LLM_SECONDS.labels("hit" if cached_tokens else "miss").observe(seconds)
+    return cached_tokens
+
+
+class StatsCollector:
+    """
+    Xuất các hàm stats() sẵn có (cache embedding, micro-batcher, cache câu trả lời, ...) ra Prometheus.
+    Khóa có tên trong `counters` là counter, các giá trị số còn lại là gauge.
+    """
+
+    def __init__(self):
+        self._sources = []
+
+    def add(self, name, stats_fn, counters=()):
+        self._sources.append((name, stats_fn, set(counters)))
+
+    def collect(self):
+        for name, stats_fn, counters in self._sources:
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"chatbot_{name}_{key}"
+                if key in counters:
+                    family = CounterMetricFamily(metric, f"{name} {key}")
+                else:
+                    family = GaugeMetricFamily(metric, f"{name} {key}")
+                family.add_metric([], value)
+                yield family
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render_metrics():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,90 @@
+"""
+Tạo index mới có dense_vector được đánh chỉ mục HNSW (cho RETRIEVAL_MODE=knn_hybrid)
+và reindex dữ liệu từ index cũ sang.
+
+Ví dụ:
+    python migrate_index.py --source chatbot_elastic --target chatbot_elastic_knn
+"""
+import os
+import time
+import argparse
+from elasticsearch import Elasticsearch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def build_target_mapping(source_mapping, dims, similarity, m, ef_construction):
+    """
+    Giữ nguyên mapping các trường khác, thay `embedding` bằng dense_vector có index HNSW.
+    """
+    properties = dict(source_mapping.get("properties", {}))
+    properties["embedding"] = {
+        "type": "dense_vector",
+        "dims": dims,
+        "index": True,
+        "similarity": similarity,
+        "index_options": {"type": "hnsw", "m": m, "ef_construction": ef_construction},
+    }
+    return {"properties": properties}
+
+
+def wait_for_task(es, task_id, poll_interval=2.0):
+    while True:
+        task = es.tasks.get(task_id=task_id)
+        status = task["task"]["status"]
+        print(f"⏳ Reindex: {status.get('created', 0) + status.get('updated', 0)}/{status.get('total', 0)} tài liệu")
+        if task.get("completed"):
+            if task.get("error") or task.get("response", {}).get("failures"):
+                raise RuntimeError(f"Reindex lỗi: {task.get('error') or task['response']['failures']}")
+            return task
+        time.sleep(poll_interval)
+
+
+def migrate(es, source, target, dims, similarity, m, ef_construction, delete_existing=False):
+    if es.indices.exists(index=target):
+        if not delete_existing:
+            raise RuntimeError(f"Index '{target}' đã tồn tại (dùng --delete-existing để tạo lại).")
+        es.indices.delete(index=target)
+        print(f"🗑️ Đã xóa index cũ '{target}'")
+
+    source_mapping = es.indices.get_mapping(index=source)[source]["mappings"]
+    mapping = build_target_mapping(source_mapping, dims, similarity, m, ef_construction)
+    # Tắt refresh trong lúc reindex để ghi nhanh hơn
+    es.indices.create(index=target, mappings=mapping, settings={"refresh_interval": "-1"})
+    print(f"✅ Đã tạo index '{target}' (dense_vector {dims} chiều, HNSW m={m}, ef_construction={ef_construction})")
+
+    response = es.reindex(source={"index": source}, dest={"index": target}, wait_for_completion=False)
+    wait_for_task(es, response["task"])
+
+    es.indices.put_settings(index=target, settings={"refresh_interval": "1s"})
+    es.indices.refresh(index=target)
+    source_count = es.count(index=source)["count"]
+    target_count = es.count(index=target)["count"]
+    print(f"✅ Reindex xong: {source} ({source_count}) → {target} ({target_count})")
+    if source_count != target_count:
+        print("⚠️ Số tài liệu không khớp, kiểm tra lại trước khi chuyển RETRIEVAL_MODE=knn_hybrid.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo index kNN (HNSW) và reindex từ index cũ.")
+    parser.add_argument("--source", default="chatbot_elastic")
+    parser.add_argument("--target", default=os.getenv("KNN_INDEX_NAME", "chatbot_elastic_knn"))
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--similarity", default="cosine")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--delete-existing", action="store_true")
+    args = parser.parse_args()
+
+    es = Elasticsearch(
+        os.getenv("ELASTICSEARCH_URL"),
+        api_key=os.getenv("ELASTICSEARCH_API_KEY"),
+        request_timeout=60,
+    )
+    migrate(es, args.source, args.target, args.dims, args.similarity, args.m,
+            args.ef_construction, delete_existing=args.delete_existing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    Chuẩn hóa văn bản làm khóa cache: NFC, chữ thường, gộp khoảng trắng.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Cache embedding 2 tầng:
+    - Tầng 1: LRU trong bộ nhớ, giới hạn số phần tử, có TTL.
+    - Tầng 2: SQLite trên đĩa (vector float32 dạng BLOB), giữ được qua các lần khởi động lại.
+    Khóa = sha1(model | dimensions | văn bản đã chuẩn hóa).
+    Các hàm *_async chỉ chạm tầng bộ nhớ trên event loop, đọc/ghi SQLite chạy trong thread (asyncio.to_thread).
+    """
+
+    _SQL_BATCH = 500  # số khóa tối đa trong một truy vấn IN (giới hạn tham số của SQLite)
+
+    def __init__(self, model_name, dimensions, max_entries=10000, ttl=7 * 24 * 3600, db_path=None):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+
+        self._memory = OrderedDict()  # key -> (hết hạn lúc, vector float32)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        raw = f"{self.model_name}|{self.dimensions}|{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            del self._memory[key]
+            return None
+
+    def _get_disk(self, keys, now):
+        """
+        Đọc nhiều khóa từ SQLite (một truy vấn IN cho mỗi lô), đưa các vector còn hạn lên tầng bộ nhớ.
+        Returns: dict khóa -> vector.
+        """
+        rows = []
+        with self._db_lock:
+            for i in range(0, len(keys), self._SQL_BATCH):
+                batch = keys[i:i + self._SQL_BATCH]
+                rows.extend(self._db.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall())
+        found = {}
+        with self._lock:
+            for key, blob, created_at in rows:
+                if created_at + self.ttl > now:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._put_memory(key, vector, created_at + self.ttl)
+                    found[key] = vector
+        return found
+
+    def _memory_pass(self, keys, now):
+        # Tra tầng bộ nhớ; trả về vector (None nếu chưa có) và các khóa cần đọc từ SQLite
+        vectors = [self._get_memory(key, now) for key in keys]
+        missing = []
+        if self._db is not None:
+            missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        return vectors, missing
+
+    def _fill(self, keys, vectors, found):
+        vectors = [found.get(key) if vector is None else vector for key, vector in zip(keys, vectors)]
+        self.disk_hits += len(found)
+        self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    def _get_vectors(self, keys):
+        now = time.time()
+        vectors, missing = self._memory_pass(keys, now)
+        found = self._get_disk(missing, now) if missing else {}
+        return self._fill(keys, vectors, found)
+
+    async def _get_vectors_async(self, keys):
+        # Chỉ tầng bộ nhớ chạy trên event loop; mọi khóa còn thiếu đọc từ SQLite trong một lần chuyển thread
+        now = time.time()
+        vectors, missing = self._memory_pass(keys, now)
+        found = await asyncio.to_thread(self._get_disk, missing, now) if missing else {}
+        return self._fill(keys, vectors, found)
+
+    def _put_memory(self, key, vector, expires_at):
+        self._memory[key] = (expires_at, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text):
+        """
+        Lấy embedding từ cache.
+        Returns:
+            list hoặc None nếu không có (hoặc đã hết hạn).
+        """
+        vector = self._get_vectors([self.key(text)])[0]
+        return vector.tolist() if vector is not None else None
+
+    def _remember(self, texts, embeddings):
+        # Ghi tầng bộ nhớ, trả về các dòng cần ghi xuống SQLite
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._put_memory(key, vector, now + self.ttl)
+                rows.append((key, vector.tobytes(), now))
+        return rows
+
+    def _write_disk(self, rows):
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def set(self, text, embedding):
+        self.set_many([text], [embedding])
+
+    def set_many(self, texts, embeddings):
+        rows = self._remember(texts, embeddings)
+        if self._db is not None and rows:
+            self._write_disk(rows)
+
+    async def set_many_async(self, texts, embeddings):
+        rows = self._remember(texts, embeddings)
+        if self._db is not None and rows:
+            await asyncio.to_thread(self._write_disk, rows)
+
+    @staticmethod
+    def _split(texts, vectors):
+        results = [vector.tolist() if vector is not None else None for vector in vectors]
+        missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+        return results, missing
+
+    def _split_misses(self, texts):
+        return self._split(texts, self._get_vectors([self.key(text) for text in texts]))
+
+    async def _split_misses_async(self, texts):
+        return self._split(texts, await self._get_vectors_async([self.key(text) for text in texts]))
+
+    @staticmethod
+    def _merge(texts, results, missing, computed):
+        by_text = dict(zip(missing, computed))
+        return [result if result is not None else by_text[text] for text, result in zip(texts, results)]
+
+    def get_many_or_compute(self, texts, batch_fn):
+        """
+        Lấy embedding cho nhiều văn bản, chỉ gọi batch_fn một lần cho các văn bản chưa có trong cache.
+        """
+        results, missing = self._split_misses(texts)
+        if not missing:
+            return results
+        computed = batch_fn(missing)
+        self.set_many(missing, computed)
+        return self._merge(texts, results, missing, computed)
+
+    async def get_many_or_compute_async(self, texts, batch_fn):
+        results, missing = await self._split_misses_async(texts)
+        if not missing:
+            return results
+        computed = await batch_fn(missing)
+        await self.set_many_async(missing, computed)
+        return self._merge(texts, results, missing, computed)
+
+    def get_or_compute(self, text, compute_fn):
+        embedding = self.get(text)
+        if embedding is None:
+            embedding = compute_fn(text)
+            self.set(text, embedding)
+        return embedding
+
+    async def get_or_compute_async(self, text, compute_fn):
+        vector = (await self._get_vectors_async([self.key(text)]))[0]
+        if vector is not None:
+            return vector.tolist()
+        embedding = await compute_fn(text)
+        await self.set_many_async([text], [embedding])
+        return embedding
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            memory_entries = len(self._memory)
+            memory_bytes = sum(vector.nbytes for _, vector in self._memory.values())
+        disk_entries = 0
+        if self._db is not None:
+            with self._db_lock:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        disk_bytes = os.path.getsize(self.db_path) if self.db_path and os.path.exists(self.db_path) else 0
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "dimensions": self.dimensions,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": memory_entries,
+            "memory_bytes": memory_bytes,
+            "disk_entries": disk_entries,
+            "disk_bytes": disk_bytes,
+        }
+
+
+def create_cache(model_name, dimensions):
+    """
+    Tạo cache theo biến môi trường:
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL (giây), EMBEDDING_CACHE_PATH (rỗng = chỉ dùng RAM).
+    """
+    return EmbeddingCache(
+        model_name,
+        dimensions,
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600))),
+        db_path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3") or None,
+    )
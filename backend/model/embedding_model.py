@@ -1,8 +1,40 @@
+import asyncio
 from sentence_transformers import SentenceTransformer
+from model.embedding_cache import create_cache
+from model.micro_batcher import create_batcher
 
-model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+model = SentenceTransformer(MODEL_NAME)
+cache = create_cache(MODEL_NAME, 384)
 # vector = model.encode("Xin chào các bạn")
 # print(len(vector))  # Sẽ ra 384
 
+def _encode_batch(texts):
+    return model.encode(texts, batch_size=32).tolist()
+
+async def _encode_batch_async(texts):
+    # model.encode tốn CPU, chạy trong thread để không chặn event loop
+    return await asyncio.to_thread(_encode_batch, texts)
+
+# Gom các yêu cầu đồng thời thành một lần model.encode
+batcher = create_batcher(_encode_batch_async)
+
 def get_embedding(text):
-    return model.encode(text).tolist()
\ No newline at end of file
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts):
+    return cache.get_many_or_compute(texts, _encode_batch)
+
+async def get_embedding_async(text):
+    return await cache.get_or_compute_async(text, batcher.submit)
+
+async def get_embeddings_async(texts):
+    return await cache.get_many_or_compute_async(texts, _encode_batch_async)
+
+async def aclose():
+    # Model chạy local, không có kết nối nào cần đóng
+    return None
+
+async def warm_up():
+    # Model đã được nạp khi import
+    return None
@@ -1,7 +1,10 @@
-from huggingface_hub import InferenceClient
+from huggingface_hub import InferenceClient, AsyncInferenceClient
 import numpy as np
 # from sklearn.metrics.pairwise import cosine_similarity
 import os
+import asyncio
+from model.embedding_cache import create_cache
+from model.micro_batcher import create_batcher
 
 # Lưu token Hugging Face của bạn
 token = os.getenv("YOUR_HF_API_TOKEN")
@@ -10,9 +13,26 @@ if not token:
 
 # Khởi tạo InferenceClient
 client = InferenceClient(token=token)
+async_client = AsyncInferenceClient(token=token)
 
-# Hàm get_embedding (dùng InferenceClient để gọi API)
+HF_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+cache = create_cache(HF_MODEL_NAME, 384)
+
+# Hàm get_embedding (ưu tiên cache, chỉ gọi API khi chưa có)
 def get_embedding(text: str):
+    return cache.get_or_compute(text, _fetch_embedding)
+
+def get_embeddings(texts):
+    return cache.get_many_or_compute(texts, lambda missing: [_fetch_embedding(text) for text in missing])
+
+async def get_embedding_async(text: str):
+    return await cache.get_or_compute_async(text, batcher.submit)
+
+async def get_embeddings_async(texts):
+    return await cache.get_many_or_compute_async(texts, _fetch_embeddings_async)
+
+# Gọi API bằng InferenceClient
+def _fetch_embedding(text: str):
     if not text or not isinstance(text, str):
         raise ValueError("❌ Đầu vào phải là một chuỗi văn bản hợp lệ.")
 
@@ -20,7 +40,7 @@ def get_embedding(text: str):
         # Lấy embedding từ API
         embedding_vector = client.feature_extraction(
             text,
-            model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+            model=HF_MODEL_NAME
         )
         # Chuyển embedding thành list
         embedding_vector = np.array(embedding_vector).tolist()
@@ -34,8 +54,32 @@ def get_embedding(text: str):
     except Exception as e:
         raise RuntimeError(f"🚫 Lỗi khi gọi Hugging Face API: {e}")
 
+# Phiên bản bất đồng bộ (dùng AsyncInferenceClient)
+async def _fetch_embedding_async(text: str):
+    if not text or not isinstance(text, str):
+        raise ValueError("❌ Đầu vào phải là một chuỗi văn bản hợp lệ.")
+
+    try:
+        embedding_vector = await async_client.feature_extraction(text, model=HF_MODEL_NAME)
+        return np.array(embedding_vector).tolist()
+    except Exception as e:
+        raise RuntimeError(f"🚫 Lỗi khi gọi Hugging Face API: {e}")
+
+# feature_extraction của InferenceClient chỉ nhận một chuỗi, nên batch = các request song song
+async def _fetch_embeddings_async(texts):
+    return await asyncio.gather(*(_fetch_embedding_async(text) for text in texts))
+
+batcher = create_batcher(_fetch_embeddings_async)
+
+async def aclose():
+    await async_client.close()
+
+async def warm_up():
+    # AsyncInferenceClient tự quản lý kết nối, không có gì để mở trước
+    return None
+
 # # Test thử
-# if __name__ == "__main__":
+if __name__ == "__main__":
     while True:
         sample_text = input("\n💬 Nhập văn bản (hoặc gõ 'exit' để thoát): ")
         if sample_text.lower() == 'exit':
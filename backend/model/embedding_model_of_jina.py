@@ -1,6 +1,10 @@
 import requests
+import httpx
 import os
 from dotenv import load_dotenv
+from connections import create_async_http_client, create_http_session, open_connection
+from model.embedding_cache import create_cache
+from model.micro_batcher import create_batcher
 
 load_dotenv()
 
@@ -10,39 +14,113 @@ if not JINA_API_KEY:
     raise ValueError("❌ Không tìm thấy Jina API Key trong biến môi trường!")
 
 # Endpoint mới theo docs chính thức của Jina AI
-JINA_API_URL = "https://api.jina.ai/v1/embeddings"
+JINA_API_URL = os.getenv("JINA_API_URL", "https://api.jina.ai/v1/embeddings")
 JINA_MODEL_NAME = "jina-embeddings-v3"
 JINA_TASK = "text-matching"  # Tùy task bạn cần, docs có giải thích rõ
 JINA_DIMENSIONS = 384  # Dùng bản base, docs nói rõ dimension này
 
+# Cache embedding (RAM + SQLite) đặt trước API
+cache = create_cache(JINA_MODEL_NAME, JINA_DIMENSIONS)
+
+# Client HTTP dùng chung (giữ kết nối keep-alive tới api.jina.ai)
+_async_client = None
+_session = None
+
+def _build_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {JINA_API_KEY}",
+    }
+
+def _build_payload(texts):
+    return {
+        "model": JINA_MODEL_NAME,
+        "task": JINA_TASK,
+        "dimensions": JINA_DIMENSIONS,
+        "input": list(texts)  # API nhận cả list văn bản
+    }
+
+def _parse_embeddings(result, count):
+    if "data" not in result or len(result["data"]) != count:
+        raise ValueError("⚠️ Phản hồi từ API không chứa trường 'data' hợp lệ.")
+    # Sắp xếp theo index để đúng thứ tự đầu vào
+    return [item["embedding"] for item in sorted(result["data"], key=lambda item: item.get("index", 0))]
+
+def _validate(texts):
+    for text in texts:
+        if not text or not isinstance(text, str):
+            raise ValueError("❌ Đầu vào phải là một chuỗi văn bản hợp lệ.")
+
+def _get_async_client():
+    """
+    Khởi tạo (lười) httpx.AsyncClient dùng chung cho toàn bộ tiến trình.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = create_async_http_client(headers=_build_headers(), read_timeout=10.0)
+    return _async_client
+
+def _get_session():
+    """
+    Khởi tạo (lười) requests.Session có connection pool cho các lời gọi đồng bộ.
+    """
+    global _session
+    if _session is None:
+        _session = create_http_session(headers=_build_headers())
+    return _session
+
+async def warm_up():
+    """
+    Mở sẵn kết nối tới api.jina.ai trước request đầu tiên.
+    """
+    await open_connection(_get_async_client(), JINA_API_URL)
+
+async def aclose():
+    """
+    Đóng client bất đồng bộ (gọi khi tắt ứng dụng).
+    """
+    global _async_client, _session
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
+
 def get_embedding(text: str):
     """
-    Gọi API Jina AI để lấy embedding cho văn bản.
+    Lấy embedding cho văn bản (ưu tiên cache, chỉ gọi API Jina AI khi chưa có).
+    """
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts):
+    """
+    Lấy embedding cho nhiều văn bản, các văn bản chưa có trong cache được gửi trong một request.
     """
-    if not text or not isinstance(text, str):
-        raise ValueError("❌ Đầu vào phải là một chuỗi văn bản hợp lệ.")
+    _validate(texts)
+    return cache.get_many_or_compute(texts, _fetch_embeddings)
 
+async def get_embedding_async(text: str):
+    """
+    Phiên bản bất đồng bộ của get_embedding. Các yêu cầu đồng thời được micro-batcher
+    gom lại thành một request tới Jina.
+    """
+    _validate([text])
+    return await cache.get_or_compute_async(text, batcher.submit)
+
+async def get_embeddings_async(texts):
+    _validate(texts)
+    return await cache.get_many_or_compute_async(texts, _fetch_embeddings_async)
+
+def _fetch_embeddings(texts):
+    """
+    Gọi API Jina AI để lấy embedding cho danh sách văn bản.
+    """
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {JINA_API_KEY}",
-        }
-
-        payload = {
-            "model": JINA_MODEL_NAME,
-            "task": JINA_TASK,
-            "dimensions": JINA_DIMENSIONS,
-            "input": [text]  # Bọc vào list
-        }
-
-        response = requests.post(JINA_API_URL, headers=headers, json=payload)
+        response = _get_session().post(JINA_API_URL, json=_build_payload(texts), timeout=(5, 10))
         response.raise_for_status()
 
-        result = response.json()
-        if "data" not in result or not result["data"]:
-            raise ValueError("⚠️ Phản hồi từ API không chứa trường 'data' hợp lệ.")
-
-        return result["data"][0]["embedding"]
+        return _parse_embeddings(response.json(), len(texts))
 
     except requests.exceptions.RequestException as e:
         raise RuntimeError(f"🚫 Lỗi gọi API Jina AI: {str(e)}")
@@ -51,6 +129,26 @@ def get_embedding(text: str):
     except Exception as e:
         raise RuntimeError(f"🚫 Lỗi không xác định: {str(e)}")
 
+async def _fetch_embeddings_async(texts):
+    """
+    Gọi API Jina AI (bất đồng bộ, dùng connection pool của httpx).
+    """
+    try:
+        response = await _get_async_client().post(JINA_API_URL, json=_build_payload(texts))
+        response.raise_for_status()
+
+        return _parse_embeddings(response.json(), len(texts))
+
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"🚫 Lỗi gọi API Jina AI: {str(e)}")
+    except ValueError as e:
+        raise RuntimeError(f"🚫 Phản hồi lỗi từ Jina AI: {str(e)}")
+    except Exception as e:
+        raise RuntimeError(f"🚫 Lỗi không xác định: {str(e)}")
+
+# Gom các yêu cầu đồng thời thành một request
+batcher = create_batcher(_fetch_embeddings_async)
+
 # Test CLI nhỏ gọn
 if __name__ == "__main__":
     while True:
@@ -0,0 +1,93 @@
+import os
+import asyncio
+import threading
+import numpy as np
+from model.embedding_cache import create_cache
+from model.micro_batcher import create_batcher
+
+# Cùng model với embedding_model.py (paraphrase-multilingual-MiniLM-L12-v2) nhưng chạy bằng ONNX Runtime,
+# trọng số lượng tử hóa int8 (tạo bằng model/export_onnx.py). Mean pooling như SentenceTransformer
+# nên vector dùng chung được với index đã tạo bằng MiniLM.
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./models/paraphrase-multilingual-MiniLM-L12-v2-onnx")
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "model_int8.onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "1"))
+MAX_SEQ_LENGTH = 128  # max_seq_length của MiniLM-L12-v2
+BATCH_SIZE = 32
+DIMENSIONS = 384
+
+cache = create_cache(f"{MODEL_NAME}-onnx-int8", DIMENSIONS)
+
+# Model được nạp lười ở lần gọi đầu tiên (không tốn thời gian/RAM khi import)
+_session = None
+_tokenizer = None
+_load_lock = threading.Lock()
+
+def _load():
+    global _session, _tokenizer
+    with _load_lock:
+        if _session is not None:
+            return
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(os.path.join(ONNX_MODEL_DIR, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id("<pad>") or 0, pad_token="<pad>")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_THREADS
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        _tokenizer = tokenizer
+        _session = ort.InferenceSession(
+            os.path.join(ONNX_MODEL_DIR, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        print(f"✅ Nạp model ONNX {ONNX_MODEL_FILE} ({ONNX_THREADS} luồng)")
+
+def _encode(texts):
+    encodings = _tokenizer.encode_batch(texts)
+    input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+    attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in {i.name for i in _session.get_inputs()}:
+        inputs["token_type_ids"] = np.zeros_like(input_ids)
+    token_embeddings = _session.run(None, inputs)[0]
+
+    # Mean pooling theo attention mask (giống SentenceTransformer)
+    mask = attention_mask[:, :, None].astype(np.float32)
+    return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+def _encode_batch(texts):
+    if _session is None:
+        _load()
+    vectors = [_encode(texts[i:i + BATCH_SIZE]) for i in range(0, len(texts), BATCH_SIZE)]
+    return np.concatenate(vectors).tolist()
+
+async def _encode_batch_async(texts):
+    # ONNX Runtime nhả GIL khi chạy, đẩy sang thread để không chặn event loop
+    return await asyncio.to_thread(_encode_batch, texts)
+
+# Gom các yêu cầu đồng thời thành một lần chạy session
+batcher = create_batcher(_encode_batch_async)
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts):
+    return cache.get_many_or_compute(texts, _encode_batch)
+
+async def get_embedding_async(text):
+    return await cache.get_or_compute_async(text, batcher.submit)
+
+async def get_embeddings_async(texts):
+    return await cache.get_many_or_compute_async(texts, _encode_batch_async)
+
+async def aclose():
+    # Model chạy local, không có kết nối nào cần đóng
+    return None
+
+async def warm_up():
+    # Nạp model ONNX trước request đầu tiên
+    if _session is None:
+        await asyncio.to_thread(_load)
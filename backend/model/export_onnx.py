@@ -0,0 +1,37 @@
+import os
+import torch
+from sentence_transformers import SentenceTransformer
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+# Xuất paraphrase-multilingual-MiniLM-L12-v2 sang ONNX rồi lượng tử hóa int8 (dùng cho embedding_model_onnx.py)
+model_dir = os.getenv("ONNX_MODEL_DIR", './models/paraphrase-multilingual-MiniLM-L12-v2-onnx')
+os.makedirs(model_dir, exist_ok=True)
+
+model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+transformer = model[0].auto_model.eval()
+tokenizer = model.tokenizer
+
+# Lưu tokenizer.json (fast tokenizer) để nạp bằng thư viện tokenizers
+tokenizer.save_pretrained(model_dir)
+
+sample = tokenizer(["Xin chào các bạn"], return_tensors="pt")
+fp32_path = os.path.join(model_dir, "model.onnx")
+torch.onnx.export(
+    transformer,
+    (sample["input_ids"], sample["attention_mask"]),
+    fp32_path,
+    input_names=["input_ids", "attention_mask"],
+    output_names=["last_hidden_state"],
+    dynamic_axes={
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "last_hidden_state": {0: "batch", 1: "sequence"},
+    },
+    opset_version=14,
+)
+
+int8_path = os.path.join(model_dir, "model_int8.onnx")
+quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+print(f"✅ Đã xuất model ONNX vào: {fp32_path}")
+print(f"✅ Đã lượng tử hóa int8: {int8_path}")
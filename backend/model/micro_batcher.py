@@ -0,0 +1,82 @@
+import os
+import asyncio
+
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu embedding đồng thời trong vài mili-giây rồi gửi thành một lần gọi batch
+    (một HTTP request với Jina, một lần model.encode với SentenceTransformer).
+    Args:
+        batch_fn: Hàm async nhận list văn bản, trả về list embedding cùng thứ tự.
+        max_batch_size (int): Số văn bản tối đa trong một batch (đủ thì gửi ngay).
+        max_wait_ms (float): Thời gian chờ tối đa để gom batch.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=5):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []  # list (văn bản, future)
+        self._timer = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending):
+        # Gộp các văn bản trùng nhau trong cùng một batch
+        texts = list(dict.fromkeys(text for text, _ in pending))
+        self.batches += 1
+        self.items += len(pending)
+        try:
+            embeddings = await self.batch_fn(texts)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, embeddings))
+        for text, future in pending:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+def create_batcher(batch_fn):
+    """
+    Tạo micro-batcher theo biến môi trường EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS.
+    """
+    return MicroBatcher(
+        batch_fn,
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+        max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")),
+    )
@@ -0,0 +1,21 @@
+import os
+import importlib
+
+# Tên provider -> module. Mỗi module có cùng giao diện: get_embedding, get_embeddings,
+# get_embedding_async, get_embeddings_async, aclose, warm_up, cache, batcher.
+PROVIDERS = {
+    "jina": "model.embedding_model_of_jina",
+    "sentence_transformers": "model.embedding_model",
+    "huggingface": "model.embedding_model_new",
+    "onnx": "model.embedding_model_onnx",
+}
+
+def load_provider(name=None):
+    """
+    Import (lười) module embedding theo tên, mặc định lấy từ biến môi trường EMBEDDING_PROVIDER.
+    Chỉ provider được chọn mới được import (các module khác cần API key hoặc nạp model khi import).
+    """
+    name = name or os.getenv("EMBEDDING_PROVIDER", "jina")
+    if name not in PROVIDERS:
+        raise ValueError(f"❌ EMBEDDING_PROVIDER không hợp lệ: '{name}' (chọn một trong {', '.join(PROVIDERS)})")
+    return importlib.import_module(PROVIDERS[name])
@@ -0,0 +1,257 @@
+import time
+import asyncio
+from collections import deque
+import numpy as np
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho một model:
+    - closed: cho gọi bình thường; `failure_threshold` lỗi liên tiếp (lời gọi chậm hơn slow_seconds cũng tính là lỗi) thì mở.
+    - open: không gọi model này trong `cooldown` giây (router chuyển sang model khác).
+    - half_open: hết cooldown thì cho một lời gọi thử; thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0, slow_seconds=20.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_seconds = slow_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, ok, seconds=0.0):
+        self._probing = False
+        if ok and seconds <= self.slow_seconds:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Lời gọi bị hủy (thua hedge, request hết hạn): không tính là thành công hay lỗi.
+        """
+        self._probing = False
+
+
+class ModelRouter:
+    """
+    Chọn model cho từng lời gọi LLM:
+    - Mỗi request chỉ định model riêng (không dùng biến toàn cục đổi được giữa chừng), bộ phân loại có model riêng.
+    - Hedging (chỉ cho các loại lời gọi trong hedge_kinds, mặc định stream (thời gian tới chunk đầu) và classify):
+      model chính chưa trả lời sau ngưỡng độ trễ (mặc định p95 quan sát được của model đó, theo từng loại lời gọi)
+      thì gọi thêm model dự phòng, lấy kết quả về trước, hủy lời gọi còn lại.
+      Model chính thua hedge (đã chờ quá ngưỡng) vẫn được ghi thời gian đã chờ (cận dưới độ trễ) và tính là chậm
+      cho circuit breaker, nên model chính chậm đẩy ngưỡng hedge lên thay vì bị hedge mãi.
+      Model dự phòng thua (bắt đầu muộn, model chính trả lời trước) không bị tính lỗi và không ghi độ trễ.
+    - Mỗi model có circuit breaker: model đang lỗi/chậm bị bỏ qua, lời gọi chuyển sang model dự phòng.
+    """
+
+    def __init__(self, models, default_model=None, classifier_model=None, fallback_models=(),
+                 hedging=True, hedge_kinds=("stream", "classify"), hedge_after=None, hedge_percentile=95,
+                 hedge_min_delay=0.5, hedge_default_delay=2.0, latency_window=200, min_samples=20,
+                 failure_threshold=5, cooldown=30.0, slow_seconds=20.0):
+        self.models = list(models)
+        self.default_model = default_model or self.models[0]
+        self.classifier_model = classifier_model or self.default_model
+        self.fallback_models = [m for m in fallback_models if m in self.models]
+        self.hedging = hedging
+        self.hedge_kinds = set(hedge_kinds)
+        self.hedge_after = hedge_after  # None: dùng percentile quan sát được
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.breakers = {
+            model: CircuitBreaker(failure_threshold, cooldown, slow_seconds) for model in self.models
+        }
+        self._latencies = {}  # (model, loại lời gọi) -> deque thời gian (giây)
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    def resolve(self, model=None):
+        """
+        Model của một request: model được chỉ định (phải nằm trong danh sách) hoặc model mặc định.
+        Raises: ValueError nếu model không được hỗ trợ.
+        """
+        if not model:
+            return self.default_model
+        if model not in self.models:
+            raise ValueError(f"Model không được hỗ trợ: {model}")
+        return model
+
+    def set_default_model(self, model):
+        self.default_model = self.resolve(model)
+
+    def candidates(self, model):
+        """
+        Model chính rồi các model dự phòng (theo fallback_models, sau đó theo thứ tự trong danh sách).
+        """
+        order = [model] + self.fallback_models + self.models
+        return list(dict.fromkeys(order))
+
+    def hedge_delay(self, model, kind):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        samples = self._latencies.get((model, kind))
+        if not samples or len(samples) < self.min_samples:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, float(np.percentile(samples, self.hedge_percentile)))
+
+    def _observe(self, model, kind, seconds):
+        samples = self._latencies.get((model, kind))
+        if samples is None:
+            samples = self._latencies[(model, kind)] = deque(maxlen=self.latency_window)
+        samples.append(seconds)
+
+    def _record_lost(self, model, kind, seconds, primary, delay):
+        if model == primary and delay is not None and seconds >= delay:
+            # Model chính thua hedge: thời gian thật ít nhất bằng thời gian đã chờ
+            self._observe(model, kind, seconds)
+            self.breakers[model].record(False, seconds)
+        else:
+            # Model dự phòng chỉ thua cuộc đua, không phải lỗi
+            self.breakers[model].release()
+
+    def _next_model(self, models):
+        # Model tiếp theo mà circuit breaker cho phép gọi
+        while models:
+            model = models.pop(0)
+            if self.breakers[model].allow():
+                return model
+        return None
+
+    async def _attempt(self, model, kind, make_call):
+        start = time.perf_counter()
+        breaker = self.breakers[model]
+        try:
+            result = await make_call(model)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record(False)
+            self.failures += 1
+            raise
+        seconds = time.perf_counter() - start
+        breaker.record(True, seconds)
+        self._observe(model, kind, seconds)
+        return result
+
+    async def call(self, model, make_call, kind="complete", discard=None):
+        """
+        Gọi LLM qua router.
+        Args:
+            model: Model chính của request (đã resolve).
+            make_call: Hàm nhận tên model, trả về coroutine thực hiện lời gọi.
+            kind (str): Loại lời gọi (complete, stream, classify, ...), độ trễ thống kê riêng theo loại.
+            discard: Hàm nhận kết quả của lời gọi thua (đã xong nhưng không dùng), ví dụ để đóng stream.
+        Returns:
+            tuple: (kết quả, model đã trả lời).
+        Raises:
+            Exception của lời gọi cuối cùng nếu mọi model đều lỗi (RuntimeError nếu mọi circuit breaker đều mở).
+        """
+        self.calls += 1
+        remaining = self.candidates(model)
+        first = self._next_model(remaining)
+        if first is None:
+            raise RuntimeError("Không có model nào khả dụng (circuit breaker đang mở)")
+        if first != model:
+            self.fallbacks += 1
+
+        def start(target):
+            pending[asyncio.ensure_future(self._attempt(target, kind, make_call))] = (target, time.perf_counter())
+
+        pending = {}
+        start(first)
+        error = None
+        hedging = self.hedging and kind in self.hedge_kinds
+        delay = self.hedge_delay(first, kind) if hedging else None
+        hedged = False
+        try:
+            while pending:
+                hedge = hedging and len(pending) == 1 and bool(remaining)
+                timeout = delay if hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Model chính chậm hơn ngưỡng: gọi thêm model dự phòng
+                    backup = self._next_model(remaining)
+                    if backup is not None:
+                        self.hedges += 1
+                        hedged = True
+                        start(backup)
+                    continue
+                for task in done:
+                    answered, _ = pending.pop(task)
+                    if task.exception() is None:
+                        if hedged and answered != first:
+                            self.hedge_wins += 1
+                        winner = task.result()
+                        for other in done - {task}:
+                            if other.exception() is None and discard is not None:
+                                await discard(other.result())
+                        now = time.perf_counter()
+                        for loser, started in pending.values():
+                            self._record_lost(loser, kind, now - started, first, delay)
+                        return winner, answered
+                    error = task.exception()
+                if not pending:
+                    # Lỗi nhanh (trước ngưỡng hedge): chuyển ngay sang model dự phòng
+                    fallback = self._next_model(remaining)
+                    if fallback is not None:
+                        self.fallbacks += 1
+                        start(fallback)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                if discard is not None:
+                    for task in pending:
+                        if not task.cancelled() and task.exception() is None:
+                            await discard(task.result())
+
+    def stats(self):
+        result = {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "open_breakers": sum(breaker.state == "open" for breaker in self.breakers.values()),
+        }
+        for model, breaker in self.breakers.items():
+            result[f"breaker:{model}"] = breaker.state
+            delays = {kind: round(self.hedge_delay(model, kind), 3) for m, kind in self._latencies if m == model}
+            if delays:
+                result[f"hedge_after:{model}"] = delays
+        return result
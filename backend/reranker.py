@@ -0,0 +1,112 @@
+import math
+from dataclasses import replace
+from functools import lru_cache
+import numpy as np
+from retriever import tokenize
+from context_assembler import document_tokens
+
+
+@lru_cache(maxsize=2048)
+def _term_counts(text):
+    counts = {}
+    for term in tokenize(text):
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def _minmax(values):
+    low, high = values.min(), values.max()
+    if high - low < 1e-9:
+        return np.ones_like(values) if high > 0 else np.zeros_like(values)
+    return (values - low) / (high - low)
+
+
+class FeatureReranker:
+    """
+    Xếp hạng lại các ứng viên (tập rộng lấy từ retriever) ngay trong tiến trình, không gọi dịch vụ ngoài.
+    Điểm là tổng có trọng số của các đặc trưng đã chuẩn hóa min-max trên tập ứng viên:
+    - retrieval: điểm gốc của retriever.
+    - bm25: BM25 của câu hỏi trên title + content, IDF tính trên chính tập ứng viên.
+    - title: tỉ lệ từ của câu hỏi xuất hiện trong tiêu đề.
+    - dense: cosine giữa embedding câu hỏi và embedding tài liệu (chỉ khi mọi hit có embedding: InMemoryRetriever,
+      hoặc ElasticsearchRetriever với embeddings=True, được bật theo RERANK).
+    """
+
+    def __init__(self, retrieval_weight=0.3, bm25_weight=0.4, title_weight=0.3, dense_weight=0.4, k1=1.2, b=0.75):
+        self.retrieval_weight = retrieval_weight
+        self.bm25_weight = bm25_weight
+        self.title_weight = title_weight
+        self.dense_weight = dense_weight
+        self.k1 = k1
+        self.b = b
+
+    def _bm25(self, terms, docs):
+        counts = [_term_counts(f"{doc.title} {doc.content}") for doc in docs]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / (lengths.mean() or 1.0))
+        scores = np.zeros(len(docs), dtype=np.float32)
+        for term in terms:
+            tfs = np.array([c.get(term, 0) for c in counts], dtype=np.float32)
+            df = int((tfs > 0).sum())
+            if df == 0:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            scores += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def _title_coverage(self, terms, docs):
+        if not terms:
+            return np.zeros(len(docs), dtype=np.float32)
+        return np.array([
+            len(terms & set(tokenize(doc.title))) / len(terms) for doc in docs
+        ], dtype=np.float32)
+
+    def _dense(self, vector, docs):
+        if vector is None or any(doc.embedding is None for doc in docs):
+            return None
+        matrix = np.asarray([doc.embedding for doc in docs], dtype=np.float32)
+        query_vector = np.asarray(vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) + 1e-12) + 1e-12
+        return matrix @ query_vector / norms
+
+    def rerank(self, query, vector, hits):
+        """
+        Returns:
+            list: Các Hit sắp xếp theo điểm rerank giảm dần (score là điểm rerank).
+        """
+        if not hits:
+            return []
+        terms = set(tokenize(query))
+        scores = self.retrieval_weight * _minmax(np.array([hit.score for hit in hits], dtype=np.float32))
+        scores += self.bm25_weight * _minmax(self._bm25(terms, hits))
+        scores += self.title_weight * self._title_coverage(terms, hits)
+        dense = self._dense(vector, hits)
+        if dense is not None:
+            scores += self.dense_weight * _minmax(dense)
+
+        order = np.argsort(-scores, kind="stable")
+        return [replace(hits[i], score=float(scores[i])) for i in order]
+
+
+def select_adaptive(ranked, max_k=4, max_context_tokens=2500, min_relative_score=0.6):
+    """
+    Chọn số tài liệu theo điểm rerank (adaptive k): lấy tài liệu tốt nhất, rồi thêm các tài liệu có điểm
+    >= min_relative_score * điểm cao nhất, tối đa max_k tài liệu và không vượt quá max_context_tokens.
+    Returns:
+        list: Các tài liệu được chọn.
+    """
+    selected = []
+    current_tokens = 0
+    if not ranked:
+        return selected
+    cutoff = ranked[0].score * min_relative_score
+    for hit in ranked:
+        if len(selected) >= max_k or (selected and hit.score < cutoff):
+            break
+        snippet_tokens = document_tokens(hit)
+        # Tài liệu quá dài thì bỏ qua, thử tài liệu tiếp theo
+        if current_tokens + snippet_tokens > max_context_tokens:
+            continue
+        selected.append(hit)
+        current_tokens += snippet_tokens
+    return selected
@@ -0,0 +1,390 @@
+import os
+import re
+import json
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from typing import List, Optional
+import numpy as np
+
+# Chỉ lấy các trường cần cho prompt (không kéo theo embedding 384 chiều và trường text trùng lặp)
+SOURCE_FIELDS = ["title", "content", "link", "token_count"]
+# Khi rerank cần đặc trưng dense thì lấy thêm embedding của tài liệu
+SOURCE_FIELDS_WITH_EMBEDDING = SOURCE_FIELDS + ["embedding"]
+# Chỉ giữ các phần cần đọc trong response (bỏ _index, _shards, took, ...)
+SEARCH_FILTER_PATH = ["hits.hits._id", "hits.hits._score", "hits.hits._source", "hits.hits.highlight"]
+MSEARCH_FILTER_PATH = [
+    "responses.hits.hits._id", "responses.hits.hits._score", "responses.hits.hits._source",
+    "responses.hits.hits.highlight", "responses.error",
+]
+
+HIGHLIGHT = {
+    "fields": {
+        "text": {
+            "pre_tags": ["<mark>"],
+            "post_tags": ["</mark>"]
+        }
+    }
+}
+
+
+@dataclass(slots=True)
+class Hit:
+    """
+    Tài liệu tìm được (gọn, có kiểu) dùng chung cho rerank, rút gọn context, build_messages và cache câu trả lời.
+    """
+    id: str
+    score: float
+    title: str
+    content: str
+    link: str
+    token_count: Optional[int] = None
+    # Các đoạn highlight của trường text (chỉ khi truy vấn có yêu cầu highlight)
+    highlight: Optional[List[str]] = None
+    # Embedding của tài liệu (InMemoryRetriever luôn có; Elasticsearch chỉ trả về khi bật embeddings, ví dụ RERANK)
+    embedding: Optional[np.ndarray] = None
+
+    def to_es_hit(self):
+        """
+        Dạng hit của Elasticsearch (_id, _score, _source) như search_results của /chat trước đây,
+        không kèm highlight/embedding.
+        """
+        source = {"title": self.title, "content": self.content, "link": self.link}
+        if self.token_count is not None:
+            source["token_count"] = self.token_count
+        return {"_id": self.id, "_score": self.score, "_source": source}
+
+    @classmethod
+    def from_es(cls, hit):
+        source = hit.get("_source") or {}
+        embedding = source.get("embedding")
+        return cls(
+            id=hit["_id"],
+            score=hit.get("_score") or 0.0,
+            title=source.get("title", ""),
+            content=source.get("content", ""),
+            link=source.get("link", ""),
+            token_count=source.get("token_count"),
+            highlight=(hit.get("highlight") or {}).get("text"),
+            embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+        )
+
+
+def _hits(res):
+    return [Hit.from_es(hit) for hit in (res.get("hits") or {}).get("hits", [])]
+
+
+def _text_match_clauses(query):
+    """
+    Các mệnh đề BM25 trên trường text: (must, should).
+    """
+    must = {
+        "match": {
+            "text": {
+                "query": query,
+                "operator": "or",
+                "minimum_should_match": "60%"
+            }
+        }
+    }
+    should = {
+        "match": {
+            "text": {
+                "query": query,
+                "operator": "or",
+                "fuzziness": "AUTO"
+            }
+        }
+    }
+    return must, should
+
+
+def build_search_query(query, vector, top_k=2, highlight=False, source_fields=SOURCE_FIELDS):
+    """
+    Xây dựng truy vấn Elasticsearch (kết hợp match và cosineSimilarity).
+    Args:
+        query (str): Câu truy vấn (đã chuyển chữ thường).
+        vector (list): Embedding của câu truy vấn.
+        top_k (int): Số lượng tài liệu tối đa trả về.
+        highlight (bool): Có lấy highlight của trường text không (dùng khi rút gọn context).
+        source_fields (list): Các trường _source cần lấy.
+    Returns:
+        dict: Body của truy vấn.
+    """
+    must, should = _text_match_clauses(query)
+    body = {
+        "size": top_k,
+        "_source": source_fields,
+        "query": {
+            "bool": {
+                "must": [must],
+                "should": [
+                    should,
+                    {
+                        "script_score": {
+                            "query": {"match_all": {}},
+                            "script": {
+                                "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+                                "params": {"query_vector": vector}
+                            }
+                        }
+                    }
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+    if highlight:
+        body["highlight"] = HIGHLIGHT
+    return body
+
+
+def fuse_rrf(hit_lists, rank_constant=60):
+    """
+    Hợp nhất nhiều danh sách kết quả bằng reciprocal-rank fusion: score = Σ 1 / (k + rank).
+    Args:
+        hit_lists (list): Các danh sách hit (đã sắp xếp theo thứ hạng).
+        rank_constant (int): Hằng số k của RRF.
+    Returns:
+        list: Danh sách Hit (với score là điểm RRF), sắp xếp giảm dần.
+    """
+    fused = {}
+    for hits in hit_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.get(hit.id)
+            if entry is None:
+                entry = fused[hit.id] = replace(hit, score=0.0)
+            elif entry.highlight is None:
+                entry.highlight = hit.highlight
+            entry.score += 1.0 / (rank_constant + rank)
+    return sorted(fused.values(), key=lambda hit: hit.score, reverse=True)
+
+
+class Retriever(ABC):
+    """
+    Giao diện truy xuất tài liệu. Kết quả là danh sách Hit để dùng chung select_documents/build_messages.
+    """
+
+    @abstractmethod
+    def search(self, query, vector, top_k=2, mode=None):
+        """
+        Tìm tài liệu cho câu hỏi.
+        Args:
+            query (str): Câu truy vấn.
+            vector (list): Embedding của câu truy vấn.
+            top_k (int): Số tài liệu tối đa trả về.
+            mode (str): Cách tìm kiếm (mặc định theo cấu hình của retriever).
+        Returns:
+            list[Hit]: Kết quả theo điểm giảm dần.
+        """
+
+    @abstractmethod
+    async def search_async(self, query, vector, top_k=2, mode=None):
+        """
+        Như search, không chặn event loop.
+        """
+
+
+class ElasticsearchRetriever(Retriever):
+    """
+    Truy xuất bằng Elasticsearch.
+    mode "script_score": cosine brute-force trên mọi tài liệu (như cũ).
+    mode "knn_hybrid": kNN HNSW + BM25 trong một msearch, hợp nhất bằng RRF.
+    """
+
+    def __init__(self, es, async_es, index_name, knn_index_name, mode="script_score",
+                 num_candidates=50, rank_constant=60, window_size=10, highlight=False, embeddings=False):
+        self.es = es
+        self.async_es = async_es
+        self.index_name = index_name
+        self.knn_index_name = knn_index_name
+        self.mode = mode
+        self.num_candidates = num_candidates
+        self.rank_constant = rank_constant
+        self.window_size = window_size
+        self.highlight = highlight
+        self.source_fields = SOURCE_FIELDS_WITH_EMBEDDING if embeddings else SOURCE_FIELDS
+
+    def build_hybrid_searches(self, query, vector, top_k=2):
+        """
+        Xây dựng 2 truy vấn cho msearch: kNN trên dense_vector (HNSW) và BM25 trên text.
+        Returns:
+            list: Danh sách header/body cho msearch.
+        """
+        window = max(top_k, self.window_size)
+        must, should = _text_match_clauses(query)
+        knn_body = {
+            "size": window,
+            "_source": self.source_fields,
+            "knn": {
+                "field": "embedding",
+                "query_vector": vector,
+                "k": window,
+                "num_candidates": max(self.num_candidates, window),
+            },
+        }
+        bm25_body = {
+            "size": window,
+            "_source": self.source_fields,
+            "query": {"bool": {"must": [must], "should": [should]}},
+        }
+        if self.highlight:
+            bm25_body["highlight"] = HIGHLIGHT
+        header = {"index": self.knn_index_name}
+        return [header, knn_body, header, bm25_body]
+
+    def _fuse_msearch(self, res):
+        hit_lists = []
+        for response in res["responses"]:
+            if "error" in response:
+                raise RuntimeError(response["error"])
+            hit_lists.append(_hits(response))
+        return fuse_rrf(hit_lists, self.rank_constant)
+
+    def search(self, query, vector, top_k=2, mode=None):
+        mode = mode or self.mode
+        if mode == "knn_hybrid":
+            res = self.es.msearch(
+                searches=self.build_hybrid_searches(query, vector, top_k), filter_path=MSEARCH_FILTER_PATH
+            )
+            return self._fuse_msearch(res)
+        res = self.es.search(
+            index=self.index_name, body=build_search_query(query, vector, top_k, self.highlight, self.source_fields),
+            filter_path=SEARCH_FILTER_PATH,
+        )
+        return _hits(res)
+
+    async def search_async(self, query, vector, top_k=2, mode=None):
+        mode = mode or self.mode
+        if mode == "knn_hybrid":
+            res = await self.async_es.msearch(
+                searches=self.build_hybrid_searches(query, vector, top_k), filter_path=MSEARCH_FILTER_PATH
+            )
+            return self._fuse_msearch(res)
+        res = await self.async_es.search(
+            index=self.index_name, body=build_search_query(query, vector, top_k, self.highlight, self.source_fields),
+            filter_path=SEARCH_FILTER_PATH,
+        )
+        return _hits(res)
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class InMemoryRetriever(Retriever):
+    """
+    Truy xuất trong tiến trình từ snapshot xuất ra từ Elasticsearch (xem export_snapshot.py):
+    - embeddings.f32: ma trận float32 (đã chuẩn hóa) được memory-map, cosine top-k bằng NumPy.
+    - docs.jsonl: _id và _source (không có embedding) của từng tài liệu, nạp thành Hit.
+    - BM25 trên trường text bằng inverted index dựng lúc nạp.
+    Hai danh sách được hợp nhất bằng RRF (tham số mode bị bỏ qua).
+    """
+
+    def __init__(self, snapshot_dir, rank_constant=60, window_size=10, k1=1.2, b=0.75):
+        self.snapshot_dir = snapshot_dir
+        self.rank_constant = rank_constant
+        self.window_size = window_size
+        self.k1 = k1
+        self.b = b
+
+        with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.matrix = np.memmap(
+            os.path.join(snapshot_dir, "embeddings.f32"),
+            dtype=np.float32, mode="r", shape=(meta["count"], meta["dimensions"]),
+        )
+        raw_docs = []
+        with open(os.path.join(snapshot_dir, "docs.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                raw_docs.append(json.loads(line))
+        self._build_bm25(raw_docs)
+        # Chỉ giữ các trường cần cho prompt (trường text chỉ dùng để dựng BM25)
+        self.docs = [Hit.from_es(doc) for doc in raw_docs]
+        print(f"✅ Nạp snapshot {snapshot_dir}: {len(self.docs)} tài liệu, {meta['dimensions']} chiều")
+
+    def _build_bm25(self, docs):
+        postings = {}
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        for doc_id, doc in enumerate(docs):
+            source = doc["_source"]
+            terms = tokenize(source.get("text") or f"{source.get('title', '')} {source.get('content', '')}")
+            lengths[doc_id] = len(terms)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        count = len(docs)
+        self.doc_lengths = lengths
+        self.avg_length = float(lengths.mean()) if count else 0.0
+        self.postings = {}
+        for term, (doc_ids, tfs) in postings.items():
+            df = len(doc_ids)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            self.postings[term] = (np.array(doc_ids, dtype=np.int32), np.array(tfs, dtype=np.float32), idf)
+
+    def _top_k(self, scores, k, positive_only=False):
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if positive_only:
+            top = top[scores[top] > 0]
+        return [replace(self.docs[i], score=float(scores[i]), embedding=self.matrix[i]) for i in top]
+
+    def dense_search(self, vector, k):
+        query_vector = np.asarray(vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) + 1e-12)
+        return self._top_k(self.matrix @ query_vector, k)
+
+    def bm25_search(self, query, k):
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (self.avg_length or 1.0))
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            doc_ids, tfs, idf = posting
+            scores[doc_ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[doc_ids])
+        return self._top_k(scores, k, positive_only=True)
+
+    def search(self, query, vector, top_k=2, mode=None):
+        window = max(top_k, self.window_size)
+        return fuse_rrf([self.dense_search(vector, window), self.bm25_search(query, window)], self.rank_constant)
+
+    async def search_async(self, query, vector, top_k=2, mode=None):
+        # Corpus nằm trong RAM, tìm kiếm chỉ mất dưới 1ms nên chạy trực tiếp trên event loop
+        return self.search(query, vector, top_k, mode)
+
+
+def export_snapshot(es, index_name, out_dir, batch_size=500):
+    """
+    Xuất toàn bộ index Elasticsearch thành snapshot cho InMemoryRetriever.
+    """
+    from elasticsearch.helpers import scan
+
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    dimensions = None
+    with open(os.path.join(out_dir, "docs.jsonl"), "w", encoding="utf-8") as docs_file, \
+            open(os.path.join(out_dir, "embeddings.f32"), "wb") as vectors_file:
+        for hit in scan(es, index=index_name, query={"query": {"match_all": {}}}, size=batch_size):
+            source = dict(hit["_source"])
+            vector = np.asarray(source.pop("embedding"), dtype=np.float32)
+            if dimensions is None:
+                dimensions = vector.shape[0]
+            vectors_file.write((vector / (np.linalg.norm(vector) + 1e-12)).tobytes())
+            docs_file.write(json.dumps({"_id": hit["_id"], "_source": source}, ensure_ascii=False) + "\n")
+            count += 1
+
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"index": index_name, "count": count, "dimensions": dimensions or 0}, f)
+    return count
@@ -0,0 +1,158 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from context_assembler import count_tokens
+
+
+SUMMARY_HEADER = "Tóm tắt phần trước của cuộc hội thoại:\n"
+MAX_PENDING_MESSAGES = 20
+
+
+class Session:
+    __slots__ = ("messages", "tokens", "summary", "summary_tokens", "pending", "summarizing", "updated_at")
+
+    def __init__(self):
+        self.messages = deque()  # dict {"role", "content", "tokens"}
+        self.tokens = 0
+        self.summary = None
+        self.summary_tokens = 0
+        # Tin nhắn đã ra khỏi cửa sổ nhưng chưa được gộp vào tóm tắt
+        self.pending = deque(maxlen=MAX_PENDING_MESSAGES)
+        self.summarizing = False
+        self.updated_at = time.time()
+
+
+class SessionStore:
+    """
+    Lưu history hội thoại phía server theo session_id (LRU, giới hạn số session).
+    Số token của mỗi tin nhắn được đếm một lần khi thêm vào; mỗi session chỉ giữ các tin nhắn
+    gần nhất còn nằm trong ngân sách history (max_history_messages, max_history_tokens),
+    nên chi phí mỗi lượt không tăng theo độ dài cuộc hội thoại.
+
+    Nếu có summarize, các tin nhắn bị đẩy ra khỏi cửa sổ được gộp (bất đồng bộ, sau khi đã trả lời)
+    vào một bản tóm tắt cuốn chiếu của session; bản tóm tắt đứng trước các tin nhắn gần nhất trong history.
+    """
+
+    def __init__(self, max_sessions=10000, max_history_tokens=1000, max_history_messages=5, summarize=None):
+        """
+        Args:
+            summarize: Hàm async (tóm tắt cũ hoặc None, danh sách tin nhắn) -> tóm tắt mới.
+        """
+        self.max_sessions = max_sessions
+        self.max_history_tokens = max_history_tokens
+        self.max_history_messages = max_history_messages
+        self.summarize = summarize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+        self.created = 0
+        self.evicted = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def _get(self, session_id, create=False):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        elif create:
+            session = Session()
+            self._sessions[session_id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+
+    def history(self, session_id):
+        """
+        Các tin nhắn gần nhất của session (kèm số token đã đếm sẵn), rỗng nếu session chưa có.
+        Bản tóm tắt (nếu có) là tin nhắn system đứng đầu.
+        """
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return []
+            history = list(session.messages)
+            if session.summary:
+                history.insert(0, {
+                    "role": "system",
+                    "content": f"{SUMMARY_HEADER}{session.summary}",
+                    "tokens": session.summary_tokens,
+                })
+            return history
+
+    def append(self, session_id, role, content):
+        message = {"role": role, "content": content, "tokens": count_tokens(content)}
+        with self._lock:
+            session = self._get(session_id, create=True)
+            session.messages.append(message)
+            session.tokens += message["tokens"]
+            session.updated_at = time.time()
+            # Bỏ các tin nhắn cũ nằm ngoài ngân sách (tin nhắn cũ nhất còn lại có thể bị cắt bớt lúc ghép prompt)
+            while session.messages and (
+                len(session.messages) > self.max_history_messages
+                or session.tokens - session.messages[0]["tokens"] >= self.max_history_tokens
+            ):
+                dropped = session.messages.popleft()
+                session.tokens -= dropped["tokens"]
+                if self.summarize:
+                    session.pending.append(dropped)
+
+    def schedule_compaction(self, session_id):
+        """
+        Gộp các tin nhắn đã ra khỏi cửa sổ vào bản tóm tắt ở một task nền (không nằm trên đường trả lời).
+        """
+        if not self.summarize:
+            return
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.summarizing or not session.pending:
+                return
+            session.summarizing = True
+        task = asyncio.ensure_future(self._compact(session_id, session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session_id, session):
+        with self._lock:
+            summary, pending = session.summary, list(session.pending)
+            session.pending.clear()
+        try:
+            new_summary = await self.summarize(summary, pending)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi tóm tắt history: {str(e)}")
+            with self._lock:
+                # Trả lại các tin nhắn để lần sau tóm tắt tiếp
+                session.pending = deque(pending + list(session.pending), maxlen=MAX_PENDING_MESSAGES)
+                session.summarizing = False
+                self.summary_errors += 1
+            return
+
+        summary_tokens = count_tokens(new_summary)
+        with self._lock:
+            session.summary = new_summary
+            session.summary_tokens = summary_tokens
+            session.summarizing = False
+            self.summaries += 1
+            more = bool(session.pending)
+        if more:
+            # Có thêm tin nhắn bị đẩy ra trong lúc đang tóm tắt
+            self.schedule_compaction(session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "evicted": self.evicted,
+                "summaries": self.summaries,
+                "summary_errors": self.summary_errors,
+                "summarizing": len(self._tasks),
+            }
@@ -0,0 +1,101 @@
+import json
+import time
+import asyncio
+import hashlib
+from metrics import Trace, start_trace, merge_trace, observe
+
+
+def fingerprint(*parts):
+    """
+    Khóa ổn định cho các tham số của một lần gọi (câu hỏi đã chuẩn hóa, history, model, ...).
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi trùng khóa đang chạy đồng thời: lời gọi đầu tiên thực thi,
+    các lời gọi đến sau chờ và nhận cùng kết quả (hoặc cùng exception).
+    Hủy một request đang chờ không hủy phần việc dùng chung của các request khác;
+    khi mọi request chờ đều đã bị hủy (hết hạn, client ngắt kết nối) thì phần việc chung cũng bị hủy
+    (các lời gọi HTTP đang chạy tới Elasticsearch/embedding/LLM bị hủy theo).
+    Phần việc chung ghi span vào trace riêng, trace này được chép vào trace của mọi request chờ;
+    request đến sau ghi thêm span "<name>_coalesced" (thời gian chờ kết quả dùng chung).
+    """
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self._inflight = {}  # key -> [task, số request đang chờ, trace của phần việc chung]
+
+        self.executions = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key, fn):
+        """
+        Args:
+            key: Khóa của lời gọi.
+            fn: Hàm không tham số trả về coroutine thực hiện lời gọi.
+        """
+        if not self.enabled:
+            return await fn()
+
+        start = time.perf_counter()
+        entry = self._inflight.get(key)
+        coalesced = entry is not None
+        if coalesced:
+            self.coalesced += 1
+            entry[1] += 1
+        else:
+            self.executions += 1
+            trace = Trace()
+            task = asyncio.ensure_future(self._run(fn, trace))
+            entry = self._inflight[key] = [task, 1, trace]
+            task.add_done_callback(lambda t: self._done(key, t))
+        task = entry[0]
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                # Request đến sau sẽ chạy lại từ đầu thay vì chờ task đang bị hủy
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                self.cancelled += 1
+                task.cancel()
+            raise
+        except Exception:
+            self._record(entry[2], coalesced, start)
+            raise
+        self._record(entry[2], coalesced, start)
+        return result
+
+    @staticmethod
+    async def _run(fn, trace):
+        start_trace(trace)
+        return await fn()
+
+    def _record(self, trace, coalesced, start):
+        merge_trace(trace)
+        if coalesced:
+            observe(f"{self.name}_coalesced", time.perf_counter() - start)
+
+    def _done(self, key, task):
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        # Đánh dấu exception đã được lấy (khi mọi request chờ đều đã bị hủy)
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        total = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "coalescing_ratio": self.coalesced / total if total else 0.0,
+            "in_flight": len(self._inflight),
+        }
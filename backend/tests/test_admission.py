@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from admission import AdmissionController, Overloaded
+
+
+def test_admits_up_to_max_concurrent():
+    async def run():
+        controller = AdmissionController(max_concurrent=2, max_queue=2, queue_timeout=1.0)
+        releases = [await controller.acquire(), await controller.acquire()]
+        stats = controller.stats()
+        for release in releases:
+            release()
+        return controller, stats
+
+    controller, stats = asyncio.run(run())
+    assert stats["in_flight"] == 2
+    assert controller.stats()["in_flight"] == 0
+    assert controller.admitted == 2
+
+
+def test_waiter_admitted_after_release():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1.0)
+        release = await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0.01)
+        waiting = controller.waiting
+        release()
+        (await waiter)()
+        return controller, waiting
+
+    controller, waiting = asyncio.run(run())
+    assert waiting == 1
+    assert controller.admitted == 2
+    assert controller.waiting == 0 and controller.in_flight == 0
+
+
+def test_full_queue_rejects_with_429():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1.0)
+        release = await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0.01)
+        try:
+            await controller.acquire()
+        finally:
+            release()
+            (await waiter)()
+
+    with pytest.raises(Overloaded) as info:
+        asyncio.run(run())
+    assert info.value.status_code == 429
+    assert info.value.reason == "queue_full"
+    assert info.value.retry_after >= 1
+
+
+def test_queue_timeout_rejects_with_503():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.02)
+        release = await controller.acquire()
+        try:
+            await controller.acquire()
+        except Overloaded as e:
+            return controller, e
+        finally:
+            release()
+
+    controller, error = asyncio.run(run())
+    assert error.status_code == 503
+    assert error.reason == "queue_timeout"
+    assert controller.rejected_timeout == 1
+    assert controller.waiting == 0
+
+
+def test_release_is_idempotent():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.02)
+        release = await controller.acquire()
+        release()
+        release()
+        # Semaphore chỉ được nhả một lần: lượt thứ hai vẫn phải chờ
+        first = await controller.acquire()
+        try:
+            await controller.acquire()
+        except Overloaded as e:
+            return controller, e
+        finally:
+            first()
+
+    controller, error = asyncio.run(run())
+    assert error.reason == "queue_timeout"
+    assert controller.stats()["in_flight"] == 0
@@ -0,0 +1,62 @@
+import numpy as np
+from dedupe import NearDuplicateFilter, shingles, _choose_bands
+
+
+def jaccard(a, b, size=3):
+    a, b = shingles(a, size), shingles(b, size)
+    return len(a & b) / len(a | b)
+
+
+def make_pair(rng, vocab, length=200, edits=5):
+    words = list(rng.choice(vocab, size=length))
+    variant = list(words)
+    for position in rng.choice(length, size=edits, replace=False):
+        variant[position] = f"sua{position}"
+    return " ".join(words), " ".join(variant)
+
+
+def test_lsh_threshold_below_configured_threshold():
+    for threshold in (0.7, 0.8, 0.9):
+        bands, rows = _choose_bands(128, threshold)
+        assert bands * rows <= 128
+        assert (1 / bands) ** (1 / rows) < threshold
+
+
+def test_recall_above_threshold():
+    # Các cặp có Jaccard thật khoảng 0.82-0.9 (ngay trên ngưỡng 0.8)
+    rng = np.random.default_rng(0)
+    vocab = np.array([f"tu{i}" for i in range(5000)])
+    detected = 0
+    pairs = 0
+    for i in range(200):
+        original, variant = make_pair(rng, vocab, edits=int(rng.integers(4, 8)))
+        if jaccard(original, variant) < 0.82:
+            continue
+        pairs += 1
+        near_duplicates = NearDuplicateFilter(threshold=0.8)
+        kept = list(near_duplicates.filter([original, variant], lambda doc: doc[:20], lambda doc: doc))
+        detected += len(kept) == 1
+    assert pairs >= 150
+    assert detected / pairs >= 0.9
+
+
+def test_unrelated_documents_kept():
+    rng = np.random.default_rng(1)
+    vocab = np.array([f"tu{i}" for i in range(5000)])
+    documents = [" ".join(rng.choice(vocab, size=200)) for _ in range(100)]
+    near_duplicates = NearDuplicateFilter(threshold=0.8)
+    kept = list(near_duplicates.filter(documents, lambda doc: doc[:20], lambda doc: doc))
+    assert len(kept) == 100
+    assert near_duplicates.duplicates == 0
+
+
+def test_dropped_documents_reported():
+    rng = np.random.default_rng(2)
+    vocab = np.array([f"tu{i}" for i in range(5000)])
+    original, variant = make_pair(rng, vocab, edits=2)
+    dropped = []
+    near_duplicates = NearDuplicateFilter(threshold=0.8)
+    kept = list(near_duplicates.filter([original, variant], lambda doc: doc[:20], lambda doc: doc,
+                                       on_duplicate=dropped.append))
+    assert kept == [original]
+    assert dropped == [variant]
@@ -0,0 +1,185 @@
+import time
+import asyncio
+import pytest
+from model_router import CircuitBreaker, ModelRouter
+
+
+def make_router(**kwargs):
+    options = dict(fallback_models=["backup"], hedge_after=0.05, failure_threshold=2, cooldown=60.0)
+    options.update(kwargs)
+    return ModelRouter(["primary", "backup"], **options)
+
+
+def fake_llm(delays, failing=()):
+    calls = []
+
+    async def make_call(model):
+        calls.append(model)
+        await asyncio.sleep(delays.get(model, 0))
+        if model in failing:
+            raise RuntimeError(f"{model} lỗi")
+        return f"trả lời từ {model}"
+
+    return make_call, calls
+
+
+def test_breaker_opens_then_half_open_then_closes():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60.0)
+    breaker.record(False)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # Hết cooldown: chỉ một lời gọi thử được đi qua
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_breaker_failed_probe_reopens_and_slow_call_counts_as_failure():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60.0, slow_seconds=1.0)
+    breaker.record(True, 5.0)
+    assert breaker.state == "open"
+
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_breaker_release_frees_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.0)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_hedge_wins_when_primary_is_slow():
+    async def run():
+        router = make_router()
+        make_call, calls = fake_llm({"primary": 1.0, "backup": 0.01})
+        result, answered = await router.call("primary", make_call, kind="stream")
+        return router, result, answered, calls
+
+    router, result, answered, calls = asyncio.run(run())
+    assert (result, answered) == ("trả lời từ backup", "backup")
+    assert calls == ["primary", "backup"]
+    assert router.hedges == 1 and router.hedge_wins == 1
+    # Lời gọi thua được ghi cận dưới độ trễ và tính là lỗi cho circuit breaker
+    assert router.breakers["primary"].failures == 1
+    assert len(router._latencies[("primary", "stream")]) == 1
+
+
+def test_lost_hedges_open_primary_breaker():
+    async def run():
+        router = make_router()
+        make_call, calls = fake_llm({"primary": 1.0, "backup": 0.01})
+        for _ in range(2):
+            await router.call("primary", make_call, kind="stream")
+        calls.clear()
+        result = await router.call("primary", make_call, kind="stream")
+        return router, result, calls
+
+    router, result, calls = asyncio.run(run())
+    assert router.breakers["primary"].state == "open"
+    assert result == ("trả lời từ backup", "backup")
+    assert calls == ["backup"]
+    assert router.fallbacks == 1
+
+
+def test_backup_losing_races_keeps_breaker_closed():
+    async def run():
+        router = make_router(failure_threshold=3)
+        make_call, _ = fake_llm({"primary": 0.08, "backup": 1.0})
+        for _ in range(3):
+            assert await router.call("primary", make_call, kind="stream") == ("trả lời từ primary", "primary")
+        assert ("backup", "stream") not in router._latencies
+        # Model chính lỗi nhanh: vẫn còn model dự phòng
+        failing, _ = fake_llm({}, failing={"primary"})
+        result = await router.call("primary", failing, kind="stream")
+        return router, result
+
+    router, result = asyncio.run(run())
+    assert router.hedges == 3 and router.hedge_wins == 0
+    assert router.breakers["backup"].state == "closed"
+    assert router.breakers["backup"].failures == 0
+    assert result == ("trả lời từ backup", "backup")
+
+
+def test_no_hedge_for_kinds_outside_hedge_kinds():
+    async def run():
+        router = make_router()
+        make_call, calls = fake_llm({"primary": 0.15})
+        result = await router.call("primary", make_call, kind="complete")
+        return router, result, calls
+
+    router, result, calls = asyncio.run(run())
+    assert result == ("trả lời từ primary", "primary")
+    assert calls == ["primary"]
+    assert router.hedges == 0
+
+
+def test_fast_failure_falls_back():
+    async def run():
+        router = make_router()
+        make_call, calls = fake_llm({}, failing={"primary"})
+        result = await router.call("primary", make_call, kind="complete")
+        return router, result, calls
+
+    router, result, calls = asyncio.run(run())
+    assert result == ("trả lời từ backup", "backup")
+    assert calls == ["primary", "backup"]
+    assert router.failures == 1 and router.fallbacks == 1
+
+
+def test_all_models_fail_raises_last_error():
+    async def run():
+        router = make_router()
+        make_call, _ = fake_llm({}, failing={"primary", "backup"})
+        await router.call("primary", make_call)
+
+    with pytest.raises(RuntimeError, match="backup lỗi"):
+        asyncio.run(run())
+
+
+def test_losing_call_is_cancelled_not_returned():
+    async def run():
+        router = make_router(hedge_after=0.02)
+        make_call, _ = fake_llm({"primary": 0.05, "backup": 0.05})
+        discarded = []
+
+        async def discard(result):
+            discarded.append(result)
+
+        result = await router.call("primary", make_call, kind="stream", discard=discard)
+        await asyncio.sleep(0.1)
+        return result, discarded
+
+    (result, answered), discarded = asyncio.run(run())
+    # Model dự phòng chưa xong khi model chính trả lời: bị hủy, không có kết quả để đóng
+    assert (result, answered) == ("trả lời từ primary", "primary")
+    assert discarded == []
+
+
+def test_hedge_delay_uses_observed_percentile():
+    router = make_router(hedge_after=None, min_samples=5, hedge_min_delay=0.1, hedge_default_delay=2.0)
+    assert router.hedge_delay("primary", "stream") == 2.0
+    for seconds in (0.2, 0.3, 0.4, 0.5, 1.0):
+        router._observe("primary", "stream", seconds)
+    assert 0.5 < router.hedge_delay("primary", "stream") <= 1.0
+    assert router.hedge_delay("primary", "classify") == 2.0
+
+
+def test_resolve_rejects_unknown_model():
+    router = make_router()
+    assert router.resolve(None) == "primary"
+    with pytest.raises(ValueError):
+        router.resolve("gpt-khong-co")
@@ -0,0 +1,133 @@
+import asyncio
+import pytest
+from single_flight import SingleFlight, fingerprint
+from metrics import start_trace, span
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint("xin chào", [{"role": "user"}]) == fingerprint("xin chào", [{"role": "user"}])
+    assert fingerprint("a", "b") != fingerprint("b", "a")
+
+
+def test_concurrent_calls_share_one_execution():
+    async def run():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "kết quả"
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        return flight, results, calls
+
+    flight, results, calls = asyncio.run(run())
+    assert results == ["kết quả"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["executions"] == 1
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_exception_is_shared():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("lỗi chung")
+
+        return await asyncio.gather(flight.do("k", work), flight.do("k", work), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelling_one_waiter_keeps_shared_work():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "kết quả"
+
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        return flight, first, result
+
+    flight, first, result = asyncio.run(run())
+    assert first.cancelled()
+    assert result == "kết quả"
+    assert flight.cancelled == 0
+
+
+def test_cancelling_all_waiters_cancels_shared_work():
+    async def run():
+        flight = SingleFlight("test")
+        state = {}
+
+        async def work():
+            try:
+                await asyncio.sleep(1.0)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("k", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+        # Request đến sau chạy lại từ đầu
+        async def again():
+            return "mới"
+
+        return flight, state, await flight.do("k", again)
+
+    flight, state, result = asyncio.run(run())
+    assert state.get("cancelled")
+    assert flight.cancelled == 1
+    assert result == "mới"
+    assert flight.stats()["executions"] == 2
+
+
+def test_shared_spans_reach_every_waiter():
+    async def work():
+        with span("test_work"):
+            await asyncio.sleep(0.02)
+        return 1
+
+    async def request(flight, delay):
+        trace = start_trace()
+        await asyncio.sleep(delay)
+        await flight.do("k", work)
+        return trace.spans
+
+    async def run():
+        flight = SingleFlight("test")
+        return await asyncio.gather(request(flight, 0), request(flight, 0.005))
+
+    first, second = asyncio.run(run())
+    assert "test_work" in first and "test_coalesced" not in first
+    assert "test_work" in second and "test_coalesced" in second
+
+
+def test_disabled_runs_every_call():
+    async def run():
+        flight = SingleFlight("test", enabled=False)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(flight.do("k", work), flight.do("k", work))
+        return calls
+
+    assert len(asyncio.run(run())) == 2
@@ -7,12 +7,23 @@ import "react-toastify/dist/ReactToastify.css";
 import "tailwindcss/tailwind.css";
 import "./App.css";
 
+// Mã session gửi lên server (server giữ history của cuộc hội thoại theo mã này)
+const newSessionId = () =>
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 function App() {
   const [query, setQuery] = useState("");
   const [selectedModel, setSelectedModel] = useState("openai/gpt-4.1");
   const [conversations, setConversations] = useState(() => {
     const saved = localStorage.getItem("conversations");
-    return saved ? JSON.parse(saved) : [];
+    // Cuộc hội thoại cũ (lưu trước khi có session) được cấp sessionId mới
+    return saved
+      ? JSON.parse(saved).map((conv) =>
+          conv.sessionId ? conv : { ...conv, sessionId: newSessionId() }
+        )
+      : [];
   });
   const [currentConversationId, setCurrentConversationId] = useState(null);
   const [searchTerm, setSearchTerm] = useState("");
@@ -39,6 +50,7 @@ function App() {
       : 1;
     const newConversation = {
       id: newId,
+      sessionId: newSessionId(),
       title: `Cuộc hội thoại ${newId}`,
       messages: [
         {
@@ -130,6 +142,44 @@ function App() {
     conv.title.toLowerCase().includes(searchTerm.toLowerCase())
   );
 
+  // Gọi /chat/stream và đọc các sự kiện Server-Sent Events
+  const readChatStream = async (body, onEvent) => {
+    const response = await fetch(
+      `${process.env.REACT_APP_SERVER_URL}/chat/stream`,
+      // `http://localhost:8000/chat/stream`
+      {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body),
+      }
+    );
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder("utf-8");
+    let buffer = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        let event = "message";
+        let data = "";
+        frame.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        });
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!query.trim()) return;
@@ -151,61 +201,87 @@ function App() {
     setConversations(updatedConversations);
     setQuery("");
 
-    try {
-      const history = currentConversation.messages.map((msg) => ({
-        role: msg.role,
-        content: msg.content,
-      }));
-      // console.log(process.env.REACT_APP_SERVER_URL);
-      // console.log(`${process.env.REACT_APP_SERVER_URL}/chat`);
-      const response = await axios.post(
-        `${process.env.REACT_APP_SERVER_URL}/chat`
-        // `http://localhost:8000/chat`
-        ,
-        {
-          query,
-          history,
-        }
+    // Cập nhật (hoặc thêm mới) tin nhắn bot đang được stream
+    const updateStreamingMessage = (content, extra = {}) => {
+      setConversations((prev) =>
+        prev.map((conv) => {
+          if (conv.id !== currentConversationId) return conv;
+          const messages = [...conv.messages];
+          const last = messages[messages.length - 1];
+          if (last && last.streaming) {
+            messages[messages.length - 1] = { ...last, content, ...extra };
+          } else {
+            messages.push({
+              role: "assistant",
+              content,
+              isNew: true,
+              streaming: true,
+              ...extra,
+            });
+          }
+          return { ...conv, messages, isLoading: false };
+        })
       );
+    };
 
-      if (response.data.error) {
-        toast.error(response.data.response);
-        setConversations((prev) =>
-          prev.map((conv) =>
-            conv.id === currentConversationId
-              ? { ...conv, isLoading: false }
-              : conv
-          )
-        );
-        return;
-      }
-
-      const botMessage = {
-        role: "assistant",
-        content: response.data.response,
-        isNew: true,
-      };
+    const removeStreamingMessage = () => {
       setConversations((prev) =>
         prev.map((conv) =>
           conv.id === currentConversationId
             ? {
                 ...conv,
-                messages: [...conv.messages, botMessage],
+                messages: conv.messages.filter((m) => !m.streaming),
                 isLoading: false,
               }
             : conv
         )
       );
+    };
+
+    try {
+      let streamedContent = "";
+      let sources = [];
+      let finished = false;
+      let streamError = null;
+
+      // Model gửi kèm từng request (không đổi model chung của server)
+      const body = {
+        query,
+        session_id: currentConversation.sessionId,
+        model: selectedModel,
+      };
+      await readChatStream(body, (event, data) => {
+        if (event === "sources") {
+          sources = data;
+        } else if (event === "token") {
+          streamedContent += data.content;
+          updateStreamingMessage(streamedContent, { sources });
+        } else if (event === "done") {
+          finished = true;
+          updateStreamingMessage(data.response, { sources, streaming: false });
+        } else if (event === "error") {
+          streamError = data.response;
+        }
+      });
+
+      if (streamError) {
+        toast.error(streamError);
+        removeStreamingMessage();
+        return;
+      }
+
+      if (!finished) {
+        // Stream bị ngắt giữa chừng: giữ phần đã nhận được
+        if (streamedContent) {
+          updateStreamingMessage(streamedContent, { sources, streaming: false });
+        } else {
+          throw new Error("Stream kết thúc mà không có dữ liệu");
+        }
+      }
     } catch (error) {
       console.error("Error:", error);
       toast.error("Có lỗi xảy ra khi gửi câu hỏi!");
-      setConversations((prev) =>
-        prev.map((conv) =>
-          conv.id === currentConversationId
-            ? { ...conv, isLoading: false }
-            : conv
-        )
-      );
+      removeStreamingMessage();
     }
   };
 
@@ -217,6 +293,13 @@ function App() {
   };
 
   const deleteConversation = (id) => {
+    const deleted = conversations.find((conv) => conv.id === id);
+    if (deleted && deleted.sessionId) {
+      // Xóa history phía server, không cần chờ kết quả
+      axios
+        .delete(`${process.env.REACT_APP_SERVER_URL}/sessions/${deleted.sessionId}`)
+        .catch(() => {});
+    }
     const updatedConversations = conversations.filter((conv) => conv.id !== id);
     setConversations(updatedConversations);
     if (currentConversationId === id) {
@@ -306,22 +389,10 @@ function App() {
     setQuery(placeQuery);
     handleSubmit({ preventDefault: () => {} });
   };
-  const handleChangeModel = async (e) => {
+  const handleChangeModel = (e) => {
     const newModel = e.target.value;
     setSelectedModel(newModel);
-    try {
-      await axios.post(
-        `${process.env.REACT_APP_SERVER_URL}/set_model`
-        // `http://localhost:8000/set_model`
-        ,
-        {
-          model_name: newModel,
-        }
-      );
-      toast.success(`Đã đổi model thành ${newModel}`);
-    } catch (err) {
-      toast.error("Đổi model thất bại!");
-    }
+    toast.success(`Đã đổi model thành ${newModel}`);
   };
   return (
     <div